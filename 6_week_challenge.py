@@ -1,389 +1,350 @@
+import os
+import sys
 import time
 import roslibpy
-import pygame
-from lights_function import play_lights
+from bridge import connect
+from lights_function import get_lightring, release_lightring
+from audio_sequencer import AudioSequencer
+from led_controller import LedController
 import threading
+from cmd_vel import TwistPublisher
+from cmd_mux import CmdVelMux
+from subscriptions import SubscriptionManager
+from joystick_events import JoystickEvents, QueuedInput
+from ir_buffer import IrRingBuffer, IrZoneClassifier, IrFilter, ZONE_LABELS
+from flight_log import FlightRecorder
+from loop_timing import LOOPS, loop_timer, install_dump_signal
 import math
-
-# Initialize pygame and joystick control
-pygame.init()
-pygame.joystick.init()
-if pygame.joystick.get_count() == 0:
-    print("No joystick detected. Please connect a joystick and restart.")
-    exit(1)
-
-# Connect to the ROS bridge
-ros_node = roslibpy.Ros(host='192.168.8.104', port=9012)
-ros_node.run()
+from pose_estimator import PoseEstimator
+from motion import MotionEngine, DriveStraight, Turn, FollowPath
+from velocity_profile import TeleopShaper
+from coverage_plan import CoveragePlan, CoverageMeter, field_ahead
+from occupancy_grid import OccupancyGrid
+from controller_core import (IR_THRESHOLDS, IR_ACTIONS, DRIVE_SPEED, DRIVE_TOLERANCE, TURN_RATE, TURN_TOLERANCE,
+                             PRIMITIVE_TIMEOUT, MOW_LENGTH, MOW_WIDTH, TOOL_WIDTH, CMD_RATE, RobotModes, ir_override)
+
+# ROS bridge connection, opened by the first topic that uses it and reopened with backoff
+# after a drop. ROSBRIDGE_HOST/ROSBRIDGE_PORT select another bridge (e.g. fake_rosbridge.py).
+# pygame is only started by a JoystickEvents, so importing this module connects nothing.
+ros_node = connect()
 
 robot_name = 'foxtrot'
 
-# Joystick class
-class Joystick:
-    def __init__(self):
-        self.joystick = pygame.joystick.Joystick(0)
-        self.joystick.init()
-        self.stop_event = threading.Event()
+# Path of a flight log (odom, ir_intensity, cmd_vel) to record, unset to disable
+RECORD_LOG = os.environ.get('RECORD_LOG')
 
-        # State variables
-        self.manual_mode = False
-        self.idle_mode = True
-        self.autonomous_mode = False
-        self.armed = False
-        self.linear_x = 0.0
-        self.angular_z = 0.0
-        self.color = 'Off'
+# Joystick class, the mode flags and their rules come from RobotModes
+class Joystick(RobotModes):
+    def __init__(self, events=None):
+        # events: any InputEvents, by default the pygame joystick 0
+        super().__init__()
+        self.events = JoystickEvents(0) if events is None else events  # debounced button/axis snapshots
+        self.stop_event = threading.Event()
         self.blink = False
 
+        # Mode change notification, the version is bumped on every toggle
+        self.mode_changed = threading.Condition()
+        self.mode_version = 0
+        self.changed_at = None  # time.perf_counter() when the press behind the last change was read
+        self.on_mode_change = None  # optional function(), called on the joystick thread after each change
+
         # Create and start thread
         self.thread = threading.Thread(target=self.get_commands, daemon=True)
         self.thread.start()
 
     def get_commands(self):
+        timer = loop_timer('joystick')
         while not self.stop_event.is_set():
-            pygame.event.pump()  # Process joystick events
-
-            if self.joystick.get_button(0):  # "A" button
-                self.manual_mode = not self.manual_mode
-                self.idle_mode = False
-                self.autonomous_mode = False
-                print(f"Manual mode {'activated' if self.manual_mode else 'deactivated'}")
-                time.sleep(0.3)  # Debounce delay
-
-            if self.joystick.get_button(2):  # "X" button
-                self.idle_mode = not self.idle_mode
-                self.manual_mode = False
-                self.autonomous_mode = False
-                print(f"Secondary mode {'activated' if self.idle_mode else 'deactivated'}")
-                time.sleep(0.3)
-
-            if self.joystick.get_button(1):  # "B" button
-                self.autonomous_mode = not self.autonomous_mode
-                self.manual_mode = False
-                self.idle_mode = False
-                print(f"Autonomous mode {'activated' if self.autonomous_mode else 'deactivated'}")
-                time.sleep(0.3)
-
-            if self.joystick.get_button(4):  # Left bumper
-                self.armed = not self.armed
-                print(f"Robot {'armed' if self.armed else 'disarmed'}")
-                time.sleep(0.3)
-
-            # Determine movement & LED state
-            if self.manual_mode:
-                self.linear_x = -self.joystick.get_axis(1)  # Invert Y-axis for forward/backward
-                self.angular_z = -self.joystick.get_axis(0)  # X-axis for rotation
-                self.color = 'Green'
-            elif self.idle_mode:
-                self.linear_x = 0.0
-                self.angular_z = 0.0
-                self.color = 'Blue'
-            elif self.autonomous_mode:
-                self.color = 'Yellow'
-
+            self.events.wait()  # sleep until an event arrives, at most WAIT_TIMEOUT
+            timer.begin()
+            pressed = []  # stamps of the presses handled in this iteration
+            # Each press arrives once, debounced by timestamp, so axes keep updating meanwhile
+            for snapshot in self.events.poll():
+                if snapshot.kind == 'button' and self.press(snapshot.name):  # A, X, B or LB
+                    pressed.append(snapshot.stamp)
+
+            # Movement & LED state
+            self.set_axes(self.events.axes[0], self.events.axes[1])
             self.blink = self.armed  # Blink if armed
-            if self.armed == False:
-                self.linear_x = 0
-                self.angular_z = 0
 
-            time.sleep(0.1)  # Loop at 5 Hz
+            if pressed:
+                # Notify once color and blink match the new mode, the LEDs read them on wake-up
+                self.changed_at = pressed[-1]
+                self.notify_mode_change()
+                if self.on_mode_change is not None:
+                    self.on_mode_change()
+                for stamp in pressed:
+                    self.events.latency.record(stamp)  # snapshot stamp -> mode change
+
+            timer.end()
+
+    def notify_mode_change(self):
+        with self.mode_changed:
+            self.mode_version += 1
+            self.mode_changed.notify_all()
+
+    def wait_mode_change(self, version, timeout=None):
+        # Block until the mode moves past `version`, returns the current version
+        with self.mode_changed:
+            self.mode_changed.wait_for(lambda: self.mode_version != version, timeout)
+            return self.mode_version
 
     def stop(self):
         self.stop_event.set()
         self.thread.join()
-        self.joystick.quit()
+        print(f"Joystick input stats: {self.events.stats()}")
+        self.events.close()
 
 # Robot class
 class RobotController:
     def __init__(self, joystick):
         self.joystick = joystick
         self.stop_event = threading.Event()
+        self.subscriptions = SubscriptionManager()
+        self.odom = PoseEstimator()  # odometry fused with the mouse and gyro, read like an OdomState
+        self.motion = MotionEngine(self.odom, self.publish_twist)
+        self.coverage = None  # CoverageMeter of the current mowing plan
+        self.ir_buffer = IrRingBuffer()
+        self.ir_classifier = IrZoneClassifier(IR_THRESHOLDS, IR_ACTIONS)
+        self.ir_filter = IrFilter(self.ir_classifier)  # a lone noisy reading never triggers a turn
+        self.grid = OccupancyGrid()  # obstacles seen by the IR sensors, in the odometry frame
 
         # ROS publishers
-        self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
         self.drive_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
-        self.audio_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_audio', 'irobot_create_msgs/AudioNoteVector')
+        self.cmd_vel = TwistPublisher(self.drive_pub)
+        self.recorder = FlightRecorder(RECORD_LOG) if RECORD_LOG else None
+        if self.recorder is not None:
+            self.cmd_vel.on_publish = self.recorder.record_cmd_vel
+        # Every behavior submits to the mux, it alone publishes cmd_vel (safety > ir > manual > autonomous)
+        self.mux = CmdVelMux(self.cmd_vel, rate=CMD_RATE)
+        self.mux.start()
+        self.teleop = TeleopShaper()  # stick to cmd_vel with limited acceleration and jerk
+        self.audio_player = AudioSequencer(ros_node, robot_name)  # one precomputed message per mode
+        self.led = LedController(get_lightring(ros_node, robot_name))  # publishes only on change, blink edge or keepalive
+        self.led.start()
+        self.joystick.on_mode_change = self.show_mode
+        self.show_mode()
         self.odom_topic = roslibpy.Topic(ros_node, f'/{robot_name}/odom', 'nav_msgs/Odometry')
         self.ir_topic = roslibpy.Topic(ros_node, f'/{robot_name}/ir_intensity', 'irobot_create_msgs/IrIntensityVector')
-        self.odom_topic.subscribe(self.odom_callback)
+        self.mouse_topic = roslibpy.Topic(ros_node, f'/{robot_name}/mouse', 'irobot_create_msgs/Mouse')
+        self.imu_topic = roslibpy.Topic(ros_node, f'/{robot_name}/imu', 'sensor_msgs/Imu')
+        self.subscriptions.attach(self.odom_topic, self.odom_callback)
+        self.subscriptions.attach(self.mouse_topic, self.odom.on_mouse)
+        self.subscriptions.attach(self.imu_topic, self.odom.on_imu)
+        self.subscriptions.attach(self.ir_topic, self.map_ir)  # the map is fed in every mode
 
         # Create and start threads
         self.drive_thread = threading.Thread(target=self.drive, daemon=True)
-        self.led_thread = threading.Thread(target=self.leds, daemon=True)
         self.audio_thread = threading.Thread(target=self.audio, daemon=True)
         self.auto_mow_thread = threading.Thread(target=self.auto_mow, daemon=True)
+        self.mow_watch_thread = threading.Thread(target=self.mow_watch, daemon=True)
         self.sense_ir_thread=threading.Thread(target=self.sense_ir, daemon=True)
         self.drive_thread.start()
-        self.led_thread.start()
         self.audio_thread.start()
         self.auto_mow_thread.start()
+        self.mow_watch_thread.start()
         #self.sense_ir_thread.start()
 
     def odom_callback(self, message): #read odometer data
-        self.latest_odom = {
-            "position": message['pose']['pose']['position'],
-            "orientation": message['pose']['pose']['orientation'],
-            "linear_velocity": message['twist']['twist']['linear'],
-            "angular_velocity": message['twist']['twist']['angular']
-        }
+        if self.recorder is not None:
+            self.recorder.record_odom(message)
+        self.odom.update(message)
+        self.motion.on_odom()  # run the active motion primitive's control step
+        if self.coverage is not None and self.motion.busy:
+            self.coverage.on_odom(self.odom.snapshot())
     
     def get_odom(self):
-        return self.latest_odom
+        return self.odom.snapshot()  # None until the first message
 
     def ir_sensor(self):
         self.sense_ir_thread.start()
-    
+
+    def map_ir(self, message):
+        # Attached from the start, feeds the buffer and the map without steering anything
+        if self.recorder is not None:
+            self.recorder.record_ir(message)
+        self.ir_buffer.push(message['readings'])
+        self.grid.update_ir(self.odom.snapshot(), self.ir_buffer.latest())
+
     def callback_ir(self, message):
-        values = [reading['value'] for reading in message['readings']]
-        front_value = values[3]  # Adjust index based on sensor configuration
-        left_value = values[0]
-        right_value = values[6]
-        left_center= values[2]
-        right_center=values[5]
-        #error = left_value - right_value
-
-        if front_value>10:
-            print('object in FRONT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': -1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-            
-        elif left_center>10:    
-            print('object in FRONT LEFT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': -1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-        elif right_center>10:
-            print('object in FRONT RIGHT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': 1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-            
-        elif left_value>10:
-            print('object LEFT')
-            
-        elif right_value>10:
-            print('object RIGHT')
-        
-        else:
-            drive_message = {'linear': {'x': 0.5, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
+        # Avoidance, attached by sense_ir after map_ir so the buffer already holds this message
+        pose = self.odom.snapshot()
+        zone, action = self.ir_filter.push(self.ir_buffer.latest())
+        if zone != 'clear':
+            print(f'object {ZONE_LABELS[zone]}')
+        ir_override(self.mux, zone, action, pose, self.grid)
 
     def sense_ir(self):
+        timer = loop_timer('sense_ir')
         while not self.stop_event.is_set():
-            if self.joystick.manual_mode == False:
-                if self.joystick.armed == True:
-                    self.ir_topic.subscribe(self.callback_ir)
+            timer.begin()
+            version = self.joystick.mode_version
+            # Only listen to the IR sensors while armed and not driving manually
+            sense = self.joystick.armed and not self.joystick.manual_mode
+            if sense and not self.subscriptions.is_attached(self.ir_topic, self.callback_ir):
+                self.ir_filter.reset()  # no stale readings from before the pause
+            self.subscriptions.set_attached(self.ir_topic, self.callback_ir, sense)
+            timer.end()
+            self.joystick.wait_mode_change(version)  # sleep until the mode changes
+
+    def publish_twist(self, linear_x, angular_z):
+        self.mux.submit('autonomous', linear_x, angular_z)
 
     def drive_straight(self, dist):
-        # retrieve data and set start position
-        msg = self.get_odom()
-        if msg:
-            start_x = msg["position"]['x']
-            start_y = msg["position"]['y']
-        else:
-            print('waiting for odometry data')
-
-        position = 0.0
-        # Drive straight for 1 meter
-        while position < dist:
-            drive_message = {'linear': {'x': 0.15, 'y': 0.0, 'z': 0.0},
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}} 
-            self.drive_pub.publish(roslibpy.Message(drive_message)) #drive forward
-            
-            msg = self.get_odom() #retrieve data and calculate relative position
-            odom_x = msg["position"]['x']
-            odom_y = msg["position"]['y']
-            position = math.sqrt((odom_x - start_x)**2 + ((odom_y - start_y)**2))
-            print(position)
+        # Drive dist meters, stops on the odometry message that reaches the target
+        result = self.motion.run(DriveStraight(dist, speed=DRIVE_SPEED, tolerance=DRIVE_TOLERANCE), timeout=PRIMITIVE_TIMEOUT)
+        print(result)
+        return result
 
-            time.sleep(0.1) #10Hz repetition
-    
-    def turn_right(self):
+    def turn_right(self, angle=math.pi/2):
         # Right turn sequence
         print("Making right turn")
-        # retrieve data and set start position
-        msg = self.get_odom()
-        if msg:
-            start_angle = msg["orientation"]['z']
-            if start_angle < 0:
-                start_angle = start_angle+2
-        else:
-            print('waiting for odometry data')
-        
-        angle = 0.0
-        while angle > -0.5:
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0}, 
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': -0.5}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-            msg = self.get_odom() #retrieve data and calculate relative turn angle
-            current_angle = msg["orientation"]['z']
-            if current_angle < 0:
-                current_angle = current_angle+2
-            angle = current_angle-start_angle
-            if 1.5<angle<2:
-                angle = angle-2 
-            print(angle)
-            time.sleep(0.1)
-
-    def turn_left(self):
+        result = self.motion.run(Turn(-angle, rate=TURN_RATE, tolerance=TURN_TOLERANCE), timeout=PRIMITIVE_TIMEOUT)
+        print(result)
+        return result
+
+    def turn_left(self, angle=math.pi/2):
         # Left turn sequence
         print("Making left turn")
-        # retrieve data and set start position
-        msg = self.get_odom()
-        start_angle = 0.0
-        if msg:
-            start_angle = msg["orientation"]['z']
-            if start_angle < 0:
-                start_angle = start_angle+2
-        else:
-            print('waiting for odometry data')
-
-        angle = 0.0
-        current_angle = 0.0
-        while angle < 0.5:
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': 0.5}}  # Rotate left
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-            msg = self.get_odom() #retrieve data and calculate relative turn angle
-            current_angle = msg["orientation"]['z']
-            if current_angle < 0:
-                current_angle = current_angle+2
-            angle = current_angle-start_angle
-            if -2<angle<-1.5:
-                angle = angle+2
-            print(angle)
-            time.sleep(0.1)
+        result = self.motion.run(Turn(angle, rate=TURN_RATE, tolerance=TURN_TOLERANCE), timeout=PRIMITIVE_TIMEOUT)
+        print(result)
+        return result
+
+    def plan_mow(self):
+        # Lanes over the field ahead of the current pose, None without odometry
+        start = self.odom.wait_for_odom(timeout=1.0)
+        if start is None:
+            return None
+        field = field_ahead(start, MOW_LENGTH, MOW_WIDTH, TOOL_WIDTH)
+        plan = CoveragePlan(field, TOOL_WIDTH, speed=DRIVE_SPEED, start=(start.x, start.y))
+        self.coverage = CoverageMeter(field, TOOL_WIDTH)
+        print(plan)
+        return plan
 
     def auto_mow(self): #autonomous mode
-        last_turn = 'left'  # track the last turn direction
+        timer = loop_timer('auto_mow')
+        plan = None
+        reverse = False  # every other pass drives the plan backwards
         while not self.stop_event.is_set():
-            if self.joystick.autonomous_mode and self.joystick.armed:           
-                self.drive_straight(1.5)
-                # Decide on the turn direction (alternate turns)
-                if last_turn == 'right':
-                    self.turn_left()
-                    self.drive_straight(0.35)
-                    self.turn_left()
-                    last_turn = 'left'  # Update last turn direction to 'left'
-                elif last_turn == 'left':
-                    self.turn_right()
-                    self.drive_straight(0.35)
-                    self.turn_right()
-                    last_turn = 'right'  # Update last turn direction to 'right'
-
-                # Sleep to allow the turn to complete before the next action
-                time.sleep(0.1)
+            timer.begin()
+            version = self.joystick.mode_version
+            if self.joystick.autonomous_mode and self.joystick.armed:
+                if plan is None:
+                    plan = self.plan_mow()
+                    reverse = False
+                    timer.end()
+                    continue
+                t_pass = time.monotonic()
+                # one continuous path, the U-turns between lanes are part of it
+                result = self.motion.run(FollowPath(plan.waypoints(reverse), plan.length, speed=DRIVE_SPEED),
+                                         timeout=2*plan.duration() + PRIMITIVE_TIMEOUT)
+                print(result)
+                print(f"Mowing pass took {time.monotonic() - t_pass:.2f} s: planned {plan.planned_rate():.2f} m²/min, "
+                      f"achieved {self.coverage.rate():.2f} m²/min, {100*self.coverage.fraction():.0f} % covered")
+                reverse = not reverse
+                timer.end()
+            else:
+                plan = None  # plan again from wherever autonomous mode starts next
+                timer.end()
+                self.joystick.wait_mode_change(version)  # sleep until the mode changes instead of spinning
+
+    def mow_watch(self):
+        # A mowing pass is one long FollowPath, cancel it as soon as autonomous+armed ends
+        while not self.stop_event.is_set():
+            version = self.joystick.mode_version
+            if not (self.joystick.autonomous_mode and self.joystick.armed) and self.motion.busy:
+                self.motion.cancel()
+            self.joystick.wait_mode_change(version)
 
     def drive(self): #manual mode
+        timer = loop_timer('drive', 0.1)
         while not self.stop_event.is_set():
+            timer.begin()
             if self.joystick.manual_mode == True:
                 if self.joystick.armed == False:
-                    drive_message = {
-                    "linear": {"x": 0.0, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": 0.0}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
+                    self.teleop.stop()
+                    self.mux.submit('manual', 0.0, 0.0)
                 elif self.joystick.armed == True:
-                    drive_message = {
-                    "linear": {"x": self.joystick.linear_x, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": self.joystick.angular_z}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
+                    self.mux.submit('manual', *self.teleop.command(self.joystick.linear_x, self.joystick.angular_z))
+            else:
+                self.teleop.stop()  # start from rest when manual mode comes back
             
-            time.sleep(0.1)  # 10Hz
+            timer.sleep(0.1)  # 10Hz
 
-    def leds(self): #control lightring
-        while not self.stop_event.is_set():
-            play_lights(ros_node, robot_name, self.joystick.color)
-            if self.joystick.armed:
-                time.sleep(0.5)  # Blink on
-                play_lights(ros_node, robot_name, 'Off')
-                time.sleep(0.5)  # Blink off
-            else:
-                time.sleep(1)  # Keep the LED color
+    def show_mode(self): #control lightring
+        # Hands the mode to the LED controller, whose thread does the blinking and keepalive
+        self.led.set(self.joystick.color, self.joystick.armed, stamp=self.joystick.changed_at)  # blink if armed
 
     def audio(self): #play audio
-        last_mode = None  # Track the last executed mode
-
+        # Sleeps until the mode changes, then starts the new tune right away
+        timer = loop_timer('audio')
         while not self.stop_event.is_set():
-            # Detect the current mode
-            current_mode = None
-            notes = []
-            sleep_duration = 0
-
-            if self.joystick.manual_mode:
-                current_mode = "manual"
-                notes = [
-                    {'frequency': 600, 'max_runtime': {'sec': 0, 'nanosec': int(5e8)}},
-                    {'frequency': 750, 'max_runtime': {'sec': 0, 'nanosec': int(5e8)}}
-                ]
-                sleep_duration = 1
-            
-            elif self.joystick.idle_mode:
-                current_mode = "idle"
-                notes = [
-                    {'frequency': 600, 'max_runtime': {'sec': 0, 'nanosec': int(5e8)}},
-                    {'frequency': 450, 'max_runtime': {'sec': 0, 'nanosec': int(5e8)}}
-                ]
-                sleep_duration = 1
-
-            elif self.joystick.autonomous_mode:
-                current_mode = "autonomous"
-                notes = [
-                    {'frequency': 600, 'max_runtime': {'sec': 0, 'nanosec': int(3e8)}},
-                    {'frequency': 750, 'max_runtime': {'sec': 0, 'nanosec': int(3e8)}},
-                    {'frequency': 900, 'max_runtime': {'sec': 0, 'nanosec': int(3e8)}}
-                ]
-                sleep_duration = 0.9
-            
-            elif self.joystick.armed == True:
-                current_mode = 'armed'
-                notes = [{'frequency': 300, 'max_runtime': {'sec': 3, 'nanosec': 0}}]
-                sleep_duration = 3
-
-            # Play notes only if the mode has changed
-            if current_mode and current_mode != last_mode:
-                audio_message = {'notes': notes, 'append': False}
-                self.audio_pub.publish(roslibpy.Message(audio_message))
-                time.sleep(sleep_duration)
-                last_mode = current_mode  # Update last mode to prevent re-triggering
-
-            time.sleep(0.1)
+            timer.begin()
+            version = self.joystick.mode_version
+            self.audio_player.play(self.joystick.mode)  # cuts off a tune that is still playing
+            timer.end()
+            self.joystick.wait_mode_change(version)
 
     def stop(self):
+        self.mux.submit('safety', 0.0, 0.0)  # holds the robot still until shutdown
         self.stop_event.set()
+        self.motion.cancel()
+        self.joystick.notify_mode_change()  # wake threads waiting on a mode change
         self.drive_thread.join()
-        self.led_thread.join()
         self.audio_thread.join()
         self.auto_mow_thread.join()
-        #self.sense_ir_thread.join()
+        self.mow_watch_thread.join()
+        if self.sense_ir_thread.is_alive():  # only ir_sensor() starts it
+            self.sense_ir_thread.join()
         self.cleanup()
 
     def cleanup(self):
-        play_lights(ros_node, robot_name, 'Off')
-        self.drive_pub.publish(roslibpy.Message({"linear": {"x": 0.0, "y": 0.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.0}}))
-        self.led_pub.unadvertise()
+        self.led.stop()
+        print(f"LED stats: {self.led.stats()}")
+        lightring = get_lightring(ros_node, robot_name)
+        lightring.publish('Off', force=True)
+        print(f"Lightring stats: {lightring.stats()}")
+        release_lightring(ros_node, robot_name)
+        self.mux.stop()
+        print(f"cmd_vel mux stats: {self.mux.stats()}")
         self.drive_pub.unadvertise()
-        self.audio_pub.unadvertise()
-        self.odom_topic.unsubscribe()
-        self.ir_topic.unsubscribe()
+        print(f"Audio stats: {self.audio_player.stats()}")
+        self.audio_player.close()
+        self.subscriptions.close()
+        print(f"IR filter stats: {self.ir_filter.stats()}")
+        print(f"Pose estimator stats: {self.odom.stats()}")
+        print(f"cmd_vel stats: {self.cmd_vel.stats()}")
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Flight log: {self.recorder.stats()}")
 
 
 # Main loop
+#   python 6_week_challenge.py               joystick control
+#   python 6_week_challenge.py --autonomous  no joystick or pygame, starts armed in autonomous mode
 if __name__ == "__main__":
+    if '--autonomous' in sys.argv[1:]:
+        events = QueuedInput()
+        events.press('LB')
+        events.press('B')
+    else:
+        try:
+            events = JoystickEvents(0)
+        except RuntimeError as error:
+            print(error)
+            exit(1)
+    pygame = getattr(events, 'pygame', None)  # only a real joystick starts pygame
+
+    install_dump_signal()  # kill -USR1 <pid> prints the loop timing report
     try:
-        joystick = Joystick()
+        joystick = Joystick(events)
         robot = RobotController(joystick)
 
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    raise KeyboardInterrupt  # Graceful exit
+            if pygame is not None:
+                for event in pygame.event.get(pygame.QUIT):  # joystick events belong to Joystick
+                    if event.type == pygame.QUIT:
+                        raise KeyboardInterrupt  # Graceful exit
 
             time.sleep(0.1)  # 10Hz loop
 
@@ -391,6 +352,9 @@ if __name__ == "__main__":
         print("\nShutting down...")
         robot.stop()
         joystick.stop()
-        pygame.quit()
+        if pygame is not None:
+            pygame.quit()
+        print(f"Bridge stats: {ros_node.stats()}")
         ros_node.terminate()
+        LOOPS.dump()
         print("Shutdown complete.")
\ No newline at end of file
@@ -1,22 +1,34 @@
+import os
 import time
 import roslibpy
 import pygame
+from bridge import connect
 from lights_function import play_lights
 import threading
-import math
+from cmd_vel import TwistPublisher
+from odometry import OdomState
+from motion import MotionEngine
+from velocity_profile import TeleopShaper
+from ir_buffer import IrRingBuffer, IrZoneClassifier, IrFilter
+from ir_mower import IrMower, mower_settings
+from flight_log import FlightRecorder
+from loop_timing import LOOPS, loop_timer, install_dump_signal
+from tuning import load_tuning
+
+# Connect to the ROS bridge, lazily on first topic use and again after a drop
+ros_node = connect()  # ROSBRIDGE_HOST/ROSBRIDGE_PORT, the lab robot by default
 
-# Initialize pygame and joystick control
-pygame.init()
-pygame.joystick.init()
-if pygame.joystick.get_count() == 0:
-    print("No joystick detected. Please connect a joystick and restart.")
-    exit(1)
+robot_name = 'echo'
 
-# Connect to the ROS bridge
-ros_node = roslibpy.Ros(host='192.168.8.104', port=9012)
-ros_node.run()
+# Values found by ir_tuner.py replace the hand tuned ones of ir_mower.py when ir_tuning.json exists
+TUNING = load_tuning()
+MOWER = mower_settings(TUNING)
+if TUNING:
+    print(f"IR tuning loaded: thresholds {MOWER['IR_THRESHOLDS']}, drive {MOWER['DRIVE_SPEED']} m/s, "
+          f"turn linear {MOWER['TURN_LINEAR']} m/s")
 
-robot_name = 'echo'
+# Path of a flight log (odom, ir_intensity, cmd_vel) to record, unset to disable
+RECORD_LOG = os.environ.get('RECORD_LOG')
 
 # Joystick class
 class Joystick:
@@ -40,7 +52,9 @@ class Joystick:
         self.thread.start()
 
     def get_commands(self):
+        timer = loop_timer('joystick', 0.1)
         while not self.stop_event.is_set():
+            timer.begin()
             pygame.event.pump()  # Process joystick events
 
             if self.joystick.get_button(0):  # "A" button
@@ -86,7 +100,7 @@ class Joystick:
                 self.linear_x = 0
                 self.angular_z = 0
 
-            time.sleep(0.1)  # Loop at 5 Hz
+            timer.sleep(0.1)  # Loop at 10 Hz, slower after a press (debounce)
 
     def stop(self):
         self.stop_event.set()
@@ -98,11 +112,21 @@ class RobotController:
     def __init__(self, joystick):
         self.joystick = joystick
         self.stop_event = threading.Event()
-        self.last_turn = 'left'
+        self.odom = OdomState()
+        self.motion = MotionEngine(self.odom, self.publish_twist)
+        self.ir_buffer = IrRingBuffer()
+        self.ir_classifier = IrZoneClassifier(MOWER['IR_THRESHOLDS'], MOWER['IR_ACTIONS'])
+        self.ir_filter = IrFilter(self.ir_classifier)  # a lone noisy reading never starts a maneuver
+        self.mower = IrMower(self.motion.run, self.odom, self.ir_buffer, self.ir_filter, MOWER,
+                             running=lambda: not self.stop_event.is_set(), verbose=True)
 
         # ROS publishers
-        self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
         self.drive_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
+        self.cmd_vel = TwistPublisher(self.drive_pub)
+        self.teleop = TeleopShaper()  # stick to cmd_vel with limited acceleration and jerk
+        self.recorder = FlightRecorder(RECORD_LOG) if RECORD_LOG else None
+        if self.recorder is not None:
+            self.cmd_vel.on_publish = self.recorder.record_cmd_vel
         self.audio_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_audio', 'irobot_create_msgs/AudioNoteVector')
         self.odom_topic = roslibpy.Topic(ros_node, f'/{robot_name}/odom', 'nav_msgs/Odometry')
         self.ir_topic = roslibpy.Topic(ros_node, f'/{robot_name}/ir_intensity', 'irobot_create_msgs/IrIntensityVector')
@@ -122,211 +146,77 @@ class RobotController:
         #self.sense_ir_thread.start()
 
     def odom_callback(self, message): #read odometer data
-        self.latest_odom = {
-            "position": message['pose']['pose']['position'],
-            "orientation": message['pose']['pose']['orientation'],
-            "linear_velocity": message['twist']['twist']['linear'],
-            "angular_velocity": message['twist']['twist']['angular']
-        }
+        if self.recorder is not None:
+            self.recorder.record_odom(message)
+        self.odom.update(message)
+        self.motion.on_odom()  # run the active motion primitive's control step
     
     def callback_ir(self, message): #read IR data
-        self.values = [reading['value'] for reading in message['readings']]
+        if self.recorder is not None:
+            self.recorder.record_ir(message)
+        self.ir_buffer.push(message['readings'])
+        zone, action = self.ir_filter.push(self.ir_buffer.latest())
+        # stop an avoiding drive_straight as soon as something is seen, auto_mow then runs ir_sensor
+        if self.motion.interruptible and action is not None:
+            self.motion.interrupt('obstacle')
     
     def get_odom(self): #retrieve odometer data
-        return self.latest_odom
+        return self.odom.snapshot()  # None until the first message
       
-    def get_ir(self): #retrieve IR data
-        while not self.stop_event.is_set():
-            return self.values
-    
-    def ir_sensor(self):
-        self.get_ir()
-        front_value = self.values[3]  # Adjust index based on sensor configuration
-        left_value = self.values[0]
-        right_value = self.values[6]
-        left_center= self.values[1]
-        right_center= self.values[5]
-
-        if front_value>300:
-            print('object in FRONT')
-            if self.last_turn == 'left':
-                self.turn_right(0.45)
-                self.drive_straight(0.25)
-                self.turn_right(0.45)
-                self.last_turn = 'left'
-            elif self.last_turn == 'right':
-                self.turn_left(0.45)
-                self.drive_straight(0.25)
-                self.turn_left(0.45)
-                self.last_turn = 'right'
-            
-        elif left_center>400:    
-            print('object in FRONT LEFT')
-            self.turn_right(0.15)
-
-        elif right_center>400:
-            print('object in FRONT RIGHT')
-            self.turn_left(0.15)
-            
-        elif left_value>500:
-            print('object LEFT')
-            self.turn_right(0.1)
-            
-        elif right_value>500:
-            print('object RIGHT')
-            self.turn_left(0.1)
-        else:
-            pass
-
-    def drive_straight(self, dist):
-        # retrieve data and set start position
-        msg = self.get_odom()
-        if msg:
-            start_x = msg["position"]['x']
-            start_y = msg["position"]['y']
-        else:
-            print('waiting for odometry data')
-
-        position = 0.0
-        # Drive straight for 1 meter
-        while position < dist:
-            self.ir_sensor()
-            drive_message = {'linear': {'x': 0.15, 'y': 0.0, 'z': 0.0},
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}} 
-            self.drive_pub.publish(roslibpy.Message(drive_message)) #drive forward
-            
-            msg = self.get_odom() #retrieve data and calculate relative position
-            odom_x = msg["position"]['x']
-            odom_y = msg["position"]['y']
-            position = math.sqrt((odom_x - start_x)**2 + ((odom_y - start_y)**2))
-            #print(position)
-
-            time.sleep(0.1) #10Hz repetition
+    def get_ir(self): #retrieve IR data, None until the first message
+        return self.ir_buffer.latest()
     
-    def turn_right(self,dist):
-        # Right turn sequence
-        print("Making right turn")
-        # retrieve data and set start position
-        msg = self.get_odom()
-        if msg:
-            start_angle = msg["orientation"]['z']
-            if start_angle < 0:
-                start_angle = start_angle+2
-        else:
-            print('waiting for odometry data')
-        
-        angle = 0.0
-        while angle > -dist:
-            drive_message = {'linear': {'x': 0.12, 'y': 0.0, 'z': 0.0}, 
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': -0.5}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-            msg = self.get_odom() #retrieve data and calculate relative turn angle
-            current_angle = msg["orientation"]['z']
-            if current_angle < 0:
-                current_angle = current_angle+2
-            angle = current_angle-start_angle
-            if 1.5<angle<2:
-                angle = angle-2 
-            print(angle)
-            time.sleep(0.05)
-
-    def turn_left(self,dist):
-        # Left turn sequence
-        print("Making left turn")
-        # retrieve data and set start position
-        msg = self.get_odom()
-        start_angle = 0.0
-        if msg:
-            start_angle = msg["orientation"]['z']
-            if start_angle < 0:
-                start_angle = start_angle+2
-        else:
-            print('waiting for odometry data')
-
-        angle = 0.0
-        current_angle = 0.0
-        while angle < dist:
-            drive_message = {'linear': {'x': 0.12, 'y': 0.0, 'z': 0.0},
-                            'angular': {'x': 0.0, 'y': 0.0, 'z': 0.5}}  # Rotate left
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-            msg = self.get_odom() #retrieve data and calculate relative turn angle
-            current_angle = msg["orientation"]['z']
-            if current_angle < 0:
-                current_angle = current_angle+2
-            angle = current_angle-start_angle
-            if -2<angle<-1.5:
-                angle = angle+2
-            print(angle)
-            time.sleep(0.05)
+    def publish_twist(self, linear_x, angular_z):
+        self.cmd_vel.publish(linear_x, angular_z)
 
     def auto_mow(self): #autonomous mode
+        timer = loop_timer('auto_mow')
         while not self.stop_event.is_set():
+            timer.begin()
             if self.joystick.autonomous_mode and self.joystick.armed:
-                self.drive_straight(1.4)
-                time.sleep(1)
-                # Decide on the turn direction (alternate turns)
-                if self.last_turn == 'right':
-                    self.turn_left(0.5)
-                    time.sleep(1)
-                    #self.drive_straight(0.26)
-                    #time.sleep(1)
-                    self.turn_left(0.5)
-                    time.sleep(1)
-                    #self.drive_straight(0.26)
-                    #time.sleep(1)
-                    #self.turn_left(0.25)
-                    #time.sleep(1)
-                    self.last_turn = 'left'  # Update last turn direction to 'left'
-                elif self.last_turn == 'left':
-                    self.turn_right(0.45)
-                    time.sleep(1)              
-                    #self.drive_straight(0.40)
-                    #time.sleep(1)
-                    self.turn_right(0.45)
-                    time.sleep(1)
-                    #self.drive_straight(0.26)
-                    #time.sleep(1)
-                    #self.turn_right(0.31)
-                    #time.sleep(1)
-                    self.last_turn = 'right'  # Update last turn direction to 'right'
-
-                # Sleep to allow the turn to complete before the next action
-                time.sleep(0.1)
+                t_pass = time.monotonic()
+                tracking = self.mower.mow_pass()
+                if tracking is not None:
+                    print(f"Mowing pass took {time.monotonic() - t_pass:.2f} s, lookahead {tracking['lookahead']:.2f} m, "
+                          f"cross-track mean {1000*tracking['cross_track_mean']:.1f} mm max {1000*tracking['cross_track_max']:.1f} mm")
+                timer.end()
+            else:
+                timer.sleep(0.1)  # poll the mode instead of spinning
 
     def drive(self): #manual mode
+        timer = loop_timer('drive', 0.1)
         while not self.stop_event.is_set():
+            timer.begin()
             if self.joystick.manual_mode == True:
                 if self.joystick.armed == False:
-                    drive_message = {
-                    "linear": {"x": 0.0, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": 0.0}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
+                    self.teleop.stop()
+                    self.cmd_vel.stop()
                 elif self.joystick.armed == True:
-                    drive_message = {
-                    "linear": {"x": self.joystick.linear_x, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": self.joystick.angular_z}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
-            
-            time.sleep(0.1)  # 10Hz
+                    self.cmd_vel.publish(*self.teleop.command(self.joystick.linear_x, self.joystick.angular_z))
+            else:
+                self.teleop.stop()  # start from rest when manual mode comes back
+
+            timer.sleep(0.1)  # 10Hz
 
     def leds(self): #control lightring
+        timer = loop_timer('leds', 0.5)
         while not self.stop_event.is_set():
+            timer.begin()
             play_lights(ros_node, robot_name, self.joystick.color)
             if self.joystick.armed:
-                time.sleep(0.5)  # Blink on
+                timer.sleep(0.5)  # Blink on
+                timer.begin()
                 play_lights(ros_node, robot_name, 'Off')
-                time.sleep(0.5)  # Blink off
+                timer.sleep(0.5)  # Blink off
             else:
-                time.sleep(1)  # Keep the LED color
+                timer.sleep(1)  # Keep the LED color
 
     def audio(self): #play audio
         last_mode = None  # Track the last executed mode
+        timer = loop_timer('audio', 0.1)
 
         while not self.stop_event.is_set():
+            timer.begin()
             # Detect the current mode
             current_mode = None
             notes = []
@@ -366,13 +256,15 @@ class RobotController:
             if current_mode and current_mode != last_mode:
                 audio_message = {'notes': notes, 'append': False}
                 self.audio_pub.publish(roslibpy.Message(audio_message))
-                time.sleep(sleep_duration)
+                timer.sleep(sleep_duration)  # let the tune play
+                timer.begin()
                 last_mode = current_mode  # Update last mode to prevent re-triggering
 
-            time.sleep(0.1)
+            timer.sleep(0.1)
 
     def stop(self):
         self.stop_event.set()
+        self.motion.cancel()
         self.drive_thread.join()
         self.led_thread.join()
         self.audio_thread.join()
@@ -382,16 +274,27 @@ class RobotController:
 
     def cleanup(self):
         play_lights(ros_node, robot_name, 'Off')
-        self.drive_pub.publish(roslibpy.Message({"linear": {"x": 0.0, "y": 0.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.0}}))
-        self.led_pub.unadvertise()
+        self.cmd_vel.stop()
         self.drive_pub.unadvertise()
         self.audio_pub.unadvertise()
         self.odom_topic.unsubscribe()
         self.ir_topic.unsubscribe()
+        print(f"IR filter stats: {self.ir_filter.stats()}")
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Flight log: {self.recorder.stats()}")
 
 
 # Main loop
 if __name__ == "__main__":
+    # Initialize pygame and joystick control
+    pygame.init()
+    pygame.joystick.init()
+    if pygame.joystick.get_count() == 0:
+        print("No joystick detected. Please connect a joystick and restart.")
+        exit(1)
+
+    install_dump_signal()  # kill -USR1 <pid> prints the loop timing report
     try:
         joystick = Joystick()
         robot = RobotController(joystick)
@@ -409,4 +312,5 @@ if __name__ == "__main__":
         joystick.stop()
         pygame.quit()
         ros_node.terminate()
+        LOOPS.dump()
         print("Shutdown complete.")
\ No newline at end of file
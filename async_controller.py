@@ -0,0 +1,307 @@
+import asyncio
+import math
+import time
+import roslibpy
+from bridge import connect
+from lights_function import get_lightring, release_lightring
+from audio_sequencer import AudioSequencer, MODE_TUNES
+from led_controller import LedStateMachine
+from cmd_vel import TwistPublisher
+from cmd_mux import CmdVelMux
+from joystick_events import JoystickEvents
+from subscriptions import SubscriptionManager
+from ir_buffer import IrRingBuffer, IrZoneClassifier, IrFilter
+from pose_estimator import PoseEstimator
+from motion import MotionEngine, DriveStraight, Turn, FollowPath
+from velocity_profile import TeleopShaper
+from coverage_plan import CoveragePlan, CoverageMeter, field_ahead
+from occupancy_grid import OccupancyGrid
+from controller_core import (IR_THRESHOLDS, IR_ACTIONS, DRIVE_SPEED, DRIVE_TOLERANCE, TURN_RATE, TURN_TOLERANCE,
+                             MOW_LENGTH, MOW_WIDTH, TOOL_WIDTH, CMD_RATE, RobotModes, ir_override)
+
+ROS_HOST = '192.168.8.104'
+ROS_PORT = 9012
+robot_name = 'foxtrot'
+
+# Loop periods (s)
+DRIVE_PERIOD = 0.1  # manual cmd_vel, 10 Hz
+CMD_PERIOD = 1.0/CMD_RATE  # multiplexed cmd_vel output
+
+# RobotModes announced on the event loop, only touched from the loop thread
+class ModeState(RobotModes):
+
+    def __init__(self):
+        super().__init__()
+
+        # Bumped on every button press, waiters sleep on `changed` until it moves
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.changed_at = None  # time.perf_counter() when the last press was read
+
+    def press(self, button, stamp=None):
+        if not super().press(button):
+            return
+
+        self.version += 1
+        self.changed_at = time.perf_counter() if stamp is None else stamp
+        # Wake everyone waiting on this version, later waiters get a fresh event
+        changed = self.changed
+        self.changed = asyncio.Event()
+        changed.set()
+
+    async def wait_change(self, version):
+        # Sleep until the version moves past `version`
+        while self.version == version:
+            await self.changed.wait()
+
+# Robot controller on one asyncio event loop: input, drive, lights, audio and autonomy
+# are coroutines, roslibpy callbacks are handed to the loop with call_soon_threadsafe
+class AsyncRobotController:
+
+    def __init__(self, ros_node, robot_name, input_source, state=None, pump_input=True):
+        # input_source: joystick_events.InputEvents, e.g. JoystickEvents()
+        # pump_input: poll input_source from this controller, False when the owner polls it (fleet.py)
+        self.ros_node = ros_node
+        self.robot_name = robot_name
+        self.input = input_source
+        self.state = state
+        self.pump_input = pump_input
+        self.subscriptions = SubscriptionManager()
+
+        self.drive_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
+        self.cmd_vel = TwistPublisher(self.drive_pub)
+        self.mux = CmdVelMux(self.cmd_vel, rate=1.0/CMD_PERIOD)  # ticked by cmd_loop, no thread
+        self.teleop = TeleopShaper()  # stick to cmd_vel with limited acceleration and jerk
+        self.audio = AudioSequencer(ros_node, robot_name)
+        self.odom_topic = roslibpy.Topic(ros_node, f'/{robot_name}/odom', 'nav_msgs/Odometry')
+        self.mouse_topic = roslibpy.Topic(ros_node, f'/{robot_name}/mouse', 'irobot_create_msgs/Mouse')
+        self.imu_topic = roslibpy.Topic(ros_node, f'/{robot_name}/imu', 'sensor_msgs/Imu')
+        self.ir_topic = roslibpy.Topic(ros_node, f'/{robot_name}/ir_intensity', 'irobot_create_msgs/IrIntensityVector')
+        self.lightring = get_lightring(ros_node, robot_name)
+        self.leds = LedStateMachine()
+
+        self.odom = PoseEstimator()  # odometry fused with the mouse and gyro
+        self.motion = MotionEngine(self.odom, lambda linear_x, angular_z: self.mux.submit('autonomous', linear_x, angular_z))
+        self.ir_buffer = IrRingBuffer()
+        self.ir_classifier = IrZoneClassifier(IR_THRESHOLDS, IR_ACTIONS)
+        self.ir_filter = IrFilter(self.ir_classifier)
+        self.grid = OccupancyGrid()  # obstacles seen by the IR sensors, in the odometry frame
+
+        self.loop = None
+        self.input_queue = None
+        self.tasks = []
+        self.mow_task = None
+        self.coverage = None  # CoverageMeter of the current mowing plan
+        self.odom_ready = None
+
+    def odom_callback(self, message):
+        # roslibpy thread, hand the message to the loop
+        self.loop.call_soon_threadsafe(self.on_odom, message)
+
+    def mouse_callback(self, message):
+        self.loop.call_soon_threadsafe(self.odom.on_mouse, message)
+
+    def imu_callback(self, message):
+        self.loop.call_soon_threadsafe(self.odom.on_imu, message)
+
+    def on_odom(self, message):
+        self.odom.update(message)
+        self.motion.on_odom()
+        if self.coverage is not None and self.motion.busy:
+            self.coverage.on_odom(self.odom.snapshot())
+        self.odom_ready.set()
+
+    def ir_callback(self, message):
+        self.loop.call_soon_threadsafe(self.on_ir, message)
+
+    def on_ir(self, message):
+        self.ir_buffer.push(message['readings'])
+        pose = self.odom.snapshot()
+        self.grid.update_ir(pose, self.ir_buffer.latest())
+        zone, action = self.ir_filter.push(self.ir_buffer.latest())
+        ir_override(self.mux, zone, action, pose, self.grid)
+
+    async def input_pump(self):
+        # SDL has nothing to await on, block in wait() on an executor thread and poll when it returns
+        while True:
+            await self.loop.run_in_executor(None, self.input.wait)
+            self.input.poll()
+
+    async def input_loop(self):
+        while True:
+            snapshot = await self.input_queue.get()
+            if snapshot.kind == 'button':
+                self.state.press(snapshot.name, snapshot.stamp)
+                self.input.latency.record(snapshot.stamp)  # snapshot stamp -> mode change
+            self.state.set_axes(snapshot.axes[0], snapshot.axes[1])
+
+    async def ir_loop(self):
+        # Listen to the IR sensors only while armed and not driving manually
+        while True:
+            version = self.state.version
+            sense = self.state.armed and not self.state.manual_mode
+            if sense and not self.subscriptions.is_attached(self.ir_topic, self.ir_callback):
+                self.ir_filter.reset()
+            self.subscriptions.set_attached(self.ir_topic, self.ir_callback, sense)
+            await self.state.wait_change(version)
+
+    async def drive_loop(self): #manual mode
+        while True:
+            if self.state.manual_mode:
+                if self.state.armed:
+                    self.mux.submit('manual', *self.teleop.command(self.state.linear_x, self.state.angular_z))
+                else:
+                    self.teleop.stop()
+                    self.mux.submit('manual', 0.0, 0.0)
+                await asyncio.sleep(DRIVE_PERIOD)
+            else:
+                self.teleop.stop()  # start from rest when manual mode comes back
+                await self.state.wait_change(self.state.version)
+
+    async def cmd_loop(self):
+        # The only writer of cmd_vel, publishes the winning source once per period
+        t_start = self.loop.time()
+        tick = 0
+        while True:
+            self.mux.tick()
+            tick = max(tick + 1, int((self.loop.time() - t_start)/CMD_PERIOD) + 1)
+            await asyncio.sleep(t_start + tick*CMD_PERIOD - self.loop.time())
+
+    async def led_loop(self):
+        # Publishes on a mode change, a blink edge or a keepalive, sleeps in between
+        while True:
+            version = self.state.version
+            self.leds.set(self.state.color, self.state.armed, stamp=self.state.changed_at)
+            frame, keepalive, deadline = self.leds.step()
+            if frame is not None:
+                self.lightring.publish(frame, force=True)
+            self.leds.shown()
+            try:
+                await asyncio.wait_for(self.state.wait_change(version), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def audio_loop(self):
+        while True:
+            version = self.state.version
+            self.audio.play(self.state.mode)  # cuts off a tune that is still playing
+            await self.state.wait_change(version)
+
+    async def autonomy_loop(self):
+        # Start auto_mow when autonomous and armed, cancel it on any other mode
+        while True:
+            version = self.state.version
+            active = self.state.autonomous_mode and self.state.armed
+            running = self.mow_task is not None and not self.mow_task.done()
+            if active and not running:
+                self.mow_task = asyncio.create_task(self.auto_mow())
+            elif not active and running:
+                self.mow_task.cancel()
+            await self.state.wait_change(version)
+
+    async def run_primitive(self, primitive):
+        # Run a motion primitive, its steps run in on_odom, cancelling the task stops the robot
+        future = self.loop.create_future()
+
+        def done(result):
+            if not future.done():
+                future.set_result(result)
+
+        self.motion.start(primitive, on_done=done)
+        try:
+            result = await future
+        except asyncio.CancelledError:
+            self.motion.cancel()
+            raise
+        print(result)
+        return result
+
+    async def drive_straight(self, dist):
+        return await self.run_primitive(DriveStraight(dist, speed=DRIVE_SPEED, tolerance=DRIVE_TOLERANCE))
+
+    async def turn_right(self, angle=math.pi/2):
+        print("Making right turn")
+        return await self.run_primitive(Turn(-angle, rate=TURN_RATE, tolerance=TURN_TOLERANCE))
+
+    async def turn_left(self, angle=math.pi/2):
+        print("Making left turn")
+        return await self.run_primitive(Turn(angle, rate=TURN_RATE, tolerance=TURN_TOLERANCE))
+
+    async def auto_mow(self): #autonomous mode
+        # Plan lanes over the field from the current pose and follow them back and forth,
+        # the U-turns are part of the path so the robot never stops between lanes
+        await self.odom_ready.wait()
+        start = self.odom.snapshot()
+        field = field_ahead(start, MOW_LENGTH, MOW_WIDTH, TOOL_WIDTH)
+        plan = CoveragePlan(field, TOOL_WIDTH, speed=DRIVE_SPEED, start=(start.x, start.y))
+        self.coverage = CoverageMeter(field, TOOL_WIDTH)
+        print(plan)
+        reverse = False
+        while True:
+            t_pass = time.monotonic()
+            await self.run_primitive(FollowPath(plan.waypoints(reverse), plan.length, speed=DRIVE_SPEED))
+            print(f"Mowing pass took {time.monotonic() - t_pass:.2f} s: planned {plan.planned_rate():.2f} m²/min, "
+                  f"achieved {self.coverage.rate():.2f} m²/min, {100*self.coverage.fraction():.0f} % covered")
+            reverse = not reverse
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.odom_ready = asyncio.Event()
+        self.input_queue = self.input.subscribe(asyncio.Queue())
+        if self.state is None:
+            self.state = ModeState()
+        self.subscriptions.attach(self.odom_topic, self.odom_callback)
+        self.subscriptions.attach(self.mouse_topic, self.mouse_callback)
+        self.subscriptions.attach(self.imu_topic, self.imu_callback)
+
+        loops = [self.input_loop(), self.cmd_loop(), self.drive_loop(), self.ir_loop(), self.led_loop(), self.audio_loop(), self.autonomy_loop()]
+        if self.pump_input:
+            loops.append(self.input_pump())
+        self.tasks = [asyncio.create_task(coro) for coro in loops]
+        try:
+            await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            pass  # stop()
+        finally:
+            await self.shutdown()
+
+    def stop(self):
+        # Safe to call from the loop thread, use loop.call_soon_threadsafe(controller.stop) elsewhere
+        for task in self.tasks:
+            task.cancel()
+
+    async def shutdown(self):
+        tasks = [task for task in self.tasks + [self.mow_task] if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.mux.submit('safety', 0.0, 0.0)
+        self.motion.cancel()
+        self.mux.stop()
+        print(f"cmd_vel mux stats: {self.mux.stats()}")
+        self.lightring.publish('Off', force=True)
+        print(f"Lightring stats: {self.lightring.stats()}, change -> light {self.leds.latency.summary()}")
+        print(f"Input stats: {self.input.stats()}")
+        release_lightring(self.ros_node, self.robot_name)
+        self.subscriptions.close()
+        print(f"IR filter stats: {self.ir_filter.stats()}")
+        print(f"Pose estimator stats: {self.odom.stats()}")
+        self.drive_pub.unadvertise()
+        print(f"Audio stats: {self.audio.stats()}")
+        self.audio.close()
+
+
+# Main loop
+if __name__ == "__main__":
+    joystick = JoystickEvents()
+    ros_node = connect(ROS_HOST, ROS_PORT)
+    robot = AsyncRobotController(ros_node, robot_name, joystick)
+    try:
+        asyncio.run(robot.run())
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        joystick.close()
+        print(f"Bridge stats: {ros_node.stats()}")
+        ros_node.terminate()
+        print("Shutdown complete.")
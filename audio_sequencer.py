@@ -0,0 +1,68 @@
+import threading
+import time
+import roslibpy
+
+def note(frequency, nanosec, sec=0):
+    return {'frequency': frequency, 'max_runtime': {'sec': sec, 'nanosec': nanosec}}
+
+# Tune played when a mode is entered
+MODE_TUNES = {
+    'manual': [note(600, int(5e8)), note(750, int(5e8))],
+    'idle': [note(600, int(5e8)), note(450, int(5e8))],
+    'autonomous': [note(600, int(3e8)), note(750, int(3e8)), note(900, int(3e8))],
+    'armed': [note(300, 0, sec=3)],
+}
+
+def tune_duration(notes):
+    return sum(n['max_runtime']['sec'] + 1e-9*n['max_runtime']['nanosec'] for n in notes)
+
+# Plays one tune per mode on cmd_audio. Every AudioNoteVector is built once up front, and
+# each is sent with append=False so a new tune cuts off whatever is still playing. play()
+# only publishes and returns, nothing waits for a tune to finish.
+class AudioSequencer:
+
+    def __init__(self, ros_node, robot_name, tunes=MODE_TUNES):
+        self.audio_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_audio', 'irobot_create_msgs/AudioNoteVector')
+        self.lock = threading.Lock()
+        self.messages = {mode: roslibpy.Message({'notes': notes, 'append': False}) for mode, notes in tunes.items()}
+        self.durations = {mode: tune_duration(notes) for mode, notes in tunes.items()}
+        self.current = None  # mode of the last tune sent
+        self.ends_at = 0.0  # time.monotonic() when that tune stops sounding
+
+        # Counters, read them with stats()
+        self.play_count = 0
+        self.preempt_count = 0  # tunes cut off by the next one
+        self.repeat_count = 0  # play() calls for the mode already played
+
+    def play(self, mode):
+        # Play the tune of `mode` now unless it is the last one played, returns True if sent
+        if mode is None:
+            return False
+        with self.lock:
+            if mode == self.current:
+                self.repeat_count += 1
+                return False
+            now = time.monotonic()
+            if now < self.ends_at:
+                self.preempt_count += 1
+            self.audio_pub.publish(self.messages[mode])
+            self.play_count += 1
+            self.current = mode
+            self.ends_at = now + self.durations[mode]
+            return True
+
+    def playing(self):
+        return time.monotonic() < self.ends_at
+
+    def stats(self):
+        return {
+            'played': self.play_count,
+            'preempted': self.preempt_count,
+            'repeats': self.repeat_count,
+            'current': self.current,
+        }
+
+    def close(self):
+        with self.lock:
+            self.audio_pub.unadvertise()
+            self.current = None
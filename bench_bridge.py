@@ -0,0 +1,98 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from fake_rosbridge import FakeRosbridge, IrPattern
+from joystick_events import QueuedInput
+
+# End-to-end benchmark of RobotController (6_week_challenge.py) against fake_rosbridge.py.
+# The controller runs in a child process, armed in idle mode so it reacts to the IR
+# sensors, while the bridge streams odometry and an IR obstacle that comes and goes.
+# Reports IR-to-cmd_vel reaction latency, publish throughput and the child's CPU.
+
+robot_name = 'foxtrot'  # the robot 6_week_challenge.py drives
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q*len(ordered)))]
+
+def run_child(duration):
+    # Runs inside the child process, ROSBRIDGE_HOST/PORT point 6_week_challenge at the fake bridge
+    challenge = importlib.import_module('6_week_challenge')
+
+    # Armed in idle mode through the same scripted input --autonomous uses, no pygame joystick needed
+    events = QueuedInput()
+    events.press('LB')
+    joystick = challenge.Joystick(events)
+    robot = challenge.RobotController(joystick)
+    robot.ir_sensor()  # IR avoidance is off unless started
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    threads = threading.active_count()  # before stop() joins them
+    robot.stop()
+    joystick.stop()
+    challenge.ros_node.terminate()
+    print('RESULT ' + json.dumps({'cpu': cpu, 'wall': wall, 'threads': threads,
+                                  'loops': challenge.LOOPS.report()}))
+
+def reaction_latency(bridge, t_ready, robot_name=robot_name):
+    # Time from each IR message that first shows the obstacle to the first rotate cmd_vel
+    commands = bridge.published(f'/{robot_name}/cmd_vel')
+    latencies = []
+    blocked = True
+    for stamp, msg in bridge.sent(f'/{robot_name}/ir_intensity'):
+        now_blocked = max(reading['value'] for reading in msg['readings']) > 10
+        if now_blocked and not blocked and stamp > t_ready:
+            for t_command, command in commands:
+                if t_command > stamp and command['angular']['z'] != 0.0:
+                    latencies.append(t_command - stamp)
+                    break
+        blocked = now_blocked
+    return latencies
+
+def run_bench(duration=10.0, ir_rate=20.0, odom_rate=20.0):
+    bridge = FakeRosbridge().start()
+    bridge.add_robot(robot_name, odom_rate=odom_rate, ir_rate=ir_rate, ir_pattern=IrPattern(obstacle=0.5, clear=0.5))
+    env = dict(os.environ, ROSBRIDGE_HOST='127.0.0.1', ROSBRIDGE_PORT=str(bridge.port), SDL_VIDEODRIVER='dummy')
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(duration)],
+                           env=env, capture_output=True, text=True, timeout=duration + 60,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    bridge.stop()
+    results = [line for line in child.stdout.splitlines() if line.startswith('RESULT ')]
+    if not results:
+        print(child.stdout[-2000:], child.stderr[-2000:])
+        raise RuntimeError('benchmark child failed')
+    result = json.loads(results[0][len('RESULT '):])
+
+    subscribed = [stamp for stamp, op, topic, msg in bridge.inbound
+                  if op == 'subscribe' and topic == f'/{robot_name}/ir_intensity']
+    latencies = reaction_latency(bridge, subscribed[0] if subscribed else 0.0)
+    counts = bridge.counts()
+
+    print(f'RobotController, {duration:.0f} s, IR {ir_rate:.0f} Hz, odom {odom_rate:.0f} Hz')
+    if latencies:
+        print(f'  IR -> cmd_vel   p50 {1e3*percentile(latencies, 0.5):6.1f} ms  p99 {1e3*percentile(latencies, 0.99):6.1f} ms'
+              f'  max {1e3*max(latencies):6.1f} ms  ({len(latencies)} obstacles)')
+    else:
+        print('  IR -> cmd_vel   no reactions')
+    for topic in sorted(counts):
+        print(f'  {topic:<28} {counts[topic]/result["wall"]:7.1f} msg/s')
+    print(f'  bridge -> robot  {bridge.sent_count/result["wall"]:7.1f} msg/s')
+    print(f'  cpu per robot    {100*result["cpu"]/result["wall"]:6.1f} % of one core, {result["threads"]} threads while running')
+    if 'loops' in result:
+        print(result['loops'])
+    return latencies, counts, result
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        run_child(float(sys.argv[2]))
+    else:
+        duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+        ir_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+        run_bench(duration, ir_rate)
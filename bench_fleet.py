@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import roslibpy
+from bench_bridge import percentile, reaction_latency
+from fake_rosbridge import FakeRosbridge, IrPattern
+
+# Scales FleetController against fake_rosbridge.py: N robots over one bridge connection,
+# all armed in autonomous mode so each one runs its motion primitives on odometry and
+# turns away from the IR obstacle. Reports IR-to-cmd_vel latency over the whole fleet,
+# received publish rate and the fleet process's CPU.
+
+def robot_names(n):
+    return [f'robot{i:02d}' for i in range(n)]
+
+def run_child(port, n, duration):
+    from fleet import FleetController
+    ros_node = roslibpy.Ros(host='127.0.0.1', port=port)
+    ros_node.run()
+    fleet = FleetController(ros_node, robot_names(n))
+    fleet.press_all('LB')
+    fleet.press_all('B')
+    result = {}
+
+    async def main():
+        task = asyncio.create_task(fleet.run())
+        await asyncio.sleep(1.0)  # settle: subscriptions, first odometry
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        await asyncio.sleep(duration)
+        result['cpu'] = time.process_time() - cpu_start
+        result['wall'] = time.perf_counter() - wall_start
+        result['threads'] = threading.active_count()
+        result['t_start'] = wall_start
+        fleet.stop()
+        await task
+
+    asyncio.run(main())
+    ros_node.terminate()
+    print('RESULT ' + json.dumps(result))
+
+def run_bench(n, duration=10.0, rate=20.0):
+    bridge = FakeRosbridge().start()
+    for name in robot_names(n):
+        bridge.add_robot(name, odom_rate=rate, ir_rate=rate, ir_pattern=IrPattern(obstacle=0.5, clear=1.5))
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(bridge.port), str(n), str(duration)],
+                           capture_output=True, text=True, timeout=duration + 60,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    bridge.stop()
+    results = [line for line in child.stdout.splitlines() if line.startswith('RESULT ')]
+    if not results:
+        print(child.stdout[-2000:], child.stderr[-2000:])
+        raise RuntimeError('benchmark child failed')
+    result = json.loads(results[0][len('RESULT '):])
+
+    latencies = []
+    for name in robot_names(n):
+        subscribed = [stamp for stamp, op, topic, msg in bridge.inbound
+                      if op == 'subscribe' and topic == f'/{name}/ir_intensity']
+        latencies += reaction_latency(bridge, subscribed[0] if subscribed else 0.0, robot_name=name)
+    received = sum(bridge.counts().values())
+    cpu = 100*result['cpu']/result['wall']
+
+    line = f'{n:3d} robots  cpu {cpu:6.1f} % ({cpu/n:5.2f} %/robot)  in {received/duration:7.1f} msg/s  out {bridge.sent_count/duration:7.1f} msg/s'
+    if latencies:
+        line += f'  IR->cmd_vel p50 {1e3*percentile(latencies, 0.5):5.1f} ms p99 {1e3*percentile(latencies, 0.99):5.1f} ms ({len(latencies)})'
+    print(line + f'  {result["threads"]} threads')
+    return cpu, latencies
+
+if __name__ == '__main__':
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        run_child(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        sizes = [int(arg) for arg in sys.argv[1:]] or [1, 5, 10, 20]
+        for n in sizes:
+            run_bench(n)
@@ -0,0 +1,146 @@
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from fake_rosbridge import FakeRosbridge
+from audio_sequencer import MODE_TUNES
+from lights_function import COLORS, make_frame
+from controller_core import MODE_COLORS
+
+# Compares the two controller runtimes against fake_rosbridge.py (no robot, no joystick):
+#  threaded - 6_week_challenge.RobotController, one OS thread per behavior
+#  asyncio  - async_controller.AsyncRobotController, every behavior a coroutine on one loop
+# Each runs in its own child process fed by a QueuedInput that toggles manual/idle mode,
+# while the bridge streams odometry. Reports the child's CPU over the run and the latency
+# from a button press to the cmd_audio and cmd_lightring publishes for the new mode.
+# Press and publish stamps are both time.perf_counter(), one system-wide monotonic clock.
+
+robot_name = 'foxtrot'  # the robot 6_week_challenge.py drives
+
+def press_script(press, presses, interval):
+    # Alternate A (manual) and X (idle), returns [(perf_counter, mode after the press)]
+    pressed = []
+    manual = False
+    time.sleep(interval)
+    for i in range(presses):
+        button = 'X' if manual else 'A'
+        manual = not manual
+        pressed.append((time.perf_counter(), 'manual' if manual else 'idle'))
+        press(button)
+        time.sleep(interval)
+    return pressed
+
+def run_threaded(presses, interval):
+    # Runs inside the child process, ROSBRIDGE_HOST/PORT point 6_week_challenge at the fake bridge
+    from joystick_events import QueuedInput
+    challenge = importlib.import_module('6_week_challenge')
+    events = QueuedInput()
+    joystick = challenge.Joystick(events)
+    robot = challenge.RobotController(joystick)
+    challenge.ros_node.wait(5.0)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    pressed = press_script(events.press, presses, interval)
+    threads = threading.active_count()  # before stop() joins them
+    robot.stop()
+    joystick.stop()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    challenge.ros_node.terminate()
+    return cpu, wall, pressed, threads
+
+def run_async(presses, interval):
+    import asyncio
+    from bridge import connect
+    from joystick_events import QueuedInput
+    from async_controller import AsyncRobotController, ModeState
+    ros_node = connect()
+    events = QueuedInput()
+    controller = AsyncRobotController(ros_node, robot_name, events, state=ModeState())
+    ready = threading.Event()
+
+    async def main():
+        controller.loop = asyncio.get_running_loop()
+        ready.set()
+        await controller.run()
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), daemon=True)
+    thread.start()
+    ready.wait()
+    ros_node.wait(5.0)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    pressed = press_script(events.press, presses, interval)
+    threads = threading.active_count()  # before stop() ends the loop
+    controller.loop.call_soon_threadsafe(controller.stop)
+    thread.join()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    ros_node.terminate()
+    return cpu, wall, pressed, threads
+
+RUNTIMES = {'threaded': run_threaded, 'asyncio': run_async}
+
+def run_child(runtime, presses, interval):
+    cpu, wall, pressed, threads = RUNTIMES[runtime](presses, interval)
+    print('RESULT ' + json.dumps({'cpu': cpu, 'wall': wall, 'pressed': pressed, 'threads': threads}))
+
+def first_after(publishes, t_press, match):
+    for stamp, msg in publishes:
+        if stamp >= t_press and match(msg):
+            return stamp - t_press
+    return None
+
+def measure(name, runtime, presses, interval):
+    bridge = FakeRosbridge().start()
+    bridge.add_robot(robot_name)
+    env = dict(os.environ, ROSBRIDGE_HOST='127.0.0.1', ROSBRIDGE_PORT=str(bridge.port), SDL_VIDEODRIVER='dummy')
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', runtime, str(presses), str(interval)],
+                           env=env, capture_output=True, text=True, timeout=presses*interval + 60,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    bridge.stop()
+    results = [line for line in child.stdout.splitlines() if line.startswith('RESULT ')]
+    if not results:
+        print(child.stdout[-2000:], child.stderr[-2000:])
+        raise RuntimeError(f'{runtime} benchmark child failed')
+    result = json.loads(results[0][len('RESULT '):])
+
+    audio = bridge.published(f'/{robot_name}/cmd_audio')
+    lights = bridge.published(f'/{robot_name}/cmd_lightring')
+    audio_latency = []
+    light_latency = []
+    for t_press, mode in result['pressed']:
+        notes = MODE_TUNES[mode]
+        frame = make_frame(*COLORS[MODE_COLORS[mode]])
+        latency = first_after(audio, t_press, lambda msg: msg['notes'] == notes)
+        if latency is not None:
+            audio_latency.append(latency)
+        latency = first_after(lights, t_press, lambda msg: msg['leds'] == frame)
+        if latency is not None:
+            light_latency.append(latency)
+
+    def summary(values):
+        if not values:
+            return 'n/a'
+        return f'mean {1e3*statistics.mean(values):6.1f} ms  max {1e3*max(values):6.1f} ms  ({len(values)}/{presses})'
+
+    cpu = result['cpu']/result['wall']
+    print(f'{name}')
+    print(f'  cpu            {100*cpu:6.1f} % of one core over {result["wall"]:.1f} s, {result["threads"]} threads while running')
+    print(f'  press -> audio {summary(audio_latency)}')
+    print(f'  press -> light {summary(light_latency)}')
+    return cpu, audio_latency, light_latency
+
+if __name__ == '__main__':
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        presses = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+        interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1.5
+        threaded = measure('threaded (6_week_challenge.RobotController)', 'threaded', presses, interval)
+        asynchronous = measure('asyncio (AsyncRobotController)', 'asyncio', presses, interval)
+        print(f'cpu ratio threaded/asyncio: {threaded[0]/max(asynchronous[0], 1e-9):.1f}x')
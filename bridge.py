@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import roslibpy
+
+# Connection to rosbridge that is opened the first time something uses it and reconnects
+# with exponential backoff after a drop. roslibpy topics re-send their advertise and
+# subscribe ops when the connection comes back, so publishers and subscriptions made
+# through it survive a drop without any help from the controller.
+
+ROSBRIDGE_HOST = os.environ.get('ROSBRIDGE_HOST', '192.168.8.104')
+ROSBRIDGE_PORT = int(os.environ.get('ROSBRIDGE_PORT', 9012))
+INITIAL_DELAY = 0.5  # s before the first reconnect attempt
+MAX_DELAY = 8.0  # s, the longest wait between attempts
+BACKOFF = 2.0  # the wait grows by this factor after every failed attempt
+
+# Stands in for roslibpy.Ros wherever a ros_node goes (roslibpy.Topic, get_lightring,
+# AudioSequencer). Making one costs nothing: the roslibpy.Ros, the twisted reactor and the
+# connection are only created when a topic first reads an attribute of it. Nothing waits
+# for the connection, roslibpy queues what is sent before it is up.
+class LazyRos:
+
+    def __init__(self, host=None, port=None, initial_delay=INITIAL_DELAY, max_delay=MAX_DELAY, backoff=BACKOFF):
+        self.host = ROSBRIDGE_HOST if host is None else host
+        self.port = ROSBRIDGE_PORT if port is None else port
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.ros = None  # the roslibpy.Ros, once started
+        self.ready = threading.Event()
+        self.closing = False
+        self.t_start = None
+        self.t_first = None  # s from start() to the first connection
+        self.dropped_at = None  # time.monotonic() of the last drop while it is down
+
+        # Counters, read them with stats()
+        self.connect_count = 0
+        self.drop_count = 0
+        self.downtime = 0.0  # s spent reconnecting
+
+    def start(self):
+        # The roslibpy.Ros, created and connecting in the background on the first call
+        with self.lock:
+            if self.ros is None:
+                self.t_start = time.monotonic()
+                ros = roslibpy.Ros(host=self.host, port=self.port)
+                factory = ros.factory
+                if hasattr(factory, 'maxDelay'):  # twisted ReconnectingClientFactory
+                    factory.initialDelay = factory.delay = self.initial_delay
+                    factory.maxDelay = self.max_delay
+                    factory.factor = self.backoff
+                ros.on('ready', self.on_ready)
+                ros.on('close', self.on_close)
+                factory.manager.run()  # event loop thread, what ros.run() starts before it blocks
+                self.ros = ros
+            return self.ros
+
+    def __getattr__(self, name):
+        # Everything else is the roslibpy.Ros's, reading it starts the connection
+        if name.startswith('__') or name in ('ros', 'lock'):
+            raise AttributeError(name)
+        return getattr(self.start(), name)
+
+    @property
+    def is_connected(self):
+        return self.start().is_connected
+
+    def on_ready(self, proto):
+        now = time.monotonic()
+        if self.t_first is None:
+            self.t_first = now - self.t_start
+        if self.dropped_at is not None:
+            down = now - self.dropped_at
+            self.downtime += down
+            self.dropped_at = None
+            print(f"Reconnected to rosbridge at {self.host}:{self.port} after {down:.1f} s")
+        self.connect_count += 1
+        self.ready.set()
+
+    def on_close(self, proto):
+        self.ready.clear()
+        if self.closing or self.dropped_at is not None:
+            return
+        self.drop_count += 1
+        self.dropped_at = time.monotonic()
+        print(f"Lost rosbridge at {self.host}:{self.port}, reconnecting")
+
+    def wait(self, timeout=None):
+        # Block until connected, returns False on timeout
+        self.start()
+        return self.ready.wait(timeout)
+
+    def stats(self):
+        factory = self.ros.factory if self.ros is not None else None
+        return {
+            'connected': self.ros is not None and self.ros.is_connected,
+            'connects': self.connect_count,
+            'drops': self.drop_count,
+            'retries': getattr(factory, 'retries', 0),  # failed attempts since the last connect
+            'first_connect': self.t_first,
+            'downtime': self.downtime + (time.monotonic() - self.dropped_at if self.dropped_at is not None else 0.0),
+        }
+
+    def terminate(self):
+        # Close and stop the event loop, a no-op if the connection was never used
+        self.closing = True
+        if self.ros is not None:
+            factory = self.ros.factory
+            if hasattr(factory, 'stopTrying'):
+                factory.stopTrying()
+            self.ros.terminate()
+
+def connect(host=None, port=None, **kwargs):
+    # Lazily connected ros_node, ROSBRIDGE_HOST/ROSBRIDGE_PORT pick the default bridge
+    return LazyRos(host, port, **kwargs)
@@ -3,6 +3,7 @@ import roslibpy
 import threading
 import math
 import random
+from cmd_vel import TwistPublisher
 
 # establish roslibpy connection to sim
 ros_node = roslibpy.Ros(host='127.0.0.1', port=9012)
@@ -25,15 +26,14 @@ class RobotController:
         self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
         # publisher on cmd_vel topic
         self.circle_track_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
+        self.circle_track_cmd = TwistPublisher(self.circle_track_pub)
         # publisher to cmd_audio topic
         self.audio_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_audio', 'irobot_create_msgs/AudioNoteVector')
 
     def circle_track(self):
         # placeholder for robot movement
         while not self.stop_event.is_set():
-            drive_message = {'linear':{'x':1, 'y':0, 'z':0}, 
-                            'angular':{'x':0, 'y':0, 'z':2}}
-            self.circle_track_pub.publish(roslibpy.Message(drive_message))
+            self.circle_track_cmd.publish(1.0, 2.0)
             time.sleep(0.25)
 
     def random_led(self):
@@ -0,0 +1,174 @@
+import threading
+import time
+from loop_timing import loop_timer
+from velocity_profile import LINEAR_LIMITS, ANGULAR_LIMITS, SlewLimiter
+
+# Default command sources: (name, priority, timeout in s), higher priority wins.
+# A source drops out once it has not submitted for `timeout` s, None keeps it until released.
+DEFAULT_SOURCES = (
+    ('safety', 3, None),
+    ('ir', 2, 0.3),
+    ('manual', 1, 0.5),
+    ('autonomous', 0, 0.5),
+)
+
+# Sources whose raw commands the mux slew limits. manual (TeleopShaper) and autonomous
+# (motion.py profiles) arrive shaped already, and a safety stop does not ramp.
+SHAPED_SOURCES = ('ir',)
+
+# Latest command of one named source
+class CommandSource:
+    __slots__ = ('name', 'priority', 'timeout', 'linear_x', 'angular_z', 'stamp', 'active', 'submitted', 'wins')
+
+    def __init__(self, name, priority, timeout=None):
+        self.name = name
+        self.priority = priority
+        self.timeout = timeout
+        self.linear_x = 0.0
+        self.angular_z = 0.0
+        self.stamp = 0.0  # time.monotonic() of the last submit
+        self.active = False
+        self.submitted = 0
+        self.wins = 0  # output ticks this source won
+
+    def expired(self, now):
+        return self.timeout is not None and now - self.stamp > self.timeout
+
+# Arbitrates cmd_vel between sources: every tick the highest priority live source is
+# published once through a TwistPublisher, nothing else reaches the topic. The raw commands
+# of SHAPED_SOURCES (an IR override) are slew limited from whatever went out before them,
+# every other source goes out as submitted.
+class CmdVelMux:
+
+    def __init__(self, cmd_vel, rate=20.0, sources=DEFAULT_SOURCES, linear_limits=LINEAR_LIMITS,
+                 angular_limits=ANGULAR_LIMITS):
+        # cmd_vel: TwistPublisher, rate: output rate in Hz, limits as in velocity_profile.py
+        self.cmd_vel = cmd_vel
+        self.period = 1.0/rate
+        self.linear = SlewLimiter(linear_limits)
+        self.angular = SlewLimiter(angular_limits)
+        self.lock = threading.Lock()
+        self.sources = {}
+        for name, priority, timeout in sources:
+            self.add_source(name, priority, timeout)
+
+        self.winner = None  # name of the source that won the last tick, None when idle
+        self.idle = True  # no live source and the stop has been sent
+        self.switches = 0
+        self.ticks = 0
+        self.published = 0
+        self.limited = 0  # ticks whose output the slew limiters changed
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def add_source(self, name, priority, timeout=None):
+        with self.lock:
+            self.sources[name] = CommandSource(name, priority, timeout)
+        return self.sources[name]
+
+    def submit(self, name, linear_x=0.0, angular_z=0.0):
+        # Record the latest command of a source, it goes out on the next tick if the source wins
+        with self.lock:
+            source = self.sources[name]
+            source.linear_x = linear_x
+            source.angular_z = angular_z
+            source.stamp = time.monotonic()
+            source.active = True
+            source.submitted += 1
+
+    def release(self, name):
+        # Drop a source right away instead of waiting for its timeout
+        with self.lock:
+            self.sources[name].active = False
+
+    def select(self, now):
+        # lock must be held
+        best = None
+        for source in self.sources.values():
+            if not source.active:
+                continue
+            if source.expired(now):
+                source.active = False
+                continue
+            if best is None or source.priority > best.priority:
+                best = source
+        return best
+
+    def tick(self, now=None):
+        # Publish one coalesced command, returns the winning source name
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            source = self.select(now)
+            name = source.name if source is not None else None
+            if source is not None:
+                source.wins += 1
+                command = (source.linear_x, source.angular_z)
+            self.ticks += 1
+            if name != self.winner:
+                self.switches += 1
+                self.winner = name
+
+        if source is not None:
+            if name in SHAPED_SOURCES:
+                if self.idle:
+                    # from rest, the first tick ramps up like every other one
+                    self.linear.reset(stamp=now - self.period)
+                    self.angular.reset(stamp=now - self.period)
+                output = (self.linear.step(command[0], now), self.angular.step(command[1], now))
+                if output != command:
+                    self.limited += 1
+            else:
+                # the limiters follow the output, so a shaped source takes over from it
+                self.linear.reset(command[0], now)
+                self.angular.reset(command[1], now)
+                output = command
+            self.cmd_vel.publish(*output)
+            self.published += 1
+            self.idle = False
+        elif not self.idle:
+            # Last source went away, stop once and then stay quiet
+            self.cmd_vel.stop()
+            self.published += 1
+            self.idle = True
+        return name
+
+    def run(self):
+        # Output loop on an absolute schedule, late ticks are skipped rather than bunched
+        timer = loop_timer('cmd_mux', self.period)
+        t_start = time.monotonic()
+        tick = 0
+        while not self.stop_event.is_set():
+            timer.begin()
+            self.tick()
+            tick = max(tick + 1, int((time.monotonic() - t_start)/self.period) + 1)
+            delay = t_start + tick*self.period - time.monotonic()
+            if delay > 0:
+                timer.wait(self.stop_event, delay)
+            else:
+                timer.end()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.cmd_vel.stop()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'winner': self.winner,
+                'ticks': self.ticks,
+                'published': self.published,
+                'switches': self.switches,
+                'limited': self.limited,
+                'submitted': {name: source.submitted for name, source in self.sources.items()},
+                'wins': {name: source.wins for name, source in self.sources.items()},
+            }
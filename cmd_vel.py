@@ -0,0 +1,185 @@
+import json
+import time
+from collections import OrderedDict
+import roslibpy
+
+def twist_message(linear_x=0.0, angular_z=0.0):
+    # geometry_msgs/Twist body for a planar robot
+    return {'linear': {'x': linear_x, 'y': 0.0, 'z': 0.0},
+            'angular': {'x': 0.0, 'y': 0.0, 'z': angular_z}}
+
+# Cached data for one (linear.x, angular.z) command
+class TwistEntry:
+    __slots__ = ('message', 'payload', 'send')
+
+    def __init__(self, topic_name, linear_x, angular_z):
+        body = twist_message(linear_x, angular_z)
+        self.message = roslibpy.Message(body)
+        # Complete rosbridge publish op, encoded once. The id field is optional in the protocol.
+        self.payload = json.dumps({'op': 'publish', 'topic': topic_name, 'msg': body}).encode('utf8')
+        payload = self.payload
+
+        def send(proto):
+            proto.send_message(payload)
+            return proto
+        self.send = send
+
+# cmd_vel publisher that reuses messages and encoded payloads for repeated commands
+class TwistPublisher:
+
+    def __init__(self, topic, cache_size=64, raw=True, drop_offline=True):
+        # topic: roslibpy.Topic of type geometry_msgs/Twist
+        # raw: hand the cached payload straight to the websocket instead of letting
+        #      roslibpy re-encode the message, falls back to topic.publish if unavailable
+        # drop_offline: drop commands while the bridge is down, roslibpy would queue them
+        #      and send every stale one at once on reconnect
+        self.topic = topic
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.raw = raw and hasattr(topic.ros, 'factory')
+        self.drop_offline = drop_offline and hasattr(topic.ros, 'is_connected')
+        self.last = None  # (linear_x, angular_z) of the last published command
+        self.on_publish = None  # optional function(linear_x, angular_z), e.g. a FlightRecorder
+
+        self.published = 0
+        self.encoded = 0  # cache misses, each one encodes a payload
+        self.hits = 0
+        self.dropped = 0  # commands dropped while the bridge was down
+
+        # Entries for the common commands stay pinned outside the LRU
+        self.stop_entry = TwistEntry(topic.name, 0.0, 0.0)
+        self.pinned = {(0.0, 0.0): self.stop_entry}
+
+    def entry(self, linear_x, angular_z):
+        key = (float(linear_x), float(angular_z))
+        entry = self.pinned.get(key)
+        if entry is not None:
+            self.hits += 1
+            return key, entry
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return key, entry
+        entry = TwistEntry(self.topic.name, key[0], key[1])
+        self.encoded += 1
+        self.cache[key] = entry
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return key, entry
+
+    def pin(self, linear_x=0.0, angular_z=0.0):
+        # Keep a command (e.g. forward at the cruise speed) cached for the life of the publisher
+        key = (float(linear_x), float(angular_z))
+        if key not in self.pinned:
+            self.pinned[key] = TwistEntry(self.topic.name, key[0], key[1])
+            self.encoded += 1
+
+    def publish(self, linear_x=0.0, angular_z=0.0):
+        key, entry = self.entry(linear_x, angular_z)
+        if self.drop_offline and not self.topic.ros.is_connected:
+            self.dropped += 1
+            self.last = key
+            return
+        if self.raw:
+            if not self.topic.is_advertised:
+                self.topic.advertise()
+            self.topic.ros.factory.on_ready(entry.send)
+        else:
+            self.topic.publish(entry.message)
+        self.published += 1
+        self.last = key
+        if self.on_publish is not None:
+            self.on_publish(key[0], key[1])
+
+    def stop(self):
+        self.publish(0.0, 0.0)
+
+    def forward(self, speed):
+        self.publish(speed, 0.0)
+
+    def rotate(self, rate):
+        self.publish(0.0, rate)
+
+    def drive_for(self, linear_x, angular_z, duration, rate=10.0, stop_event=None):
+        # Publish the command at `rate` Hz for `duration` s, then stop. Ticks are on an absolute
+        # schedule (start + n/rate) so sleep jitter never accumulates, ticks missed after an
+        # overrun are skipped rather than burst out. Returns the number of messages sent.
+        period = 1.0/rate
+        t_start = time.monotonic()
+        t_end = t_start + duration
+        sent = 0
+        tick = 0
+        now = t_start
+        while now < t_end:
+            self.publish(linear_x, angular_z)
+            sent += 1
+            tick = max(tick + 1, int((time.monotonic() - t_start)/period) + 1)
+            deadline = min(t_start + tick*period, t_end)
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                if stop_event is None:
+                    time.sleep(delay)
+                elif stop_event.wait(delay):
+                    break
+            now = time.monotonic()
+        self.stop()
+        return sent + 1
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'encoded': self.encoded,
+            'hits': self.hits,
+            'dropped': self.dropped,
+            'cached': len(self.cache) + len(self.pinned),
+        }
+
+# Micro-benchmark: publish-path CPU per message, old dict + Message path vs TwistPublisher
+if __name__ == '__main__':
+    from roslibpy.comm import RosBridgeProtocol
+
+    class NullProtocol(RosBridgeProtocol):
+        # Stands in for the websocket, counts the bytes that would be sent
+        def __init__(self):
+            super().__init__()
+            self.sent_bytes = 0
+
+        def send_message(self, payload):
+            self.sent_bytes += len(payload)
+
+    def make_topic():
+        ros = roslibpy.Ros(host='127.0.0.1', port=9012)  # never connected
+        ros.factory._proto = NullProtocol()
+        return roslibpy.Topic(ros, '/bench/cmd_vel', 'geometry_msgs/Twist')
+
+    def bench(name, publish, n):
+        t_start = time.process_time()
+        for i in range(n):
+            publish(i)
+        cpu = time.process_time() - t_start
+        print(f'{name:<28} {1e6*cpu/n:7.2f} us/msg')
+        return cpu/n
+
+    n = 20000
+    commands = [(0.15, 0.0), (0.0, -0.5), (0.0, 0.5), (0.0, 0.0)]  # what the drive loops actually send
+
+    topic = make_topic()
+    def old_publish(i):
+        linear_x, angular_z = commands[i % len(commands)]
+        drive_message = {'linear': {'x': linear_x, 'y': 0.0, 'z': 0.0},
+                        'angular': {'x': 0.0, 'y': 0.0, 'z': angular_z}}
+        topic.publish(roslibpy.Message(drive_message))
+
+    publisher = TwistPublisher(make_topic(), drop_offline=False)
+    def new_publish(i):
+        publisher.publish(*commands[i % len(commands)])
+
+    message_publisher = TwistPublisher(make_topic(), raw=False, drop_offline=False)
+    def message_publish(i):
+        message_publisher.publish(*commands[i % len(commands)])
+
+    before = bench('dict + roslibpy.Message', old_publish, n)
+    cached = bench('TwistPublisher (Message)', message_publish, n)
+    after = bench('TwistPublisher (payload)', new_publish, n)
+    print(f'speedup {before/after:.1f}x, {publisher.stats()}')
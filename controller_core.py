@@ -0,0 +1,104 @@
+# What the threaded 6_week_challenge.py and the asyncio async_controller.py share: the
+# constants, the joystick mode rules and the IR override. Both runtimes import them from
+# here, so they decide the same way.
+
+# IR avoidance: any sensor over 10 counts, turn away from front obstacles, only report side ones
+IR_THRESHOLDS = 10
+IR_ACTIONS = {
+    'front': 'rotate_right',
+    'front_left': 'rotate_right',
+    'front_right': 'rotate_left',
+    'clear': 'forward',
+}
+
+# Motion primitives: speeds, stop tolerances and the longest a primitive may run
+DRIVE_SPEED = 0.15  # m/s
+DRIVE_TOLERANCE = 0.01  # m
+TURN_RATE = 0.5  # rad/s
+TURN_TOLERANCE = 0.02  # rad
+PRIMITIVE_TIMEOUT = 30.0  # s
+
+# Mowing field, planned from the pose where autonomous mode starts
+MOW_LENGTH = 1.5  # m, lane length along the starting heading
+MOW_WIDTH = 1.4  # m, to the right of the start
+TOOL_WIDTH = 0.35  # m between lanes
+
+# cmd_vel output rate of the command multiplexer
+CMD_RATE = 20  # Hz
+
+# Lightring color of each mode, the armed-only mode keeps the last color
+MODE_COLORS = {'manual': 'Green', 'idle': 'Blue', 'autonomous': 'Yellow'}
+
+# Mode flags and stick axes, changed by button presses: A manual, X idle, B autonomous,
+# LB arms. The runtimes add how a change is announced.
+class RobotModes:
+
+    def __init__(self):
+        self.manual_mode = False
+        self.idle_mode = True
+        self.autonomous_mode = False
+        self.armed = False
+        self.linear_x = 0.0
+        self.angular_z = 0.0
+        self.color = MODE_COLORS['idle']
+
+    def press(self, button):
+        # Apply one button press, returns False for a button that changes nothing
+        if button == 'A':
+            self.manual_mode = not self.manual_mode
+            self.idle_mode = False
+            self.autonomous_mode = False
+            print(f"Manual mode {'activated' if self.manual_mode else 'deactivated'}")
+        elif button == 'X':
+            self.idle_mode = not self.idle_mode
+            self.manual_mode = False
+            self.autonomous_mode = False
+            print(f"Secondary mode {'activated' if self.idle_mode else 'deactivated'}")
+        elif button == 'B':
+            self.autonomous_mode = not self.autonomous_mode
+            self.manual_mode = False
+            self.idle_mode = False
+            print(f"Autonomous mode {'activated' if self.autonomous_mode else 'deactivated'}")
+        elif button == 'LB':
+            self.armed = not self.armed
+            print(f"Robot {'armed' if self.armed else 'disarmed'}")
+        else:
+            return False
+
+        self.color = MODE_COLORS.get(self.mode, self.color)
+        if not self.manual_mode or not self.armed:
+            self.linear_x = 0.0
+            self.angular_z = 0.0
+        return True
+
+    def set_axes(self, x_axis, y_axis):
+        # Stick position, it only drives in manual mode while armed
+        if self.manual_mode and self.armed:
+            self.linear_x = -y_axis  # Invert Y-axis for forward/backward
+            self.angular_z = -x_axis  # X-axis for rotation
+
+    @property
+    def mode(self):
+        # Mode whose tune plays, manual > idle > autonomous > armed
+        if self.manual_mode:
+            return 'manual'
+        if self.idle_mode:
+            return 'idle'
+        if self.autonomous_mode:
+            return 'autonomous'
+        if self.armed:
+            return 'armed'
+        return None
+
+def ir_override(mux, zone, action, pose, grid):
+    # Hand one filtered IR decision to the 'ir' source of a CmdVelMux. Side obstacles only
+    # get reported: the override lapses on its mux timeout unless the path is clear.
+    if zone == 'front' and pose is not None:
+        # Straight ahead: turn toward the side the map shows more open
+        mux.submit('ir', 0.0, grid.freer_side(pose.x, pose.y, pose.yaw))
+    elif action == 'rotate_right':
+        mux.submit('ir', 0.0, -1.0)  # Rotate right
+    elif action == 'rotate_left':
+        mux.submit('ir', 0.0, 1.0)  # Rotate left
+    elif action == 'forward':
+        mux.release('ir')  # Path clear, hand control back to manual/autonomous
@@ -0,0 +1,234 @@
+import math
+import time
+import numpy as np
+
+# Coverage planning for mowing: lanes across a field polygon, one tool width apart, joined
+# by turn arcs into one waypoint path, plus a grid meter of the area actually covered.
+
+def rotate(points, angle):
+    c = math.cos(angle)
+    s = math.sin(angle)
+    points = np.asarray(points, dtype=float)
+    return np.stack((c*points[..., 0] - s*points[..., 1], s*points[..., 0] + c*points[..., 1]), axis=-1)
+
+def polygon_area(polygon):
+    x, y = np.asarray(polygon, dtype=float).T
+    return 0.5*abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def inside(polygon, points):
+    # Even-odd point in polygon test for points (..., 2)
+    polygon = np.asarray(polygon, dtype=float)
+    px = points[..., 0][..., None]
+    py = points[..., 1][..., None]
+    x0, y0 = polygon.T
+    x1, y1 = np.roll(polygon, -1, axis=0).T
+    crosses = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (py - y0)*(x1 - x0)/(y1 - y0)
+    return (crosses & (px < x_cross)).sum(axis=-1) % 2 == 1
+
+def field_ahead(odom, length, width, tool_width, side=-1):
+    # Field with the robot at the start of its first lane: lanes `length` long along the
+    # robot's heading, stacked `width` to its right (side=-1) or left (side=1)
+    half = 0.5*tool_width
+    corners = np.array([(-half, half), (length + half, half),
+                        (length + half, half - width), (-half, half - width)])
+    corners[:, 1] *= -side
+    return rotate(corners, odom.yaw) + (odom.x, odom.y)
+
+def scanline(polygon, y):
+    # Sorted x intervals where the horizontal line at y lies inside polygon
+    x0, y0 = polygon.T
+    x1, y1 = np.roll(polygon, -1, axis=0).T
+    crosses = (y0 > y) != (y1 > y)
+    xs = np.sort(x0[crosses] + (y - y0[crosses])*(x1[crosses] - x0[crosses])/(y1[crosses] - y0[crosses]))
+    return list(zip(xs[0::2], xs[1::2]))
+
+def sweep_lanes(polygon, tool_width, angle):
+    # Lanes (n, 2, 2) along direction `angle`, one tool width apart, inset half a tool width
+    local = rotate(polygon, -angle)
+    y_min = local[:, 1].min()
+    y_max = local[:, 1].max()
+    half = 0.5*tool_width
+    n = max(1, int(math.ceil((y_max - y_min)/tool_width - 1e-9)))
+    offsets = y_min + half + tool_width*np.arange(n)
+    offsets[-1] = min(offsets[-1], y_max - half)  # last lane overlaps instead of overhanging
+    lanes = []
+    for y in offsets:
+        for x_start, x_end in scanline(local, y):
+            if x_end - x_start > 2*half:
+                x_start += half
+                x_end -= half
+            else:
+                x_start = x_end = 0.5*(x_start + x_end)
+            lanes.append(((x_start, y), (x_end, y)))
+    if not lanes:
+        return np.zeros((0, 2, 2))
+    return rotate(np.array(lanes), angle)
+
+def order_lanes(lanes, start=None):
+    # Greedy nearest end ordering, each lane may be driven either way. For a convex field
+    # this is the plain boustrophedon, for concave fields it visits the pieces in turn.
+    remaining = list(range(len(lanes)))
+    position = lanes[0][0] if start is None else np.asarray(start, dtype=float)
+    ordered = []
+    while remaining:
+        ends = lanes[remaining]  # (k, 2, 2)
+        gaps = np.hypot(*(ends - position).transpose(2, 0, 1))  # (k, 2)
+        k, end = np.unravel_index(np.argmin(gaps), gaps.shape)
+        lane = lanes[remaining.pop(k)]
+        if end == 1:
+            lane = lane[::-1]
+        ordered.append(lane)
+        position = lane[1]
+    return np.array(ordered)
+
+def turn_points(a, b, heading, spacing):
+    # Waypoints from lane end a to the next lane start b: a half circle when the lanes are
+    # adjacent and parallel (one continuous U-turn), else a straight transit
+    gap = b - a
+    across = np.array((-heading[1], heading[0]))
+    offset = np.dot(gap, across)
+    along = np.dot(gap, heading)
+    radius = 0.5*abs(offset)
+    if radius > 0 and abs(along) < 0.25*radius:
+        center = a + 0.5*gap
+        n = max(2, int(math.ceil(math.pi*radius/spacing)))
+        sweep = np.linspace(0.0, math.pi, n + 1)[1:-1]
+        start = a - center
+        turn = math.copysign(1.0, offset)  # left turn when b is to the left
+        return [center + rotate(start, turn*angle) for angle in sweep]
+    n = int(math.floor(np.hypot(*gap)/spacing))
+    return [a + gap*i/(n + 1) for i in range(1, n + 1)]
+
+def lane_points(x, y, heading, length):
+    # Straight lane of `length` m from (x, y) along heading (rad)
+    return [(x, y), (x + length*math.cos(heading), y + length*math.sin(heading))]
+
+def u_turn_points(x, y, heading, lane_spacing, left, spacing=0.05):
+    # Half circle from a lane end at (x, y) to the start of the next lane, lane_spacing to the
+    # left or right, driven back along the opposite heading
+    a = np.array((x, y))
+    direction = np.array((math.cos(heading), math.sin(heading)))
+    across = np.array((-direction[1], direction[0]))
+    b = a + (1.0 if left else -1.0)*lane_spacing*across
+    return [a] + turn_points(a, b, direction, spacing) + [b]
+
+# Lane plan for one field: the sweep direction is the one with the fewest lanes, i.e. the
+# fewest turns, tried along every polygon edge
+class CoveragePlan:
+
+    def __init__(self, polygon, tool_width, speed=0.15, start=None, angle=None, spacing=0.1):
+        self.polygon = np.asarray(polygon, dtype=float)
+        self.tool_width = tool_width
+        self.speed = speed  # m/s the follower drives at, for the planned rate
+        self.spacing = spacing  # m between waypoints on lanes and turns
+        if angle is None:
+            angle = self.best_angle()
+        self.angle = angle
+        self.lanes = order_lanes(sweep_lanes(self.polygon, tool_width, angle), start)
+        self.path = self.build_path()
+        self.length = float(np.hypot(*np.diff(self.path, axis=0).T).sum()) if len(self.path) > 1 else 0.0
+        self.area = polygon_area(self.polygon)
+
+    def best_angle(self):
+        edges = np.diff(np.vstack((self.polygon, self.polygon[:1])), axis=0)
+        angles = np.unique(np.round(np.arctan2(edges[:, 1], edges[:, 0]) % math.pi, 6))
+        return min(angles, key=lambda angle: len(sweep_lanes(self.polygon, self.tool_width, angle)))
+
+    def build_path(self):
+        points = []
+        for i, (a, b) in enumerate(self.lanes):
+            if i:
+                points += turn_points(points[-1], a, heading, self.spacing)
+            heading = (b - a)/max(np.hypot(*(b - a)), 1e-9)
+            n = max(1, int(math.ceil(np.hypot(*(b - a))/self.spacing)))
+            points += [a + (b - a)*j/n for j in range(n + 1)]
+        return np.array(points).reshape(-1, 2)
+
+    def turns(self):
+        return max(0, len(self.lanes) - 1)
+
+    def duration(self):
+        return self.length/self.speed
+
+    def planned_rate(self):
+        # m²/min if the follower holds `speed` along the whole path
+        return 60.0*self.area/self.duration() if self.length else 0.0
+
+    def waypoints(self, reverse=False):
+        # Waypoint stream for a follower, (x, y) floats
+        path = self.path[::-1] if reverse else self.path
+        for x, y in path:
+            yield float(x), float(y)
+
+    def __repr__(self):
+        return (f'CoveragePlan({len(self.lanes)} lanes, {self.turns()} turns, {self.length:.2f} m, '
+                f'{self.area:.2f} m², {self.planned_rate():.2f} m²/min planned)')
+
+# Area covered so far on a grid over the field: every odometry pose stamps the tool width
+# along the segment from the previous pose
+class CoverageMeter:
+
+    def __init__(self, polygon, tool_width, resolution=0.02):
+        self.polygon = np.asarray(polygon, dtype=float)
+        self.half = 0.5*tool_width
+        self.resolution = resolution
+        self.origin = self.polygon.min(axis=0)
+        shape = np.ceil((self.polygon.max(axis=0) - self.origin)/resolution).astype(int) + 1
+        ys, xs = np.mgrid[0:shape[1], 0:shape[0]]
+        self.centers = np.stack((xs, ys), axis=-1)*resolution + self.origin  # (ny, nx, 2)
+        self.field = inside(self.polygon, self.centers)
+        self.covered = np.zeros(self.field.shape, dtype=bool)
+        self.cell_area = resolution*resolution
+        self.last = None
+        self.t_start = None
+        self.t_last = None
+
+    def update(self, x, y, stamp=None):
+        if stamp is None:
+            stamp = time.monotonic()
+        if self.t_start is None:
+            self.t_start = stamp
+        self.t_last = stamp
+        p = np.array((x, y))
+        a = p if self.last is None else self.last
+        self.last = p
+        # only the cells in the bounding box of the swept segment
+        low = np.floor((np.minimum(a, p) - self.half - self.origin)/self.resolution).astype(int)
+        high = np.ceil((np.maximum(a, p) + self.half - self.origin)/self.resolution).astype(int) + 1
+        low = np.maximum(low, 0)
+        high = np.minimum(high, self.field.shape[::-1])
+        if np.any(high <= low):
+            return
+        centers = self.centers[low[1]:high[1], low[0]:high[0]]
+        s = p - a
+        length2 = np.dot(s, s)
+        ap = centers - a
+        u = np.clip((ap @ s)/length2, 0.0, 1.0) if length2 > 0 else 0.0
+        d = ap - u[..., None]*s if length2 > 0 else ap
+        self.covered[low[1]:high[1], low[0]:high[0]] |= (d*d).sum(axis=-1) <= self.half*self.half
+
+    def on_odom(self, record):
+        # OdomRecord from OdomState.snapshot()
+        self.update(record.x, record.y, record.stamp)
+
+    def area(self):
+        return float((self.covered & self.field).sum())*self.cell_area
+
+    def fraction(self):
+        return (self.covered & self.field).sum()/max(1, self.field.sum())
+
+    def elapsed(self):
+        return 0.0 if self.t_start is None else self.t_last - self.t_start
+
+    def rate(self):
+        # Achieved m²/min
+        elapsed = self.elapsed()
+        return 60.0*self.area()/elapsed if elapsed > 0 else 0.0
+
+    def reset(self):
+        self.covered[:] = False
+        self.last = None
+        self.t_start = None
+        self.t_last = None
@@ -0,0 +1,264 @@
+import math
+import time
+import numpy as np
+from ir_buffer import SENSOR_ANGLES, ROBOT_RADIUS, IR_RANGE, IrRingBuffer, IrZoneClassifier, IrFilter, ir_message, ir_intensity
+from odometry import OdomState, odom_message
+from motion import MotionEngine, FollowPath
+from coverage_plan import CoveragePlan, CoverageMeter, field_ahead
+from occupancy_grid import OccupancyGrid
+from ir_mower import IR_THRESHOLDS, IR_ACTIONS, IrMower, mower_settings
+
+# Headless differential-drive Create3 on a virtual clock: cmd_vel in, nav_msgs/Odometry and
+# seven-beam IrIntensityVector out. Nothing sleeps, a run goes as fast as the CPU allows.
+# The IR readings follow the beam model in ir_buffer.py.
+
+SENSOR_RAD = np.radians(SENSOR_ANGLES)
+
+# Obstacles as closed polygons, every edge kept in flat arrays for vectorized queries
+class World:
+
+    def __init__(self, polygons):
+        starts = []
+        ends = []
+        for polygon in polygons:
+            points = np.asarray(polygon, dtype=float)
+            starts.append(points)
+            ends.append(np.roll(points, -1, axis=0))
+        self.a = np.concatenate(starts)  # (m, 2) edge start points
+        self.s = np.concatenate(ends) - self.a  # (m, 2) edge vectors
+        self.polygons = [np.asarray(polygon, dtype=float) for polygon in polygons]
+
+    @classmethod
+    def field(cls, width, height, boxes=()):
+        # Walled width x height field with its corner at the origin, boxes: (x, y, w, h)
+        polygons = [[(0.0, 0.0), (width, 0.0), (width, height), (0.0, height)]]
+        for x, y, w, h in boxes:
+            polygons.append([(x, y), (x + w, y), (x + w, y + h), (x, y + h)])
+        return cls(polygons)
+
+    def cast(self, origins, angles, max_range=np.inf):
+        # Distance along each ray (origins (k, 2), angles (k,)) to the nearest edge
+        r = np.stack((np.cos(angles), np.sin(angles)), axis=-1)[:, None, :]  # (k, 1, 2)
+        ap = self.a[None, :, :] - origins[:, None, :]  # (k, m, 2)
+        s = self.s[None, :, :]
+        denom = r[..., 0]*s[..., 1] - r[..., 1]*s[..., 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (ap[..., 0]*s[..., 1] - ap[..., 1]*s[..., 0])/denom
+            u = (ap[..., 0]*r[..., 1] - ap[..., 1]*r[..., 0])/denom
+        hit = (np.abs(denom) > 1e-12) & (t >= 0.0) & (u >= 0.0) & (u <= 1.0)
+        return np.minimum(np.where(hit, t, np.inf).min(axis=1), max_range)
+
+    def clearance(self, x, y):
+        # Distance from a point to the nearest edge
+        ap = np.array((x, y)) - self.a
+        u = np.clip((ap*self.s).sum(axis=1)/(self.s*self.s).sum(axis=1), 0.0, 1.0)
+        closest = self.a + u[:, None]*self.s
+        return float(np.hypot(*(np.array((x, y)) - closest).T).min())
+
+# Kinematic Create3: commanded velocities apply immediately, the body stops at walls
+class Create3Sim:
+
+    def __init__(self, world, x=0.0, y=0.0, yaw=0.0, dt=0.01, odom_rate=20.0, ir_rate=62.0):
+        self.world = world
+        self.x = x
+        self.y = y
+        self.yaw = yaw
+        self.dt = dt
+        self.t = 0.0  # virtual clock (s)
+        self.linear = 0.0
+        self.angular = 0.0
+        self.odom_period = 1.0/odom_rate
+        self.ir_period = 1.0/ir_rate
+        self.next_odom = 0.0
+        self.next_ir = 0.0
+        self.distance = 0.0  # m driven
+        self.bumps = 0  # contact episodes
+        self.touching = False
+        self.steps = 0
+
+    def cmd_vel(self, linear_x, angular_z):
+        self.linear = linear_x
+        self.angular = angular_z
+
+    def on_twist(self, message):
+        # geometry_msgs/Twist dict, e.g. from a roslibpy subscription
+        self.cmd_vel(message['linear']['x'], message['angular']['z'])
+
+    def step(self):
+        yaw = self.yaw + 0.5*self.angular*self.dt  # midpoint heading
+        x = self.x + self.linear*math.cos(yaw)*self.dt
+        y = self.y + self.linear*math.sin(yaw)*self.dt
+        if self.linear != 0.0 and self.world.clearance(x, y) < ROBOT_RADIUS:
+            # blocked, the wheels slip and only the rotation happens
+            if not self.touching:
+                self.bumps += 1
+            self.touching = True
+        else:
+            self.distance += math.hypot(x - self.x, y - self.y)
+            self.x = x
+            self.y = y
+            self.touching = False
+        self.yaw = (self.yaw + self.angular*self.dt + math.pi) % (2*math.pi) - math.pi
+        self.t += self.dt
+        self.steps += 1
+
+    def odom_message(self):
+        return odom_message(self.x, self.y, self.yaw, self.linear, self.angular)
+
+    def ir_values(self):
+        angles = self.yaw + SENSOR_RAD
+        origins = np.stack((self.x + ROBOT_RADIUS*np.cos(angles), self.y + ROBOT_RADIUS*np.sin(angles)), axis=-1)
+        return ir_intensity(self.world.cast(origins, angles, IR_RANGE))
+
+    def ir_message(self):
+        return ir_message(self.ir_values())
+
+    def advance(self, odom_callback=None, ir_callback=None):
+        # One physics step, then any sensor messages that fell due on the virtual clock
+        self.step()
+        if self.t >= self.next_odom:
+            self.next_odom += self.odom_period
+            if odom_callback is not None:
+                odom_callback(self.odom_message())
+        if self.t >= self.next_ir:
+            self.next_ir += self.ir_period
+            if ir_callback is not None:
+                ir_callback(self.ir_message())
+
+    def run(self, duration, odom_callback=None, ir_callback=None, until=None):
+        # Advance `duration` virtual seconds, or until until() is true
+        t_end = self.t + duration
+        while self.t < t_end:
+            self.advance(odom_callback, ir_callback)
+            if until is not None and until():
+                break
+
+# Runs motion primitives against a Create3Sim, single threaded: every odometry message runs the
+# engine's control step synchronously, so results do not depend on thread scheduling
+class SimRunner:
+
+    def __init__(self, sim, ir_thresholds, ir_actions=None, grid=None):
+        # grid: an OccupancyGrid to map the IR readings into, mapping about halves the sim speed
+        self.sim = sim
+        self.odom = OdomState()
+        self.motion = MotionEngine(self.odom, sim.cmd_vel)
+        self.ir_buffer = IrRingBuffer()
+        self.ir_classifier = IrZoneClassifier(ir_thresholds, ir_actions)
+        self.ir_filter = IrFilter(self.ir_classifier)
+        self.grid = grid
+        self.interrupts = 0
+        self.on_pose = None  # function(OdomRecord) after every odometry message, e.g. CoverageMeter.on_odom
+        self.advance(1.0, until=lambda: self.odom.snapshot() is not None)  # a pose before the first decision
+
+    def odom_callback(self, message):
+        self.odom.update(message, stamp=self.sim.t)
+        self.motion.on_odom()
+        if self.on_pose is not None:
+            self.on_pose(self.odom.snapshot())
+
+    def ir_callback(self, message):
+        self.ir_buffer.push(message['readings'], stamp=self.sim.t)
+        if self.grid is not None:
+            self.grid.update_ir(self.odom.snapshot(), self.ir_buffer.latest())
+        zone, action = self.ir_filter.push(self.ir_buffer.latest())
+        if self.motion.interruptible and action is not None and self.motion.interrupt('obstacle'):
+            self.interrupts += 1
+
+    def advance(self, duration, until=None):
+        self.sim.run(duration, self.odom_callback, self.ir_callback, until)
+
+    def run(self, primitive, interruptible=False, timeout=30.0):
+        # Run one primitive to completion on the virtual clock, returns its MotionResult
+        finished = []
+        self.motion.start(primitive, interruptible, on_done=finished.append)
+        self.advance(timeout, until=lambda: bool(finished))
+        if not finished:
+            self.motion.cancel()
+        return primitive.result
+
+    def pause(self, duration):
+        # A time.sleep() of the controller, the robot keeps its last command meanwhile
+        self.advance(duration)
+
+# The ir_mower.py mower of 6wk_tune_ir.py on a SimRunner. config overrides the ir_mower.py
+# constants by name, e.g. an ir_tuner.py tuning file; deadline is the virtual time after which
+# legs are not retried anymore, grid an OccupancyGrid the run maps.
+class TuneIrMower(IrMower):
+
+    def __init__(self, sim, config=None, deadline=None, grid=None):
+        settings = mower_settings(config)
+        self.runner = SimRunner(sim, settings['IR_THRESHOLDS'], settings['IR_ACTIONS'], grid)
+        running = None if deadline is None else lambda: sim.t < deadline
+        super().__init__(self.runner.run, self.runner.odom, self.runner.ir_buffer, self.runner.ir_filter,
+                         settings, running)
+
+# coverage_plan.py mowing on a SimRunner: one planned path over a field ahead of the robot,
+# driven by FollowPath with no stops between lanes
+class PlannedMower:
+
+    def __init__(self, sim, length=1.5, width=1.4, tool_width=0.35, speed=0.15):
+        self.runner = SimRunner(sim, IR_THRESHOLDS, IR_ACTIONS)
+        self.field = field_ahead(sim, length, width, tool_width)  # the sim pose has x, y and yaw
+        self.plan = CoveragePlan(self.field, tool_width, speed=speed, start=(sim.x, sim.y))
+        self.coverage = CoverageMeter(self.field, tool_width)
+        self.runner.on_pose = self.coverage.on_odom
+        self.speed = speed
+
+    def mow(self, reverse=False):
+        return self.runner.run(FollowPath(self.plan.waypoints(reverse), self.plan.length, speed=self.speed),
+                               timeout=2*self.plan.duration() + 10.0)
+
+# What the default regression run must still reach. The sim is deterministic, these leave
+# room for small tuning changes but not for a mower that stops avoiding or stops covering.
+REGRESSION_PASSES = 10
+REGRESSION_MAX_BUMPS = 30  # measured 18
+REGRESSION_MIN_FIELD = 0.35  # fraction of the walled field covered, measured 0.43
+REGRESSION_MIN_PLANNED = 0.9  # fraction of the open field covered by the planned path, measured 0.97
+REGRESSION_MIN_HARDCODED = 0.65  # the same by the mower's passes, measured 0.75
+
+# Regression run: the 6wk_tune_ir mower in a walled 4 x 3 m field with one box, the default
+# number of passes asserts the bounds above. With `map` it also maps the IR readings:
+#   python create3_sim.py [passes] [map]
+if __name__ == '__main__':
+    import sys
+    passes = int(sys.argv[1]) if len(sys.argv) > 1 else REGRESSION_PASSES
+    grid = OccupancyGrid() if 'map' in sys.argv[2:] else None
+    world = World.field(4.0, 3.0, boxes=[(2.2, 1.2, 0.4, 0.4)])
+    sim = Create3Sim(world, x=0.5, y=0.4, yaw=0.0)
+    mower = TuneIrMower(sim, grid=grid)
+    field = CoverageMeter([(0.0, 0.0), (4.0, 0.0), (4.0, 3.0), (0.0, 3.0)], 0.35)
+    mower.runner.on_pose = field.on_odom
+    t_start = time.perf_counter()
+    for i in range(passes):
+        mower.mow_pass()
+    wall = time.perf_counter() - t_start
+    print(f'{passes} passes: {sim.t:.1f} s simulated in {wall:.2f} s ({sim.t/wall:.0f}x real time)')
+    print(f'  driven {sim.distance:.2f} m, bumps {sim.bumps}, IR interrupts {mower.runner.interrupts}, avoidances {mower.avoidances}')
+    print(f'  final pose x={sim.x:.2f} y={sim.y:.2f} yaw={sim.yaw:.2f}, {100*field.fraction():.0f} % of the field covered')
+    bumps = sim.bumps
+    if grid is not None:
+        print(f'  map: {len(grid.obstacle_cells())} occupied cells, {grid.stats()}')
+
+    # Coverage rate on an open field: the hardcoded boustrophedon against the planned path
+    open_field = World.field(4.0, 3.0)
+    sim = Create3Sim(open_field, x=0.5, y=2.5)
+    planned = PlannedMower(sim)
+    print(planned.plan)
+    result = planned.mow()
+    print(f'planned path: {result}')
+    print(f'  achieved {planned.coverage.rate():.2f} m²/min, {100*planned.coverage.fraction():.0f} % of the field covered')
+    sim = Create3Sim(open_field, x=0.5, y=2.5)
+    mower = TuneIrMower(sim)
+    meter = CoverageMeter(planned.field, planned.plan.tool_width)
+    mower.runner.on_pose = meter.on_odom
+    for lane in planned.plan.lanes:
+        mower.mow_pass()
+    print(f'hardcoded passes: {len(planned.plan.lanes)} lanes in {sim.t:.1f} s, {meter.rate():.2f} m²/min, '
+          f'{100*meter.fraction():.0f} % of the field covered')
+
+    if passes == REGRESSION_PASSES:
+        assert bumps <= REGRESSION_MAX_BUMPS, f'{bumps} bumps in the walled field'
+        assert field.fraction() >= REGRESSION_MIN_FIELD, f'{field.fraction():.2f} of the walled field covered'
+        assert planned.coverage.fraction() >= REGRESSION_MIN_PLANNED, f'{planned.coverage.fraction():.2f} covered by the plan'
+        assert meter.fraction() >= REGRESSION_MIN_HARDCODED, f'{meter.fraction():.2f} covered by the passes'
+        print('regression bounds hold')
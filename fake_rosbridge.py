@@ -0,0 +1,268 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import struct
+import threading
+import time
+from odometry import odom_message
+from ir_buffer import ir_message
+
+# Local stand-in for the robot's rosbridge websocket: speaks enough of the rosbridge
+# protocol for roslibpy (advertise/publish/subscribe), streams synthetic odometry and
+# IR readings at fixed rates and records everything the controllers publish.
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Integrates the last cmd_vel a robot received into an odometry stream
+class OdomSim:
+
+    def __init__(self, bridge, robot_name):
+        self.bridge = bridge
+        self.cmd_topic = f'/{robot_name}/cmd_vel'
+        self.x = 0.0
+        self.y = 0.0
+        self.yaw = 0.0
+        self.last = None
+
+    def __call__(self, now):
+        command = self.bridge.latest.get(self.cmd_topic)
+        linear = command['linear']['x'] if command else 0.0
+        angular = command['angular']['z'] if command else 0.0
+        if self.last is not None:
+            dt = now - self.last
+            self.x += linear*math.cos(self.yaw)*dt
+            self.y += linear*math.sin(self.yaw)*dt
+            self.yaw = (self.yaw + angular*dt + math.pi) % (2*math.pi) - math.pi
+        self.last = now
+        return odom_message(self.x, self.y, self.yaw, linear, angular)
+
+# IR readings that alternate between an obstacle in front and a clear path
+class IrPattern:
+
+    def __init__(self, obstacle=1.0, clear=1.0, high=500, low=2, sensor=3):
+        self.obstacle = obstacle  # s with the obstacle present
+        self.clear = clear  # s with nothing in range
+        self.high = high
+        self.low = low
+        self.sensor = sensor  # index of the sensor that sees the obstacle, 3 = front_center_left
+        self.t_start = None
+
+    def blocked(self, now):
+        if self.t_start is None:
+            self.t_start = now
+        return (now - self.t_start) % (self.obstacle + self.clear) >= self.clear
+
+    def __call__(self, now):
+        values = [self.low]*7
+        if self.blocked(now):
+            values[self.sensor] = self.high
+        return ir_message(values)
+
+# One websocket client, frames are RFC 6455 with no extensions
+class BridgeClient:
+
+    def __init__(self, bridge, reader, writer):
+        self.bridge = bridge
+        self.reader = reader
+        self.writer = writer
+        self.subscriptions = set()
+
+    async def handshake(self):
+        request = await self.reader.readuntil(b'\r\n\r\n')
+        key = None
+        for line in request.split(b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        if key is None:
+            return False
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        self.writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        await self.writer.drain()
+        return True
+
+    async def read_frame(self):
+        head = await self.reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+        mask = await self.reader.readexactly(4) if head[1] & 0x80 else None
+        payload = await self.reader.readexactly(length)
+        if mask is not None and length:
+            # unmask all bytes at once as one big integer xor
+            key = (mask*(length//4 + 1))[:length]
+            payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+        return fin, opcode, payload
+
+    def send_frame(self, payload, opcode=0x1):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self.writer.write(head + payload)
+
+    async def serve(self):
+        if not await self.handshake():
+            self.writer.close()
+            return
+        self.bridge.clients.append(self)
+        fragments = []
+        try:
+            while True:
+                fin, opcode, payload = await self.read_frame()
+                if opcode == 0x8:  # close
+                    self.send_frame(payload[:2], opcode=0x8)
+                    break
+                if opcode == 0x9:  # ping
+                    self.send_frame(payload, opcode=0xA)
+                    continue
+                if opcode in (0x0, 0x1, 0x2):
+                    fragments.append(payload)
+                    if fin:
+                        self.bridge.on_message(self, b''.join(fragments))
+                        fragments = []
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.bridge.clients.remove(self)
+            self.writer.close()
+
+# Rosbridge stand-in running its own asyncio loop in a background thread
+class FakeRosbridge:
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port  # 0 picks a free port, read it back after start()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.clients = []
+        self.streams = []
+
+        self.lock = threading.Lock()
+        self.inbound = []  # (perf_counter, op, topic, msg) of every op received
+        self.outbound = {}  # topic -> [(perf_counter, msg)] for recorded streams
+        self.latest = {}  # topic -> last published msg
+        self.advertised = {}  # topic -> type
+        self.sent_count = 0
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.accept, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        async def shutdown():
+            for task in self.streams:
+                task.cancel()
+            self.server.close()
+            for client in list(self.clients):
+                client.writer.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def accept(self, reader, writer):
+        await BridgeClient(self, reader, writer).serve()
+
+    def on_message(self, client, payload):
+        message = json.loads(payload)
+        op = message.get('op')
+        topic = message.get('topic')
+        with self.lock:
+            self.inbound.append((time.perf_counter(), op, topic, message.get('msg')))
+            if op == 'publish':
+                self.latest[topic] = message['msg']
+            elif op == 'advertise':
+                self.advertised[topic] = message.get('type')
+        if op == 'subscribe':
+            client.subscriptions.add(topic)
+        elif op == 'unsubscribe':
+            client.subscriptions.discard(topic)
+
+    def publish(self, topic, msg, record=False):
+        # Send msg to every client subscribed to topic, call from the bridge loop
+        payload = None
+        for client in self.clients:
+            if topic in client.subscriptions:
+                if payload is None:
+                    payload = json.dumps({'op': 'publish', 'topic': topic, 'msg': msg}).encode('utf8')
+                client.send_frame(payload)
+                self.sent_count += 1
+        if record:
+            with self.lock:
+                self.outbound.setdefault(topic, []).append((time.perf_counter(), msg))
+
+    def add_stream(self, topic, rate, make_message, record=False):
+        # Publish make_message(now) on topic at `rate` Hz from the bridge loop
+        async def stream():
+            period = 1.0/rate
+            t_start = self.loop.time()
+            tick = 0
+            while True:
+                self.publish(topic, make_message(time.perf_counter()), record)
+                tick = max(tick + 1, int((self.loop.time() - t_start)/period) + 1)
+                await asyncio.sleep(t_start + tick*period - self.loop.time())
+
+        def schedule():
+            self.streams.append(self.loop.create_task(stream()))
+        self.loop.call_soon_threadsafe(schedule)
+
+    def add_robot(self, robot_name, odom_rate=20.0, ir_rate=20.0, ir_pattern=None):
+        # Odometry that follows the robot's cmd_vel and a recorded IR stream
+        self.add_stream(f'/{robot_name}/odom', odom_rate, OdomSim(self, robot_name))
+        self.add_stream(f'/{robot_name}/ir_intensity', ir_rate, ir_pattern or IrPattern(), record=True)
+
+    def published(self, topic):
+        # [(perf_counter, msg)] of every publish received on topic
+        with self.lock:
+            return [(stamp, msg) for stamp, op, name, msg in self.inbound if op == 'publish' and name == topic]
+
+    def sent(self, topic):
+        with self.lock:
+            return list(self.outbound.get(topic, ()))
+
+    def counts(self):
+        # Received publish ops per topic
+        counts = {}
+        with self.lock:
+            for stamp, op, topic, msg in self.inbound:
+                if op == 'publish':
+                    counts[topic] = counts.get(topic, 0) + 1
+        return counts
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9012
+    robots = sys.argv[2:] or ['foxtrot']
+    bridge = FakeRosbridge(host='0.0.0.0', port=port).start()
+    for name in robots:
+        bridge.add_robot(name)
+    print(f'Fake rosbridge on port {bridge.port} for {", ".join(robots)}')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'clients {len(bridge.clients)}, sent {bridge.sent_count}, received {bridge.counts()}')
+    except KeyboardInterrupt:
+        bridge.stop()
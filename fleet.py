@@ -0,0 +1,111 @@
+import asyncio
+import sys
+import threading
+from bridge import connect
+from async_controller import AsyncRobotController, ModeState, ROS_HOST, ROS_PORT
+from joystick_events import JoystickEvents, QueuedInput, BUTTON_NAMES, WAIT_TIMEOUT
+
+# Y (button 3) hands the joystick to the next robot
+FLEET_BUTTONS = dict(BUTTON_NAMES)
+FLEET_BUTTONS[3] = 'Y'
+
+# Drives several robots from one process over one shared bridge connection. Every robot
+# is an AsyncRobotController with its own topic namespace, mode state and input queue,
+# all on one event loop: bridge callbacks only enqueue work, so no robot blocks another.
+class FleetController:
+
+    def __init__(self, ros_node, robot_names, joystick=None):
+        # joystick: optional JoystickEvents, drives the selected robot
+        self.ros_node = ros_node
+        self.names = list(robot_names)
+        self.ready = threading.Event()  # set by a push to any robot's input
+        self.robots = {name: AsyncRobotController(ros_node, name, QueuedInput(self.ready), state=ModeState(), pump_input=False)
+                       for name in self.names}
+        self.joystick = joystick
+        self.selected = self.names[0]
+        self.tasks = []
+        self.pumps = []
+
+    def select(self, name):
+        self.selected = name
+        print(f"Joystick now drives {name}")
+
+    def select_next(self):
+        self.select(self.names[(self.names.index(self.selected) + 1) % len(self.names)])
+
+    def press(self, name, button):
+        # Press a button on one robot, safe from any thread
+        self.robots[name].input.press(button)
+
+    def press_all(self, button):
+        for robot in self.robots.values():
+            robot.input.press(button)
+
+    async def input_pump(self):
+        # One loop for the scripted input of the whole fleet instead of one per robot, they
+        # share one ready event so a single executor thread waits on all of them
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self.ready.wait, WAIT_TIMEOUT)
+            for robot in self.robots.values():
+                robot.input.poll()
+
+    async def joystick_pump(self):
+        # The joystick goes to the selected robot, Y selects the next one
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self.joystick.wait)
+            for snapshot in self.joystick.poll():
+                if snapshot.kind == 'button' and snapshot.name == 'Y':
+                    self.select_next()
+                    continue
+                queue = self.robots[self.selected].input_queue
+                if queue is not None:
+                    queue.put_nowait(snapshot)
+
+    async def run(self):
+        self.tasks = [asyncio.create_task(robot.run()) for robot in self.robots.values()]
+        self.pumps = [asyncio.create_task(self.input_pump())]
+        if self.joystick is not None:
+            self.pumps.append(asyncio.create_task(self.joystick_pump()))
+        self.tasks += self.pumps
+        try:
+            await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            pass  # stop()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stop(self):
+        # Call from the loop thread, e.g. loop.call_soon_threadsafe(fleet.stop)
+        for robot in self.robots.values():
+            robot.stop()
+        for pump in self.pumps:
+            pump.cancel()
+
+    def stats(self):
+        return {name: {'winner': robot.mux.winner, 'mode': robot.state.mode} for name, robot in self.robots.items()}
+
+
+# Main loop
+if __name__ == "__main__":
+    names = sys.argv[1:] or ['foxtrot', 'echo', 'juliet', 'india']
+    try:
+        joystick = JoystickEvents(button_names=FLEET_BUTTONS)
+    except RuntimeError as error:
+        print(f"{error} Running without a joystick.")
+        joystick = None
+    ros_node = connect(ROS_HOST, ROS_PORT)
+    fleet = FleetController(ros_node, names, joystick)
+    try:
+        asyncio.run(fleet.run())
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        if joystick is not None:
+            joystick.close()
+        print(f"Bridge stats: {ros_node.stats()}")
+        ros_node.terminate()
+        print("Shutdown complete.")
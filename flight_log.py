@@ -0,0 +1,207 @@
+import os
+import struct
+import threading
+import time
+import numpy as np
+from odometry import quat_to_yaw, odom_message
+from ir_buffer import ir_message, IrZoneClassifier, ZONES
+
+# Binary flight log: a 16 byte header followed by fixed-size records, so a log can be
+# memory-mapped straight into a NumPy structured array and sliced by kind
+MAGIC = b'FLTLOG01'
+VERSION = 1
+HEADER = struct.Struct('<8sII')  # magic, version, record size
+
+KIND_ODOM = 0
+KIND_IR = 1
+KIND_CMD_VEL = 2
+KIND_NAMES = ('odom', 'ir_intensity', 'cmd_vel')
+
+# values by kind:
+#  odom:    x, y, yaw, linear.x, angular.z
+#  ir:      the seven ir_intensity values in SENSOR_NAMES order
+#  cmd_vel: linear.x, angular.z
+RECORD_DTYPE = np.dtype([
+    ('stamp', '<f8'),  # time.monotonic() when the message was seen
+    ('kind', '<u4'),
+    ('count', '<u4'),  # number of used entries in values
+    ('values', '<f4', (8,)),
+])
+
+# Appends records to a log file, buffered in a preallocated chunk
+class FlightRecorder:
+
+    def __init__(self, path, chunk=1024):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize))
+        self.lock = threading.Lock()
+        self.buffer = np.zeros(chunk, dtype=RECORD_DTYPE)
+        self.stamps = self.buffer['stamp']
+        self.kinds = self.buffer['kind']
+        self.counts = self.buffer['count']
+        self.values = self.buffer['values']
+        self.n = 0
+        self.written = 0
+        self.kind_counts = [0]*len(KIND_NAMES)
+
+    def append(self, kind, values, stamp=None):
+        if stamp is None:
+            stamp = time.monotonic()
+        with self.lock:
+            if self.file is None:
+                return
+            n = self.n
+            row = self.values[n]
+            row[:] = 0.0
+            row[:len(values)] = values
+            self.stamps[n] = stamp
+            self.kinds[n] = kind
+            self.counts[n] = len(values)
+            self.kind_counts[kind] += 1
+            self.n = n + 1
+            if self.n == len(self.buffer):
+                self.flush_locked()
+
+    def record_odom(self, message, stamp=None):
+        position = message['pose']['pose']['position']
+        orientation = message['pose']['pose']['orientation']
+        twist = message['twist']['twist']
+        yaw = quat_to_yaw(orientation['x'], orientation['y'], orientation['z'], orientation['w'])
+        self.append(KIND_ODOM, (position['x'], position['y'], yaw, twist['linear']['x'], twist['angular']['z']), stamp)
+
+    def record_ir(self, message, stamp=None):
+        self.append(KIND_IR, [reading['value'] for reading in message['readings']], stamp)
+
+    def record_cmd_vel(self, linear_x, angular_z, stamp=None):
+        self.append(KIND_CMD_VEL, (linear_x, angular_z), stamp)
+
+    def flush_locked(self):
+        if self.n:
+            self.file.write(self.buffer[:self.n].tobytes())
+            self.written += self.n
+            self.n = 0
+        self.file.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.flush_locked()
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.flush_locked()
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {'path': self.path, 'records': self.written + self.n,
+                'by_kind': dict(zip(KIND_NAMES, self.kind_counts))}
+
+# Read-only, memory-mapped view of a flight log
+class FlightLog:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as log_file:
+            magic, version, record_size = HEADER.unpack(log_file.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a flight log (version {VERSION})")
+        # A crash can leave a partial record at the end, map whole records only
+        n = (os.path.getsize(path) - HEADER.size)//RECORD_DTYPE.itemsize
+        if n:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, kind):
+        return self.records[self.records['kind'] == kind]
+
+    def odom(self):
+        # stamps (n,), values (n, 5): x, y, yaw, linear, angular
+        records = self.select(KIND_ODOM)
+        return records['stamp'], records['values'][:, :5]
+
+    def ir(self):
+        # stamps (n,), values (n, 7)
+        records = self.select(KIND_IR)
+        return records['stamp'], records['values'][:, :7]
+
+    def cmd_vel(self):
+        # stamps (n,), values (n, 2): linear, angular
+        records = self.select(KIND_CMD_VEL)
+        return records['stamp'], records['values'][:, :2]
+
+    def duration(self):
+        if len(self.records) == 0:
+            return 0.0
+        return float(self.records['stamp'][-1] - self.records['stamp'][0])
+
+    def summary(self):
+        kinds = np.bincount(self.records['kind'], minlength=len(KIND_NAMES))
+        duration = self.duration()
+        return {
+            'records': len(self.records),
+            'duration': duration,
+            'counts': {name: int(count) for name, count in zip(KIND_NAMES, kinds)},
+            'rates': {name: float(count)/duration if duration else 0.0 for name, count in zip(KIND_NAMES, kinds)},
+        }
+
+    def zone_counts(self, thresholds, actions=None):
+        # How often each IR zone would have fired with these thresholds, for the whole log at once
+        stamps, values = self.ir()
+        ranks = IrZoneClassifier(thresholds, actions).ranks(values)
+        counts = np.bincount(ranks, minlength=len(ZONES))
+        return {zone: int(count) for zone, count in zip(ZONES, counts)}
+
+    def replay(self, odom_callback=None, ir_callback=None, cmd_vel_callback=None, speed=1.0, stop_event=None):
+        # Feed the log back into controller callbacks (e.g. RobotController.odom_callback and
+        # callback_ir) with rebuilt roslibpy-style messages. speed: 1.0 real time, N for N times
+        # faster, None as fast as possible. cmd_vel_callback gets (linear_x, angular_z).
+        # Returns the number of messages delivered.
+        if len(self.records) == 0:
+            return 0
+        stamps = self.records['stamp']
+        kinds = self.records['kind']
+        values = self.records['values']
+        t_log = stamps[0]
+        t_start = time.monotonic()
+        delivered = 0
+        for i in range(len(self.records)):
+            if speed:
+                delay = (stamps[i] - t_log)/speed - (time.monotonic() - t_start)
+                if delay > 0:
+                    if stop_event is None:
+                        time.sleep(delay)
+                    elif stop_event.wait(delay):
+                        break
+            kind = kinds[i]
+            row = values[i]
+            if kind == KIND_ODOM and odom_callback is not None:
+                odom_callback(odom_message(float(row[0]), float(row[1]), float(row[2]), float(row[3]), float(row[4])))
+            elif kind == KIND_IR and ir_callback is not None:
+                ir_callback(ir_message(row[:7]))
+            elif kind == KIND_CMD_VEL and cmd_vel_callback is not None:
+                cmd_vel_callback(float(row[0]), float(row[1]))
+            else:
+                continue
+            delivered += 1
+        return delivered
+
+# Summary and an IR threshold sweep of a log:
+#   python flight_log.py run.log [threshold ...]
+if __name__ == '__main__':
+    import sys
+    log = FlightLog(sys.argv[1])
+    summary = log.summary()
+    print(f"{summary['records']} records over {summary['duration']:.1f} s")
+    for name in KIND_NAMES:
+        print(f"  {name:<14} {summary['counts'][name]:8d}  {summary['rates'][name]:6.1f} Hz")
+    for threshold in [float(arg) for arg in sys.argv[2:]] or [100, 200, 300, 400, 500]:
+        counts = log.zone_counts(threshold)
+        print(f"  threshold {threshold:6.0f}: " + ', '.join(f'{zone} {counts[zone]}' for zone in ZONES))
@@ -0,0 +1,245 @@
+import time
+import numpy as np
+
+# Create3 ir_intensity readings, in message order, with their mounting angle (deg, left positive)
+SENSOR_NAMES = ('side_left', 'left', 'front_left', 'front_center_left', 'front_center_right', 'front_right', 'right')
+SENSOR_ANGLES = (65.3, 38.0, 20.0, 3.0, -14.25, -34.0, -65.3)
+
+# Zones in priority order, the first zone with a sensor over threshold wins
+ZONES = ('front', 'front_left', 'front_right', 'left', 'right', 'clear')
+ZONE_LABELS = {
+    'front': 'in FRONT',
+    'front_left': 'in FRONT LEFT',
+    'front_right': 'in FRONT RIGHT',
+    'left': 'LEFT',
+    'right': 'RIGHT',
+    'clear': 'CLEAR',
+}
+
+# Zone of every sensor by its side of the center: side_left(65) is left, left(38) and
+# front_left(20) are front_left, front_center_left(3) is front, front_center_right(-14) and
+# front_right(-34) are front_right, right(-65) is right. Every sensor a controller ever read
+# is in its zone, and no sensor is left out. None in a controller's own table leaves one out.
+SENSOR_ZONES = ('left', 'front_left', 'front_left', 'front', 'front_right', 'front_right', 'right')
+
+# Beam model: the sensors sit on the bumper circle facing outward, a reading falls off with
+# the distance d to the reflecting surface as IR_MAX*(IR_D0/(d + IR_D0))**2 up to IR_RANGE
+ROBOT_RADIUS = 0.171  # m
+IR_RANGE = 0.3  # m
+IR_MAX = 4000.0  # reading at contact
+IR_D0 = 0.02  # m
+IR_FLOOR = IR_MAX*(IR_D0/(IR_RANGE + IR_D0))**2  # weakest reading of a surface in range
+
+def ir_intensity(distances):
+    # Reading for a surface at each distance (m), 0 when out of range
+    distances = np.asarray(distances)
+    return np.where(distances < IR_RANGE, IR_MAX*(IR_D0/(distances + IR_D0))**2, 0.0)
+
+def ir_distance(values):
+    # Inverse of ir_intensity: distance (m) for each reading, inf below IR_FLOOR
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide='ignore'):
+        distances = IR_D0*(np.sqrt(IR_MAX/np.maximum(values, 1e-9)) - 1.0)
+    return np.where(values >= IR_FLOOR, np.maximum(distances, 0.0), np.inf)
+
+def ir_message(values):
+    # IrIntensityVector body for seven values, as roslibpy delivers it to a callback
+    return {'readings': [{'value': int(value)} for value in values]}
+
+# Fixed capacity ring buffer of the last N ir_intensity vectors
+class IrRingBuffer:
+
+    def __init__(self, capacity=64, n_sensors=len(SENSOR_NAMES)):
+        self.capacity = capacity
+        self.n_sensors = n_sensors
+        # Every sample is written twice (at i and i + capacity) so the last k
+        # samples are always one contiguous slice and windows never need a copy
+        self.values = np.zeros((2*capacity, n_sensors))
+        self.stamps = np.zeros(2*capacity)
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def push(self, readings, stamp=None):
+        # readings: message['readings'] from an IrIntensityVector
+        if stamp is None:
+            stamp = time.monotonic()
+        row = self.values[self.head]
+        for i, reading in enumerate(readings):
+            row[i] = reading['value']
+        self.values[self.head + self.capacity] = row
+        self.stamps[self.head] = stamp
+        self.stamps[self.head + self.capacity] = stamp
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def push_values(self, values, stamp=None):
+        # Same as push() for an already decoded vector of 7 values
+        if stamp is None:
+            stamp = time.monotonic()
+        self.values[self.head] = values
+        self.values[self.head + self.capacity] = values
+        self.stamps[self.head] = stamp
+        self.stamps[self.head + self.capacity] = stamp
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def bounds(self, k=None):
+        if k is None or k > self.count:
+            k = self.count
+        end = self.head + self.capacity
+        return end - k, end
+
+    def window(self, k=None):
+        # View (not a copy) of the last k vectors, oldest first, shape (k, n_sensors)
+        start, end = self.bounds(k)
+        return self.values[start:end]
+
+    def window_stamps(self, k=None):
+        start, end = self.bounds(k)
+        return self.stamps[start:end]
+
+    def latest(self):
+        # View of the newest vector, None before the first message
+        if self.count == 0:
+            return None
+        return self.values[self.head + self.capacity - 1]
+
+    def latest_stamp(self):
+        if self.count == 0:
+            return None
+        return self.stamps[self.head + self.capacity - 1]
+
+    def min(self, k=None):
+        return self.window(k).min(axis=0)
+
+    def max(self, k=None):
+        return self.window(k).max(axis=0)
+
+    def mean(self, k=None):
+        return self.window(k).mean(axis=0)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+# Maps all seven sensors to a zone and an action with one array operation
+class IrZoneClassifier:
+
+    def __init__(self, thresholds, actions=None, sensor_zones=SENSOR_ZONES):
+        # thresholds: scalar, {zone: value} or one value per sensor
+        # actions: {zone: action}, zones missing from the table map to None
+        # sensor_zones: zone of every sensor, None for a sensor that is never read
+        if isinstance(thresholds, dict):
+            thresholds = [thresholds.get(zone, np.inf) for zone in sensor_zones]
+        self.thresholds = np.broadcast_to(np.asarray(thresholds, dtype=float), (len(sensor_zones),)).copy()
+        self.thresholds[[zone is None for zone in sensor_zones]] = np.inf
+        self.clear_rank = ZONES.index('clear')
+        self.sensor_rank = np.array([self.clear_rank if zone is None else ZONES.index(zone) for zone in sensor_zones])
+        actions = actions or {}
+        self.actions = [actions.get(zone) for zone in ZONES]
+
+    def ranks(self, values):
+        # Zone index of every row of `values` (shape (..., 7)), the highest priority zone over threshold wins
+        return self.hit_ranks(np.asarray(values) > self.thresholds)
+
+    def hit_ranks(self, hits):
+        # Same for per-sensor booleans (..., 7) that already say which sensors see something
+        return np.where(hits, self.sensor_rank, self.clear_rank).min(axis=-1)
+
+    def classify(self, values):
+        # Returns (zone, action) for a single vector
+        rank = int(self.ranks(values))
+        return ZONES[rank], self.actions[rank]
+
+    def classify_window(self, buffer, k=None):
+        # Zone names for the last k vectors of an IrRingBuffer
+        return [ZONES[rank] for rank in self.ranks(buffer.window(k))]
+
+IR_FILTER_WINDOW = 3  # vectors in the sliding median, a spike must last 2 of them to count
+IR_FILTER_ALPHA = 0.5  # EMA weight of the newest vector
+IR_EXIT_RATIO = 0.7  # a sensor stops seeing an obstacle under this fraction of its threshold
+
+# Noise filter between the ir_intensity subscription and the zone decision. Every push
+# smooths all seven channels at once, with a sliding median over the last few vectors or
+# an EMA, and applies hysteresis: a sensor starts seeing an obstacle when its smoothed
+# reading goes over the classifier threshold and stops when it falls under exit_ratio of
+# it. Memory is fixed, `window` values per channel.
+class IrFilter:
+
+    def __init__(self, classifier, mode='median', window=IR_FILTER_WINDOW, alpha=IR_FILTER_ALPHA,
+                 exit_ratio=IR_EXIT_RATIO):
+        # mode: 'median' drops single-sample spikes outright, 'ema' only damps them
+        if mode not in ('median', 'ema'):
+            raise ValueError(f"Unknown IR filter mode '{mode}'")
+        self.classifier = classifier
+        self.mode = mode
+        self.alpha = alpha
+        self.enter = classifier.thresholds
+        self.exit = classifier.thresholds*exit_ratio
+        n_sensors = len(self.enter)
+        self.history = np.zeros((window, n_sensors))
+        self.value = np.zeros(n_sensors)  # smoothed readings
+        self.active = np.zeros(n_sensors, dtype=bool)  # sensors seeing an obstacle
+        self.raw_firing = False
+        self.passed = False  # the current raw trigger reached the output
+        self.filled = 0
+        self.index = 0
+
+        # Counters, read them with stats()
+        self.samples = 0
+        self.raw_triggers = 0  # episodes with some raw reading over its threshold
+        self.triggers = 0  # episodes of the filtered output, what the decision logic acts on
+        self.suppressed = 0  # raw episodes that ended without ever reaching the output
+
+    def push(self, values):
+        # Filter one vector of 7 readings, returns (zone, action) like IrZoneClassifier.classify
+        values = np.asarray(values, dtype=float)
+        if self.mode == 'median':
+            self.history[self.index] = values
+            self.index = (self.index + 1) % len(self.history)
+            # lower median of the whole window, slots not filled since reset() count as 0, so
+            # a lone spike right after a reset is dropped like any other
+            self.value[:] = np.sort(self.history, axis=0)[(len(self.history) - 1)//2]
+        elif self.filled == 0:
+            self.value[:] = values  # seed the average with the first vector since reset()
+        else:
+            self.value += self.alpha*(values - self.value)
+        self.filled = min(self.filled + 1, len(self.history))
+        was_active = bool(self.active.any())
+        self.active = np.where(self.active, self.value >= self.exit, self.value > self.enter)
+        active = bool(self.active.any())
+        self.triggers += active and not was_active
+        raw = bool((values > self.enter).any())
+        if raw and not self.raw_firing:
+            self.raw_triggers += 1
+            self.passed = False
+        self.passed = self.passed or active
+        if self.raw_firing and not raw and not self.passed:
+            self.suppressed += 1
+        self.raw_firing = raw
+        self.samples += 1
+        return self.current()
+
+    def current(self):
+        # (zone, action) of the filtered state, without a new vector
+        rank = int(self.classifier.hit_ranks(self.active))
+        return ZONES[rank], self.classifier.actions[rank]
+
+    def reset(self):
+        # Forget the history, e.g. before listening to the sensors again after a pause
+        self.history[:] = 0.0
+        self.value[:] = 0.0
+        self.active = np.zeros(len(self.active), dtype=bool)
+        self.raw_firing = False
+        self.passed = False
+        self.filled = 0
+        self.index = 0
+
+    def stats(self):
+        return {'mode': self.mode, 'samples': self.samples, 'raw_triggers': self.raw_triggers,
+                'triggers': self.triggers, 'suppressed': self.suppressed}
@@ -0,0 +1,166 @@
+import math
+from motion import DriveStraight, Turn, FollowPath, wrap_angle
+from coverage_plan import lane_points, u_turn_points
+from ir_buffer import ZONE_LABELS
+
+# Mowing passes and IR avoidance of 6wk_tune_ir.py. The robot, create3_sim.py and ir_tuner.py
+# all run this one copy, so what the simulator scores is what the robot drives.
+
+# IR thresholds per zone and the (turn, angle in rad) each zone triggers
+IR_THRESHOLDS = {'front': 300, 'front_left': 400, 'front_right': 400, 'left': 500, 'right': 500}
+IR_ACTIONS = {
+    'front': ('u_turn', 0.93),
+    'front_left': ('right', 0.30),
+    'front_right': ('left', 0.30),
+    'left': ('right', 0.20),
+    'right': ('left', 0.20),
+}
+
+# Motion primitives: speeds, stop tolerances and the longest a primitive may run
+DRIVE_SPEED = 0.15  # m/s
+DRIVE_TOLERANCE = 0.01  # m
+TURN_RATE = 0.5  # rad/s
+TURN_LINEAR = 0.12  # m/s forward while turning
+TURN_TOLERANCE = 0.02  # rad
+PRIMITIVE_TIMEOUT = 30.0  # s
+
+# Mowing passes: a lane, then a half circle U-turn into the next one, both followed by pure
+# pursuit without stopping in between
+LANE_LENGTH = 1.4  # m
+LANE_SPACING = 0.5  # m between lanes, the U-turn diameter
+LOOKAHEAD = 0.12  # m along the path to the point steered at
+
+SETTINGS = ('IR_THRESHOLDS', 'IR_ACTIONS', 'DRIVE_SPEED', 'DRIVE_TOLERANCE', 'TURN_RATE', 'TURN_LINEAR',
+            'TURN_TOLERANCE', 'PRIMITIVE_TIMEOUT', 'LANE_LENGTH', 'LANE_SPACING', 'LOOKAHEAD')
+
+def mower_settings(config=None):
+    # The constants above by name, config (e.g. an ir_tuner.py tuning file) overrides some of them
+    settings = {name: globals()[name] for name in SETTINGS}
+    for name, value in (config or {}).items():
+        if name not in settings:
+            raise KeyError(f"Unknown mower setting '{name}'")
+        settings[name] = value
+    return settings
+
+# The auto_mow/ir_sensor decisions on any motion runner. run(primitive, timeout=, interruptible=)
+# blocks until the primitive ends and returns its MotionResult: MotionEngine.run on the robot,
+# SimRunner.run on the virtual clock.
+class IrMower:
+
+    def __init__(self, run, odom, ir_buffer, ir_filter, settings, running=None, verbose=False):
+        # settings: mower_settings(), running: function() -> False once legs are not retried
+        # anymore (shutdown, a simulation deadline)
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.motion_run = run
+        self.odom = odom
+        self.ir_buffer = ir_buffer
+        self.ir_filter = ir_filter
+        self.running = running or (lambda: True)
+        self.verbose = verbose
+        self.last_turn = 'left'
+        self.heading = None  # rad, direction of the current lane, set by the first pass
+        self.lane_start = None  # (x, y) where the last U-turn put the next lane
+        self.avoidances = {}  # zone -> avoidance maneuvers run
+        self.tracking = []  # FollowPath.tracking() of every lane leg
+
+    def say(self, text):
+        if self.verbose:
+            print(text)
+
+    def ir_sensor(self):
+        # Run the avoidance maneuver of the zone the IR filter reports, if any
+        if self.ir_buffer.latest() is None:
+            return
+        zone, action = self.ir_filter.current()
+        if action is None:
+            return
+        self.say(f'object {ZONE_LABELS[zone]}')
+        self.avoidances[zone] = self.avoidances.get(zone, 0) + 1
+
+        turn, angle = action
+        if turn == 'u_turn':
+            # away from the side of the last U-turn, past the obstacle and back
+            sign = -1 if self.last_turn == 'left' else 1
+            self.turn(sign*angle)
+            self.drive_straight(0.25, avoid=False)
+            self.turn(sign*angle)
+        elif turn == 'right':
+            self.turn(-angle)
+        elif turn == 'left':
+            self.turn(angle)
+
+    def turn(self, angle):
+        # Turn in place by angle (rad, positive left) while creeping forward at TURN_LINEAR
+        self.say(f"Making {'left' if angle > 0 else 'right'} turn")
+        result = self.motion_run(Turn(angle, rate=self.TURN_RATE, tolerance=self.TURN_TOLERANCE, linear=self.TURN_LINEAR),
+                                 timeout=self.PRIMITIVE_TIMEOUT, interruptible=False)
+        self.say(result)
+        return result
+
+    def drive_straight(self, dist, avoid=True):
+        # Drive dist meters. With avoid=True an IR detection interrupts the leg,
+        # ir_sensor runs the avoidance maneuver and the rest of the leg is driven after
+        result = None
+        remaining = dist
+        while remaining > self.DRIVE_TOLERANCE and self.running():
+            result = self.motion_run(DriveStraight(remaining, speed=self.DRIVE_SPEED, tolerance=self.DRIVE_TOLERANCE),
+                                     timeout=self.PRIMITIVE_TIMEOUT, interruptible=avoid)
+            if result.reason != 'obstacle':
+                break
+            remaining -= result.achieved
+            self.ir_sensor()
+        return result
+
+    def follow(self, points, interruptible=False):
+        # One pure pursuit leg that runs into the next one, no slowdown at its end. Given up
+        # after twice its driving time, e.g. when a wall blocks a U-turn
+        follower = FollowPath(points, speed=self.DRIVE_SPEED, lookahead=self.LOOKAHEAD, tolerance=self.DRIVE_TOLERANCE,
+                              max_rate=self.TURN_RATE, stop_at_end=False)
+        timeout = min(self.PRIMITIVE_TIMEOUT, 2.0*follower.length/self.DRIVE_SPEED + 1.0)
+        result = self.motion_run(follower, timeout=timeout, interruptible=interruptible)
+        return result, follower.tracking()
+
+    def mow_lane(self, dist):
+        # Follow dist meters of the lane. An IR detection interrupts it like drive_straight,
+        # ir_sensor runs the avoidance maneuver and the rest is followed from where it ends up,
+        # along the heading the maneuver left. Returns the tracking of the last leg.
+        tracking = None
+        remaining = dist
+        while remaining > self.DRIVE_TOLERANCE and self.running():
+            pose = self.odom.snapshot()
+            if pose is None:
+                break
+            if self.heading is None:
+                self.heading = pose.yaw
+            # planned lanes stay one LANE_SPACING apart instead of adding up U-turn errors
+            x, y = self.lane_start if self.lane_start is not None else (pose.x, pose.y)
+            result, tracking = self.follow(lane_points(x, y, self.heading, remaining), interruptible=True)
+            self.tracking.append(tracking)
+            if result.reason != 'obstacle':
+                break
+            remaining -= result.achieved
+            self.ir_sensor()
+            self.heading = self.odom.snapshot().yaw
+            self.lane_start = None
+        return tracking
+
+    def u_turn(self, left):
+        # Half circle into the next lane, not interruptible (ir_sensor reacts to the lane only)
+        pose = self.odom.snapshot()
+        if pose is None or self.heading is None or not self.running():
+            return None
+        self.say(f"Making {'left' if left else 'right'} U-turn")
+        points = u_turn_points(pose.x, pose.y, self.heading, self.LANE_SPACING, left)
+        result, tracking = self.follow(points)
+        self.heading = wrap_angle(self.heading + math.pi)
+        self.lane_start = tuple(points[-1]) if result.completed else None
+        return tracking
+
+    def mow_pass(self):
+        # One lane and the U-turn into the next, turns alternate. Returns the lane's tracking.
+        tracking = self.mow_lane(self.LANE_LENGTH)
+        left = self.last_turn == 'right'
+        self.u_turn(left)
+        self.last_turn = 'left' if left else 'right'
+        return tracking
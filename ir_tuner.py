@@ -0,0 +1,148 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from create3_sim import World, Create3Sim, TuneIrMower
+from coverage_plan import CoverageMeter
+from tuning import TUNING_FILE
+import ir_mower
+
+# Offline tuning of the 6wk_tune_ir.py avoidance settings: IR thresholds, turn angles and
+# speeds. Every candidate drives the TuneIrMower (the ir_mower.py logic 6wk_tune_ir.py runs)
+# through the same simulated fields on the virtual clock and is scored on bumps, area
+# covered and time. Candidates share nothing, the process pool gets one per
+# task, so the search runs as many candidates at once as there are cores.
+
+SIM_DURATION = 90.0  # s of virtual time per field
+TOOL_WIDTH = 0.35  # m, swath for the coverage score
+BUMP_COST = 0.25  # m²/min of coverage rate one bump costs in the score
+
+# Fields every candidate mows: (width, height, boxes (x, y, w, h), start x, y, yaw)
+SCENARIOS = [
+    (4.0, 3.0, [(2.2, 1.2, 0.4, 0.4)], 0.5, 0.4, 0.0),
+    (3.0, 3.0, [(1.0, 1.6, 0.3, 0.3), (2.0, 0.7, 0.3, 0.5)], 0.5, 0.5, 0.0),
+    (5.0, 1.2, [], 0.4, 0.6, 0.0),  # corridor, a wall close on every pass
+]
+
+# Search space: name -> (low, high, log scale). Thresholds are IR counts, turns rad, speeds m/s.
+SPACE = {
+    'front': (40.0, 1500.0, True),
+    'diagonal': (40.0, 1500.0, True),  # front_left and front_right
+    'side': (40.0, 1500.0, True),  # left and right
+    'u_turn': (0.6, 1.6, False),
+    'diagonal_turn': (0.1, 0.8, False),
+    'side_turn': (0.05, 0.6, False),
+    'drive_speed': (0.1, 0.3, False),
+    'turn_linear': (0.0, 0.15, False),
+}
+
+def rounded(name, value):
+    # Thresholds as whole counts, the rest to the mm or mrad, so the file holds what was scored
+    return int(round(value)) if SPACE[name][2] else round(float(value), 3)
+
+def baseline():
+    # The hand tuned values of ir_mower.py
+    thresholds = ir_mower.IR_THRESHOLDS
+    actions = ir_mower.IR_ACTIONS
+    return {'front': thresholds['front'], 'diagonal': thresholds['front_left'], 'side': thresholds['left'],
+            'u_turn': actions['front'][1], 'diagonal_turn': actions['front_left'][1], 'side_turn': actions['left'][1],
+            'drive_speed': ir_mower.DRIVE_SPEED, 'turn_linear': ir_mower.TURN_LINEAR}
+
+def sample(n, seed=0):
+    # n random candidates, uniform or log-uniform per SPACE
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(n):
+        params = {}
+        for name, (low, high, log) in SPACE.items():
+            value = math.exp(rng.uniform(math.log(low), math.log(high))) if log else rng.uniform(low, high)
+            params[name] = rounded(name, value)
+        candidates.append(params)
+    return candidates
+
+def to_config(params):
+    # The ir_mower.py constants for one candidate, the format of the tuning file
+    return {
+        'IR_THRESHOLDS': {'front': params['front'], 'front_left': params['diagonal'], 'front_right': params['diagonal'],
+                          'left': params['side'], 'right': params['side']},
+        'IR_ACTIONS': {
+            'front': ('u_turn', params['u_turn']),
+            'front_left': ('right', params['diagonal_turn']),
+            'front_right': ('left', params['diagonal_turn']),
+            'left': ('right', params['side_turn']),
+            'right': ('left', params['side_turn']),
+        },
+        'DRIVE_SPEED': params['drive_speed'],
+        'TURN_LINEAR': params['turn_linear'],
+    }
+
+def run_scenario(config, scenario, duration=SIM_DURATION):
+    # Mowing passes until `duration` virtual seconds are used up
+    width, height, boxes, x, y, yaw = scenario
+    sim = Create3Sim(World.field(width, height, boxes), x, y, yaw)
+    mower = TuneIrMower(sim, config, deadline=duration)
+    meter = CoverageMeter([(0.0, 0.0), (width, 0.0), (width, height), (0.0, height)], TOOL_WIDTH)
+    mower.runner.on_pose = meter.on_odom
+    while sim.t < duration:
+        mower.mow_pass()
+    return {'bumps': sim.bumps, 'coverage': float(meter.fraction()), 'rate': 60.0*meter.area()/sim.t, 'time': sim.t}
+
+def evaluate(params, duration=SIM_DURATION):
+    # Score of one candidate over every scenario, higher is better. Runs in a pool worker.
+    config = to_config(params)
+    runs = [run_scenario(config, scenario, duration) for scenario in SCENARIOS]
+    bumps = sum(run['bumps'] for run in runs)
+    rate = sum(run['rate'] for run in runs)/len(runs)
+    coverage = sum(run['coverage'] for run in runs)/len(runs)
+    return {'params': params, 'score': rate - BUMP_COST*bumps/len(runs), 'rate': rate,
+            'coverage': coverage, 'bumps': bumps}
+
+def search(candidates, workers=None, duration=SIM_DURATION):
+    # Evaluate every candidate across a process pool, returns the results best first
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [evaluate(params, duration) for params in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(evaluate, candidates, [duration]*len(candidates)))
+    return sorted(results, key=lambda result: result['score'], reverse=True)
+
+def save_tuning(result, path=TUNING_FILE, baseline_result=None):
+    config = to_config(result['params'])
+    config['score'] = {name: result[name] for name in ('score', 'rate', 'coverage', 'bumps')}
+    if baseline_result is not None:
+        config['baseline_score'] = {name: baseline_result[name] for name in ('score', 'rate', 'coverage', 'bumps')}
+    with open(path, 'w') as tuning_file:
+        json.dump(config, tuning_file, indent=2)
+    return path
+
+# Random search, then write the winner for 6wk_tune_ir.py:
+#   python ir_tuner.py [candidates] [workers] [run.log ...]
+# The hand tuned set is always scored too. Flight logs only replay open loop, so for them the
+# report is how often the baseline and winning thresholds fire on the recorded IR.
+if __name__ == '__main__':
+    import sys
+    from flight_log import FlightLog
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    logs = sys.argv[3:]
+    candidates = [baseline()] + sample(n)
+    t_start = time.perf_counter()
+    results = search(candidates, workers)
+    wall = time.perf_counter() - t_start
+    print(f'{len(candidates)} candidates x {len(SCENARIOS)} fields on {workers} workers in {wall:.1f} s '
+          f'({len(candidates)/wall:.2f} candidates/s)')
+    base = next(result for result in results if result['params'] == candidates[0])
+    best = results[0]
+    for label, result in (('best', best), ('baseline', base)):
+        print(f"  {label:<9} score {result['score']:6.2f}  {result['rate']:.2f} m²/min  "
+              f"{100*result['coverage']:.0f} % covered  {result['bumps']} bumps  {result['params']}")
+    for path in logs:
+        log = FlightLog(path)
+        n_ir = max(1, len(log.ir()[0]))
+        for label, result in (('best', best), ('baseline', base)):
+            counts = log.zone_counts(to_config(result['params'])['IR_THRESHOLDS'])
+            print(f"  {path} {label}: fires on {100*(1 - counts['clear']/n_ir):.1f} % of {n_ir} IR vectors {counts}")
+    print(f'wrote {save_tuning(best, baseline_result=base)}')
@@ -0,0 +1,185 @@
+import collections
+import queue
+import threading
+import time
+
+# Joystick button index -> name
+BUTTON_NAMES = {0: 'A', 1: 'B', 2: 'X', 4: 'LB'}
+
+DEBOUNCE = 0.05  # s, presses of the same button closer than this are contact bounce
+DEADBAND = 0.05  # axis values below this read as 0.0
+WAIT_TIMEOUT = 0.1  # s, longest a consumer blocks in wait() before it checks for shutdown
+
+# One input event plus the controller state right after it, never modified once made.
+# kind: 'button' (name = button name) or 'axes' (name = None)
+# stamp: time.perf_counter() when the event reached the process: when wait() woke up on it for
+#   a joystick (pygame events carry no SDL timestamp), when press()/move() queued it for QueuedInput
+# axes: tuple of axis values, buttons: frozenset of held button names
+InputSnapshot = collections.namedtuple('InputSnapshot', ('kind', 'name', 'stamp', 'axes', 'buttons'))
+
+# Keeps the last N latencies (s) and reports percentiles in ms
+class LatencyMeter:
+
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+
+    def record(self, stamp, now=None):
+        # stamp: time.perf_counter() at the start of the measured interval
+        if now is None:
+            now = time.perf_counter()
+        self.samples.append(now - stamp)
+
+    def percentile(self, q):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q*len(ordered)))]
+
+    def summary(self):
+        if not self.samples:
+            return {'count': 0}
+        return {
+            'count': len(self.samples),
+            'p50_ms': 1e3*self.percentile(0.5),
+            'p99_ms': 1e3*self.percentile(0.99),
+            'max_ms': 1e3*max(self.samples),
+        }
+
+# Turns raw button/axis events into debounced snapshots and hands them to every
+# subscribed queue. Subclasses implement read().
+class InputEvents:
+
+    def __init__(self, n_axes=2, debounce=DEBOUNCE, deadband=DEADBAND):
+        self.debounce = debounce
+        self.deadband = deadband
+        self.axes = [0.0]*n_axes
+        self.held = set()
+        self.last_press = {}  # button name -> stamp of the last accepted press
+        self.queues = []
+        self.latency = LatencyMeter()  # consumers record snapshot stamp -> mode change here
+        self.presses = 0
+        self.bounces = 0
+
+    def read(self):
+        # Yield (kind, key, value, stamp), kind is 'down', 'up' or 'axis'
+        return ()
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        # Block until read() may have something or timeout (s) passes, consumers call
+        # wait() then poll() instead of polling on a timer
+        time.sleep(timeout)
+
+    def subscribe(self, consumer):
+        # consumer: anything with put_nowait(), e.g. asyncio.Queue or queue.SimpleQueue
+        self.queues.append(consumer)
+        return consumer
+
+    def snapshot(self, kind, name, stamp):
+        return InputSnapshot(kind, name, stamp, tuple(self.axes), frozenset(self.held))
+
+    def poll(self):
+        # Drain pending events, returns the new snapshots (axis motion is coalesced to one per poll)
+        snapshots = []
+        axes_stamp = None
+        for kind, key, value, stamp in self.read():
+            if kind == 'down':
+                self.held.add(key)
+                last = self.last_press.get(key)
+                if last is not None and stamp - last < self.debounce:
+                    self.bounces += 1
+                    continue
+                self.last_press[key] = stamp
+                self.presses += 1
+                snapshots.append(self.snapshot('button', key, stamp))
+            elif kind == 'up':
+                self.held.discard(key)
+            elif kind == 'axis' and key < len(self.axes):
+                if abs(value) < self.deadband:
+                    value = 0.0
+                if value != self.axes[key]:
+                    self.axes[key] = value
+                    axes_stamp = stamp
+        if axes_stamp is not None:
+            snapshots.append(self.snapshot('axes', None, axes_stamp))
+        for snapshot in snapshots:
+            for consumer in self.queues:
+                consumer.put_nowait(snapshot)
+        return snapshots
+
+    def stats(self):
+        return {'presses': self.presses, 'bounces': self.bounces, 'stamp_to_mode': self.latency.summary()}
+
+    def close(self):
+        pass
+
+# Input fed from code instead of a device (fleet robots, benchmarks), safe to push from any thread
+class QueuedInput(InputEvents):
+
+    def __init__(self, ready=None, **kwargs):
+        # ready: threading.Event set on every push, pass one to several inputs to wait on all of them
+        super().__init__(**kwargs)
+        self.pending = queue.SimpleQueue()
+        self.ready = threading.Event() if ready is None else ready
+
+    def press(self, button):
+        stamp = time.perf_counter()
+        self.pending.put(('down', button, 1.0, stamp))
+        self.pending.put(('up', button, 0.0, stamp))
+        self.ready.set()
+
+    def move(self, axis, value):
+        self.pending.put(('axis', axis, value, time.perf_counter()))
+        self.ready.set()
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        self.ready.wait(timeout)
+
+    def read(self):
+        self.ready.clear()  # a push from here on sets it again
+        while not self.pending.empty():
+            yield self.pending.get_nowait()
+
+# pygame joystick read from JOYBUTTONDOWN/JOYBUTTONUP/JOYAXISMOTION events
+class JoystickEvents(InputEvents):
+
+    def __init__(self, index=0, button_names=BUTTON_NAMES, **kwargs):
+        import pygame
+        pygame.init()
+        pygame.joystick.init()
+        if pygame.joystick.get_count() == 0:
+            raise RuntimeError("No joystick detected. Please connect a joystick and restart.")
+        self.pygame = pygame
+        self.joystick = pygame.joystick.Joystick(index)
+        self.joystick.init()
+        super().__init__(n_axes=self.joystick.get_numaxes(), **kwargs)
+        self.instance_id = self.joystick.get_instance_id()
+        self.button_names = button_names
+        self.types = [pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP, pygame.JOYAXISMOTION]
+        # SDL queues only these and QUIT, so wait() wakes up for nothing else
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(self.types + [pygame.QUIT])
+        self.woken = []  # (event, stamp) taken off the SDL queue by wait()
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        event = self.pygame.event.wait(int(1000*timeout))
+        if event.type in self.types:
+            self.woken.append((event, time.perf_counter()))
+        elif event.type == self.pygame.QUIT:
+            self.pygame.event.post(event)  # QUIT belongs to the main loop, let it take it
+            time.sleep(timeout)
+
+    def read(self):
+        # Only joystick events are taken off the SDL queue, QUIT stays for the main loop
+        stamp = time.perf_counter()
+        events = self.woken + [(event, stamp) for event in self.pygame.event.get(self.types)]
+        self.woken = []
+        for event, stamp in events:
+            if event.instance_id != self.instance_id:
+                continue
+            if event.type == self.pygame.JOYAXISMOTION:
+                yield 'axis', event.axis, event.value, stamp
+            else:
+                name = self.button_names.get(event.button)
+                if name is not None:
+                    yield 'down' if event.type == self.pygame.JOYBUTTONDOWN else 'up', name, 1.0, stamp
+
+    def close(self):
+        self.joystick.quit()
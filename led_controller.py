@@ -0,0 +1,131 @@
+import threading
+import time
+from joystick_events import LatencyMeter
+
+BLINK_PERIOD = 0.5  # s on, then the same off, while armed
+KEEPALIVE = 2.0  # s, resend a steady frame this often so the ring stays under our control
+
+# What the lightring should show and when it next needs a publish. set() takes the wanted
+# color and blink state, step(now) returns the frame to send, if any, and the deadline
+# of the next blink edge or keepalive, and shown() is called once that frame is published.
+# Blinking runs on one phase that restarts on every change, so the first frame after a
+# change is always the new color.
+class LedStateMachine:
+
+    def __init__(self, blink_period=BLINK_PERIOD, keepalive=KEEPALIVE):
+        self.blink_period = blink_period
+        self.keepalive = keepalive
+        self.color = 'Off'
+        self.blink = False
+        self.phase_start = 0.0
+        self.frame = None  # last frame sent
+        self.sent_at = None
+        self.pending = None  # perf_counter() of a change not yet on the ring
+        self.showing = None  # perf_counter() of the change the last step() frame shows
+        self.latency = LatencyMeter()  # change -> first publish of the new frame
+
+    def set(self, color, blink, stamp=None):
+        # Returns True if the wanted state changed
+        if color == self.color and blink == self.blink:
+            return False
+        self.color = color
+        self.blink = blink
+        self.phase_start = time.monotonic()
+        self.pending = time.perf_counter() if stamp is None else stamp
+        return True
+
+    def wanted(self, now):
+        # (frame, time of the next blink edge or None)
+        if not self.blink:
+            return self.color, None
+        half = int((now - self.phase_start)/self.blink_period)
+        frame = self.color if half % 2 == 0 else 'Off'
+        return frame, self.phase_start + (half + 1)*self.blink_period
+
+    def step(self, now=None):
+        # Returns (frame or None, keepalive, deadline)
+        if now is None:
+            now = time.monotonic()
+        frame, edge = self.wanted(now)
+        send = None
+        keepalive = False
+        if frame != self.frame:
+            send = frame
+        elif self.sent_at is not None and now - self.sent_at >= self.keepalive:
+            send = frame
+            keepalive = True
+        if send is not None:
+            self.frame = send
+            self.sent_at = now
+        if self.pending is not None:
+            # on the ring once the caller publishes, or already showing (e.g. arming in a blink-on phase)
+            self.showing = self.pending
+            self.pending = None
+        deadline = self.sent_at + self.keepalive if self.sent_at is not None else now + self.keepalive
+        if edge is not None:
+            deadline = min(deadline, edge)
+        return send, keepalive, deadline
+
+    def shown(self):
+        # Call after publishing the frame step() returned, records change -> publish
+        if self.showing is not None:
+            self.latency.record(self.showing)
+            self.showing = None
+
+# Drives a LightringPublisher (lights_function.get_lightring) from one thread: it sleeps
+# until the next blink edge, keepalive or set() call, so a mode change shows right away
+# and a steady ring costs one message per KEEPALIVE.
+class LedController:
+
+    def __init__(self, lightring, blink_period=BLINK_PERIOD, keepalive=KEEPALIVE):
+        self.lightring = lightring
+        self.machine = LedStateMachine(blink_period, keepalive)
+        self.changed = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.t_start = None
+        self.publish_count = 0
+        self.keepalive_count = 0
+
+    def set(self, color, blink, stamp=None):
+        # Safe from any thread
+        with self.changed:
+            if self.machine.set(color, blink, stamp):
+                self.changed.notify()
+
+    def run(self):
+        self.t_start = time.monotonic()
+        while not self.stop_event.is_set():
+            with self.changed:
+                frame, keepalive, deadline = self.machine.step()
+            if frame is not None:
+                # force: the publisher skips repeats, a keepalive is a deliberate repeat
+                self.lightring.publish(frame, force=True)
+                self.publish_count += 1
+                self.keepalive_count += keepalive
+            with self.changed:
+                self.machine.shown()
+                if self.machine.pending is None and not self.stop_event.is_set():
+                    self.changed.wait(max(0.0, deadline - time.monotonic()))
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.changed:
+            self.changed.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        elapsed = time.monotonic() - self.t_start if self.t_start is not None else 0.0
+        return {
+            'published': self.publish_count,
+            'keepalives': self.keepalive_count,
+            'per_minute': 60.0*self.publish_count/elapsed if elapsed else 0.0,
+            'latency': self.machine.latency.summary(),
+        }
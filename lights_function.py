@@ -1,78 +1,113 @@
 import roslibpy
 import time
 import random
+import threading
 
-class Lights:
-    
-    def __init__ (self, ros_node, robot_name, color):
-        #ros_node: name of node that initializes connection to ROS2 library
-        #robot_name: name of robot
-        #color: color of lights, input arguments include ('RGB', 'Random', 'Red', 'Orange', 'Yellow', 'Green', 'Blue', 'Violet', 'White', 'Off')
-        self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
+# Color tables shared by every publisher, each entry is one frame of 6 leds
+COLORS = {
+    'Red': (255, 0, 0),
+    'Orange': (255, 165, 0),
+    'Yellow': (255, 255, 0),
+    'Green': (0, 255, 0),
+    'Blue': (0, 0, 255),
+    'Violet': (148, 0, 211),
+    'White': (255, 255, 255),
+    'Off': (0, 0, 0),
+}
+RGB_SEQUENCE = ('Red', 'Green', 'Blue')
+
+def make_frame(red, green, blue):
+    return [{"red": red, "green": green, "blue": blue}]*6
+
+# Long-lived lightring publisher, one per (ros connection, robot name)
+class LightringPublisher:
+
+    def __init__(self, ros_node, robot_name):
         self.ros_node = ros_node
         self.robot_name = robot_name
-        self.color = color
-        self.RGB = [[{"red": 255, "green": 0, "blue": 0}]*6,  # Red
-                    [{"red": 0, "green": 255, "blue": 0}]*6,  # Green
-                    [{"red": 0, "green": 0, "blue": 255}]*6   # Blue
-                    ]
-        self.Rand = [{"red": random.randint(0, 255), "green": random.randint(0, 255), "blue": random.randint(0, 255)}]*6
-        self.Red = [{"red": 255, "green": 0, "blue": 0}]*6
-        self.Orange = [{"red": 255, "green": 165, "blue": 0}]*6
-        self.Yellow = [{"red": 255, "green": 255, "blue": 0}]*6
-        self.Green = [{"red": 0, "green": 255, "blue": 0}]*6
-        self.Blue = [{"red": 0, "green": 0, "blue": 255}]*6
-        self.Violet = [{"red": 148, "green": 0, "blue": 211}]*6
-        self.White = [{"red": 255, "green": 255, "blue": 255}]*6
-        self.Off = [{"red": 0, "green": 0, "blue": 0}]*6
-    
-    def fetch_color(self):
-        if self.color == 'RGB':
-            color_des = self.RGB
-        elif self.color == 'Random':
-            color_des = self.Rand
-        elif self.color == 'Red':
-            color_des = self.Red
-        elif self.color == 'Orange':
-            color_des = self.Orange
-        elif self.color == 'Yellow':
-            color_des = self.Yellow
-        elif self.color == 'Green':
-            color_des = self.Green
-        elif self.color == 'Blue':
-            color_des = self.Blue
-        elif self.color == 'Violet':
-            color_des = self.Violet
-        elif self.color == 'White':
-            color_des = self.White
-        elif self.color == 'Off':
-            color_des = self.Off
-        return color_des
-    
-    def init(self):
-        # Initialize the LED publisher
+        self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
+        self.lock = threading.Lock()
+        self.last_frame = None  # name of the frame currently on the ring
+
+        # Counters, read them with stats()
+        self.advertise_count = 0
+        self.message_count = 0  # LightringLeds messages allocated
+        self.publish_count = 0
+        self.skip_count = 0
+
+        # Precompute one message per named color, these are never rebuilt
+        self.messages = {name: self.make_message(make_frame(*rgb)) for name, rgb in COLORS.items()}
+
         self.led_pub.advertise()
+        self.advertise_count += 1
 
-    def pub(self, color):
-        # Compose a LightringLeds message
-        lightring_led_message = {"leds": color, "override_system": True}
-        lightring_ros_msg = roslibpy.Message(lightring_led_message)
+    def make_message(self, frame):
+        self.message_count += 1
+        return roslibpy.Message({"leds": frame, "override_system": True})
 
-        # Publish the message
-        if self.color == 'RGB':
-            for colors in color:
-                self.led_pub.publish(roslibpy.Message({"leds": colors, "override_system": True}))
+    def publish(self, color, force=False):
+        # Publish a named color, returns True if a message went out
+        if color == 'RGB':
+            for name in RGB_SEQUENCE:
+                self.publish(name, force=True)
                 time.sleep(1)
-        else:
-            self.led_pub.publish(lightring_ros_msg)
-    
+            return True
+
+        with self.lock:
+            if color == 'Random':
+                message = self.make_message(make_frame(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+            elif color in self.messages:
+                if color == self.last_frame and not force:
+                    self.skip_count += 1
+                    return False
+                message = self.messages[color]
+            else:
+                raise ValueError(f"Unknown lightring color '{color}'")
+
+            self.led_pub.publish(message)
+            self.publish_count += 1
+            self.last_frame = color
+            return True
+
+    def stats(self):
+        return {
+            'advertise': self.advertise_count,
+            'messages': self.message_count,
+            'published': self.publish_count,
+            'skipped': self.skip_count,
+        }
+
+    def close(self):
+        with self.lock:
+            self.led_pub.unadvertise()
+            self.last_frame = None
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+def get_lightring(ros_node, robot_name):
+    # Return the cached publisher for this connection and robot, creating it on first use
+    key = (ros_node, robot_name)
+    with _publishers_lock:
+        lightring = _publishers.get(key)
+        if lightring is None:
+            lightring = LightringPublisher(ros_node, robot_name)
+            _publishers[key] = lightring
+        return lightring
+
+def release_lightring(ros_node, robot_name):
+    # Unadvertise and forget the cached publisher, e.g. on shutdown
+    with _publishers_lock:
+        lightring = _publishers.pop((ros_node, robot_name), None)
+    if lightring is not None:
+        lightring.close()
+
+def lightring_stats():
+    # Counters for every cached publisher, keyed by robot name
+    with _publishers_lock:
+        return {robot_name: lightring.stats() for (_, robot_name), lightring in _publishers.items()}
+
 # Main loop
 def play_lights(ros_node, robot_name, color):
-    #create instance of Lights
-    lightring = Lights(ros_node, robot_name, color)
-    #fetch desired color pattern
-    color_pattern = lightring.fetch_color()
-    #initialize lights
-    lightring.init()
-    #publish lights
-    lightring.pub(color_pattern)
+    #publish through the cached lightring, only sends when the frame changes
+    return get_lightring(ros_node, robot_name).publish(color)
@@ -0,0 +1,184 @@
+import bisect
+import signal
+import sys
+import threading
+import time
+
+# Per-loop timing: every instrumented loop gets a LoopTimer that counts iterations and
+# fills fixed-bucket histograms of its period, its work time and how late it woke up.
+# Recording is a perf_counter() call, a bisect over the bucket edges and an int increment,
+# with no lock: each timer has one writer, its own loop thread.
+
+# Histogram bucket upper edges (s), roughly 1-2-5 steps from 50 us to 5 s
+BUCKET_EDGES = (50e-6, 100e-6, 200e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3,
+                0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+def format_ms(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return f'>{1e3*BUCKET_EDGES[-1]:.0f}'
+    return f'{1e3*seconds:.3g}' if seconds < 1.0 else f'{1e3*seconds:.0f}'
+
+# Counts per bucket plus the exact total and maximum
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0]*(len(BUCKET_EDGES) + 1)  # the last bucket is everything above 5 s
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(BUCKET_EDGES, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # Upper edge of the bucket holding the q-th sample, None when empty
+        if self.count == 0:
+            return None
+        rank = q*self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_EDGES[i] if i < len(BUCKET_EDGES) else float('inf')
+        return float('inf')
+
+    def mean(self):
+        return self.total/self.count if self.count else None
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean(), 'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99), 'max': self.max if self.count else None,
+                'buckets': {format_ms(edge): count for edge, count in zip(BUCKET_EDGES + (float('inf'),), self.counts) if count}}
+
+# Timing of one loop. Call begin() at the top of every iteration and end the work with
+# end(), sleep(duration) or wait(event, timeout) so the wake-up time can be checked.
+class LoopTimer:
+
+    def __init__(self, name, period=None):
+        self.name = name
+        self.period = period  # s, the loop's intended period, a work time over it is an overrun
+        self.periods = Histogram()  # begin to begin
+        self.work = Histogram()  # begin to end
+        self.jitter = Histogram()  # wake-up minus requested wake-up
+        self.iterations = 0
+        self.overruns = 0
+        self.t_first = None
+        self.t_begin = None
+        self.wake_at = None
+
+    def begin(self):
+        now = time.perf_counter()
+        if self.t_begin is None:
+            self.t_first = now
+        else:
+            self.periods.record(now - self.t_begin)
+        if self.wake_at is not None:
+            self.jitter.record(max(0.0, now - self.wake_at))
+            self.wake_at = None
+        self.t_begin = now
+        self.iterations += 1
+
+    def end(self):
+        if self.t_begin is None:
+            return
+        work = time.perf_counter() - self.t_begin
+        self.work.record(work)
+        if self.period is not None and work > self.period:
+            self.overruns += 1
+
+    def expect(self, delay):
+        # The loop will block for `delay` s, the next begin() measures how late it came back
+        self.wake_at = time.perf_counter() + delay
+
+    def sleep(self, duration):
+        # end() followed by time.sleep(duration)
+        self.end()
+        self.expect(duration)
+        time.sleep(duration)
+
+    def wait(self, event, timeout):
+        # end() followed by event.wait(timeout), waking on the event is not jitter
+        self.end()
+        self.expect(timeout)
+        woke = event.wait(timeout)
+        if woke:
+            self.wake_at = None
+        return woke
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.t_first if self.t_first is not None else 0.0
+        return {
+            'name': self.name,
+            'period_target': self.period,
+            'iterations': self.iterations,
+            'rate': self.iterations/elapsed if elapsed else 0.0,
+            'busy': self.work.total/elapsed if elapsed else 0.0,  # share of wall time spent working
+            'overruns': self.overruns,
+            'period': self.periods.summary(),
+            'work': self.work.summary(),
+            'jitter': self.jitter.summary(),
+        }
+
+# Every LoopTimer of the process, by name
+class LoopRegistry:
+
+    def __init__(self):
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def loop(self, name, period=None):
+        # New timer, a second loop with the same name gets a numbered one
+        with self.lock:
+            key = name
+            n = 2
+            while key in self.timers:
+                key = f'{name}#{n}'
+                n += 1
+            timer = LoopTimer(key, period)
+            self.timers[key] = timer
+            return timer
+
+    def summary(self):
+        with self.lock:
+            timers = list(self.timers.values())
+        return [timer.summary() for timer in timers]
+
+    def report(self):
+        # One line per loop, times in ms. Means and maxima are exact, p99 is the upper edge
+        # of its histogram bucket.
+        lines = [f"{'loop':<12}{'iters':>8}{'Hz':>7}{'target':>8}{'busy %':>8}{'overrun':>8}"
+                 f"{'period mean/max':>18}{'work mean/p99/max':>22}{'late mean/p99/max':>22}"]
+        for s in self.summary():
+            period = s['period']
+            work = s['work']
+            jitter = s['jitter']
+            lines.append(
+                f"{s['name']:<12}{s['iterations']:>8}{s['rate']:>7.1f}{format_ms(s['period_target']):>8}"
+                f"{100*s['busy']:>8.1f}{s['overruns']:>8}"
+                f"{format_ms(period['mean']) + '/' + format_ms(period['max']):>18}"
+                f"{format_ms(work['mean']) + '/' + format_ms(work['p99']) + '/' + format_ms(work['max']):>22}"
+                f"{format_ms(jitter['mean']) + '/' + format_ms(jitter['p99']) + '/' + format_ms(jitter['max']):>22}")
+        return '\n'.join(lines)
+
+    def dump(self, file=None):
+        print(self.report(), file=file or sys.stdout, flush=True)
+
+# Process-wide registry, like the lightring publishers there is one per process
+LOOPS = LoopRegistry()
+
+def loop_timer(name, period=None):
+    return LOOPS.loop(name, period)
+
+def install_dump_signal(signum=getattr(signal, 'SIGUSR1', None)):
+    # `kill -USR1 <pid>` prints the report without stopping anything (not on Windows)
+    if signum is None:
+        return False
+    signal.signal(signum, lambda signum, frame: LOOPS.dump())
+    return True
@@ -0,0 +1,333 @@
+import math
+import threading
+from velocity_profile import LINEAR_LIMITS, ANGULAR_LIMITS, velocity_profile, SlewLimiter
+
+def wrap_angle(angle):
+    # Wrap an angle (rad) into -pi..pi
+    return (angle + math.pi) % (2*math.pi) - math.pi
+
+# Outcome of a primitive, error is signed (target - achieved) in m or rad
+class MotionResult:
+    __slots__ = ('name', 'target', 'achieved', 'error', 'duration', 'completed', 'reason')
+
+    def __init__(self, name, target, achieved, duration, completed, reason):
+        self.name = name
+        self.target = target
+        self.achieved = achieved
+        self.error = target - achieved
+        self.duration = duration
+        self.completed = completed
+        self.reason = reason  # 'done', 'timeout', 'no_odom', 'cancelled' or the interrupt reason
+
+    def __repr__(self):
+        return (f'MotionResult({self.name} target={self.target:.3f} achieved={self.achieved:.3f} '
+                f'error={self.error:+.3f} in {self.duration:.2f}s, {self.reason})')
+
+# Drive a distance along the starting heading, speed follows the velocity profile of the
+# distance: limited acceleration and jerk up to `speed` and back down to rest on target
+class DriveStraight:
+    name = 'drive_straight'
+
+    def __init__(self, dist, speed=0.15, tolerance=0.01, min_speed=0.03, limits=LINEAR_LIMITS, heading_gain=1.0):
+        self.target = dist
+        self.speed = speed
+        self.tolerance = tolerance  # stop once within this many meters
+        self.min_speed = min_speed  # floor while short of the target, the profile starts at rest
+        self.profile = velocity_profile(dist, limits, velocity=speed)
+        self.heading_gain = heading_gain
+        self.achieved = 0.0
+        self.reason = None
+
+    def start(self, odom):
+        self.start_x = odom.x
+        self.start_y = odom.y
+        self.start_yaw = odom.yaw
+        self.start_stamp = odom.stamp
+
+    def step(self, odom):
+        # Returns (linear, angular, done)
+        self.achieved = math.hypot(odom.x - self.start_x, odom.y - self.start_y)
+        remaining = self.target - self.achieved
+        if remaining <= self.tolerance:
+            return 0.0, 0.0, True
+        speed = max(self.min_speed, self.profile.command(odom.stamp - self.start_stamp, remaining))
+        # hold the starting heading
+        angular = -self.heading_gain*wrap_angle(odom.yaw - self.start_yaw)
+        return speed, angular, False
+
+# Turn in place (or on an arc with linear > 0) by a relative angle, positive is left. The
+# rate follows the velocity profile of the angle, linear scales with it to keep the arc radius.
+class Turn:
+    name = 'turn'
+
+    def __init__(self, angle, rate=0.5, tolerance=0.02, min_rate=0.1, limits=ANGULAR_LIMITS, linear=0.0):
+        self.target = angle
+        self.rate = abs(rate)
+        self.tolerance = tolerance  # rad
+        self.min_rate = min_rate
+        self.profile = velocity_profile(angle, limits, velocity=rate)
+        self.linear = linear
+        self.achieved = 0.0
+        self.reason = None
+
+    def start(self, odom):
+        self.start_yaw = odom.yaw
+        self.last_yaw = odom.yaw
+        self.start_stamp = odom.stamp
+
+    def step(self, odom):
+        # Accumulate wrapped yaw increments so turns past +-pi keep counting
+        self.achieved += wrap_angle(odom.yaw - self.last_yaw)
+        self.last_yaw = odom.yaw
+        remaining = self.target - self.achieved
+        if abs(remaining) <= self.tolerance or remaining*self.target < 0:
+            return 0.0, 0.0, True
+        rate = max(self.min_rate, self.profile.command(odom.stamp - self.start_stamp, abs(remaining)))
+        return self.linear*rate/self.rate, math.copysign(rate, remaining), False
+
+# Pure pursuit along a polyline of (x, y) waypoints: every step steers onto the arc through
+# the point `lookahead` meters further along the path than the closest one, so corners and
+# turn arcs are driven without stopping. Speed is capped where the path ahead curves so the
+# yaw rate stays under max_rate, brakes on the velocity profile of the path length unless the
+# path ends into another one (stop_at_end=False), and moves between the two slew limited, as
+# does the yaw rate. A path that ends into another one leaves the last command running.
+class FollowPath:
+    name = 'follow_path'
+
+    def __init__(self, waypoints, length=None, speed=0.15, lookahead=0.12, tolerance=0.02, max_rate=1.0,
+                 min_speed=0.03, slowdown=0.1, stop_at_end=True, limits=LINEAR_LIMITS, angular_limits=ANGULAR_LIMITS):
+        self.points = [(float(x), float(y)) for x, y in waypoints]  # a generator works
+        # arc length at every waypoint
+        self.arc = [0.0]
+        for (x0, y0), (x1, y1) in zip(self.points, self.points[1:]):
+            self.arc.append(self.arc[-1] + math.hypot(x1 - x0, y1 - y0))
+        self.length = self.arc[-1]
+        self.target = self.length if length is None else length  # m, for the MotionResult
+        self.curvature = self.path_curvature()
+        self.speed = speed
+        self.lookahead = lookahead
+        self.tolerance = tolerance  # m, done this close to the end of the path
+        self.max_rate = max_rate
+        self.min_speed = min_speed
+        self.slowdown = slowdown  # m past the lookahead point checked for curves
+        self.stop_at_end = stop_at_end
+        self.limits = (min(speed, limits[0]),) + tuple(limits[1:])
+        self.profile = velocity_profile(self.length, self.limits)
+        self.angular_limits = (min(max_rate, angular_limits[0]),) + tuple(angular_limits[1:])
+        self.limiter = None
+        self.turn_limiter = None
+        self.command = (0.0, 0.0)
+        self.index = 0  # segment of the closest point, only moves forward
+        self.progress = 0.0  # m along the path of the closest point
+        self.achieved = 0.0
+        self.reason = None
+
+        # Tracking, read it with tracking()
+        self.cross_track = 0.0  # m, signed distance from the path, positive when left of it
+        self.cross_track_max = 0.0
+        self.cross_track_sum = 0.0
+        self.steps = 0
+
+    def path_curvature(self):
+        # 1/m at every waypoint, its turning angle over the mean length of its two segments
+        curvature = [0.0]*len(self.points)
+        for i in range(1, len(self.points) - 1):
+            (x0, y0), (x1, y1), (x2, y2) = self.points[i - 1:i + 2]
+            turn = wrap_angle(math.atan2(y2 - y1, x2 - x1) - math.atan2(y1 - y0, x1 - x0))
+            span = 0.5*(self.arc[i + 1] - self.arc[i - 1])
+            if span > 0.0:
+                curvature[i] = abs(turn)/span
+        return curvature
+
+    def closest(self, x, y):
+        # Closest point on the segments from self.index to a little past the lookahead point
+        best = None
+        horizon = self.arc[self.index] + 2*self.lookahead + 0.2
+        i = self.index
+        while i < len(self.points) - 1 and self.arc[i] <= horizon:
+            (x0, y0), (x1, y1) = self.points[i], self.points[i + 1]
+            sx = x1 - x0
+            sy = y1 - y0
+            length2 = sx*sx + sy*sy
+            t = 0.0 if length2 == 0.0 else max(0.0, min(1.0, ((x - x0)*sx + (y - y0)*sy)/length2))
+            dx = x - x0 - t*sx
+            dy = y - y0 - t*sy
+            distance2 = dx*dx + dy*dy
+            if best is None or distance2 < best[0]:
+                side = sx*dy - sy*dx  # positive when the robot is left of the segment
+                best = (distance2, i, t, math.copysign(math.sqrt(distance2), side))
+            i += 1
+        return best
+
+    def point_at(self, s):
+        # (x, y) at arc length s, clamped to the ends
+        if s >= self.length:
+            return self.points[-1]
+        i = self.index
+        while self.arc[i + 1] < s:
+            i += 1
+        span = self.arc[i + 1] - self.arc[i]
+        t = 0.0 if span == 0.0 else (s - self.arc[i])/span
+        (x0, y0), (x1, y1) = self.points[i], self.points[i + 1]
+        return x0 + t*(x1 - x0), y0 + t*(y1 - y0)
+
+    def curvature_ahead(self, s, distance):
+        # Sharpest path curvature between s and s + distance
+        peak = 0.0
+        i = self.index + 1
+        while i < len(self.points) and self.arc[i] <= s + distance:
+            peak = max(peak, self.curvature[i])
+            i += 1
+        return peak
+
+    def start(self, odom):
+        self.last_x = odom.x
+        self.last_y = odom.y
+        # carry on at the current speed when started on the move, e.g. right after another path
+        self.limiter = SlewLimiter(self.limits, max(0.0, odom.linear))
+        self.turn_limiter = SlewLimiter(self.angular_limits, odom.angular)
+        self.command = (max(0.0, odom.linear), odom.angular)
+
+    def step(self, odom):
+        # Returns (linear, angular, done)
+        self.achieved += math.hypot(odom.x - self.last_x, odom.y - self.last_y)
+        self.last_x = odom.x
+        self.last_y = odom.y
+        if len(self.points) < 2:
+            return 0.0, 0.0, True
+        _, self.index, t, self.cross_track = self.closest(odom.x, odom.y)
+        self.progress = self.arc[self.index] + t*(self.arc[self.index + 1] - self.arc[self.index])
+        self.steps += 1
+        self.cross_track_sum += abs(self.cross_track)
+        self.cross_track_max = max(self.cross_track_max, abs(self.cross_track))
+        remaining = self.length - self.progress
+        end_x, end_y = self.points[-1]
+        if remaining <= self.tolerance and (not self.stop_at_end or
+                                            math.hypot(end_x - odom.x, end_y - odom.y) <= self.tolerance + abs(self.cross_track)):
+            if self.stop_at_end:
+                return 0.0, 0.0, True
+            return self.command[0], self.command[1], True
+
+        # lookahead point in the robot frame
+        goal_x, goal_y = self.point_at(self.progress + self.lookahead)
+        c = math.cos(odom.yaw)
+        s = math.sin(odom.yaw)
+        ahead = c*(goal_x - odom.x) + s*(goal_y - odom.y)
+        left = -s*(goal_x - odom.x) + c*(goal_y - odom.y)
+        distance2 = ahead*ahead + left*left
+        if distance2 < 1e-9:
+            return 0.0, 0.0, True
+        if ahead <= 0.0:
+            # the path is behind: turn in place toward it, braking at the limits when still moving
+            self.command = (self.limiter.step(0.0, odom.stamp),
+                            self.turn_limiter.step(math.copysign(self.max_rate, left), odom.stamp))
+            return self.command[0], self.command[1], False
+        curvature = 2.0*left/distance2  # arc through the lookahead point
+
+        # slow down for the tighter of the arc being driven and the path ahead
+        speed = self.speed
+        sharpest = max(abs(curvature), self.curvature_ahead(self.progress, self.lookahead + self.slowdown))
+        if sharpest > 0.0:
+            speed = min(speed, self.max_rate/sharpest)
+        if self.stop_at_end:
+            speed = min(speed, self.profile.braking(remaining))
+        speed = max(self.min_speed, self.limiter.step(speed, odom.stamp))
+        angular = self.turn_limiter.step(speed*curvature, odom.stamp)
+        self.command = (speed, angular)
+        return speed, angular, False
+
+    def tracking(self):
+        return {'lookahead': self.lookahead, 'progress': self.progress,
+                'cross_track_mean': self.cross_track_sum/self.steps if self.steps else 0.0,
+                'cross_track_max': self.cross_track_max}
+
+# Runs one primitive at a time, its control step runs on every odometry message
+class MotionEngine:
+
+    def __init__(self, odom, publish):
+        # odom: OdomState, publish: function(linear, angular) sending cmd_vel
+        self.odom = odom
+        self.publish = publish
+        self.lock = threading.RLock()
+        self.active = None
+        self.interruptible = False
+
+    def on_odom(self):
+        # Call from the odometry callback right after OdomState.update()
+        with self.lock:
+            primitive = self.active
+            if primitive is None:
+                return
+            record = self.odom.snapshot()
+            linear, angular, done = primitive.step(record)
+            self.publish(linear, angular)
+            if done:
+                self.finish('done')
+
+    def finish(self, reason):
+        # lock must be held
+        primitive = self.active
+        self.active = None
+        self.interruptible = False
+        self.complete(primitive, reason)
+
+    def complete(self, primitive, reason):
+        # Durations are on the odometry clock, the virtual clock when the odometry is simulated
+        primitive.reason = reason
+        record = self.odom.snapshot()
+        duration = 0.0 if record is None or primitive.t_start is None else record.stamp - primitive.t_start
+        primitive.result = MotionResult(primitive.name, primitive.target, primitive.achieved,
+                                        duration, reason == 'done', reason)
+        if primitive.on_done is not None:
+            primitive.on_done(primitive.result)
+
+    def start(self, primitive, interruptible=False, on_done=None):
+        # Start a primitive without blocking, on_done(result) is called when it finishes
+        primitive.on_done = on_done
+        record = self.odom.snapshot()
+        primitive.t_start = None if record is None else record.stamp
+        if record is None:
+            self.complete(primitive, 'no_odom')
+            return
+        with self.lock:
+            if self.active is not None:
+                self.finish('cancelled')
+            primitive.start(record)
+            linear, angular, done = primitive.step(record)
+            self.publish(linear, angular)
+            if done:
+                self.complete(primitive, 'done')
+                return
+            self.active = primitive
+            self.interruptible = interruptible
+
+    def run(self, primitive, timeout=None, interruptible=False):
+        # Start a primitive and block until it finishes, returns a MotionResult
+        self.odom.wait_for_odom(timeout=1.0)
+        finished = threading.Event()
+        self.start(primitive, interruptible, on_done=lambda result: finished.set())
+        if not finished.wait(timeout):
+            with self.lock:
+                if self.active is primitive:
+                    self.finish('timeout')
+                    self.publish(0.0, 0.0)
+        return primitive.result
+
+    def interrupt(self, reason='interrupted'):
+        # Stop the active primitive if it was started as interruptible
+        with self.lock:
+            if self.active is not None and self.interruptible:
+                self.finish(reason)
+                self.publish(0.0, 0.0)
+                return True
+        return False
+
+    def cancel(self):
+        with self.lock:
+            if self.active is not None:
+                self.finish('cancelled')
+                self.publish(0.0, 0.0)
+
+    @property
+    def busy(self):
+        return self.active is not None
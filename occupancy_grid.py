@@ -0,0 +1,167 @@
+import math
+import threading
+import numpy as np
+from ir_buffer import SENSOR_ANGLES, ROBOT_RADIUS, IR_RANGE, ir_distance
+
+# Occupancy grid from IR intensity and odometry, in the odometry frame. Cells hold log-odds,
+# 0 is unknown, positive occupied. The grid is stored in TILE x TILE tiles that are only
+# allocated where a beam lands, so it grows with the area the robot visits.
+
+RESOLUTION = 0.02  # m per cell
+TILE = 32  # cells per tile side
+L_OCC = 0.85  # log-odds added where a beam ends on a surface
+L_FREE = -0.4  # log-odds added along a beam before it ends
+L_MIN = -4.0
+L_MAX = 4.0
+OCCUPIED = 0.5  # log-odds above which a cell counts as an obstacle
+
+def beam_model(resolution=RESOLUTION, sensor_angles=SENSOR_ANGLES, radius=ROBOT_RADIUS, max_range=IR_RANGE):
+    # Sample points of every beam in the robot frame, half a cell apart:
+    # returns points (n_sensors, k, 2) and their range along the beam (k,)
+    ranges = np.arange(0.0, max_range, 0.5*resolution)
+    angles = np.radians(sensor_angles)[:, None]
+    x = radius*np.cos(angles) + ranges*np.cos(angles)
+    y = radius*np.sin(angles) + ranges*np.sin(angles)
+    return np.stack((x, y), axis=-1), ranges
+
+# Log-odds occupancy grid, updated in place by one vectorized pass per IR vector
+class OccupancyGrid:
+
+    def __init__(self, resolution=RESOLUTION, tile=TILE, tiles=64):
+        self.resolution = resolution
+        self.tile = tile
+        self.points, self.ranges = beam_model(resolution)
+        self.hit_band = resolution  # m around the measured distance marked occupied
+        # Tile pool: one (tiles, tile*tile) float32 array, slots are handed out in order and
+        # the pool doubles when full. index maps (tile_x, tile_y) -> slot.
+        self.pool = np.zeros((tiles, tile*tile), dtype=np.float32)
+        self.flat = self.pool.reshape(-1)
+        self.index = {}
+        self.lock = threading.Lock()
+        self.updates = 0
+
+    def cells(self, xy):
+        # Integer cell coordinates of points (..., 2)
+        return np.floor(np.asarray(xy)/self.resolution).astype(np.int64)
+
+    def slot(self, key):
+        slot = self.index.get(key)
+        if slot is None:
+            slot = len(self.index)
+            if slot == len(self.pool):
+                self.pool = np.concatenate((self.pool, np.zeros_like(self.pool)))
+                self.flat = self.pool.reshape(-1)
+            self.index[key] = slot
+        return slot
+
+    def flat_index(self, cells, allocate=True):
+        # Offsets into self.flat for cells (n, 2), -1 for cells in unallocated tiles
+        if len(cells) == 0:
+            return np.zeros(0, dtype=np.int64)
+        tiles = cells//self.tile
+        local = cells - tiles*self.tile
+        # one int64 key per tile so the unique pass is one dimensional
+        keys, inverse = np.unique((tiles[:, 0] << 32) + (tiles[:, 1] & 0xFFFFFFFF), return_inverse=True)
+        tile_x = keys >> 32
+        tile_y = ((keys & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000  # back to signed
+        if allocate:
+            slots = np.array([self.slot((int(tx), int(ty))) for tx, ty in zip(tile_x, tile_y)], dtype=np.int64)
+        else:
+            slots = np.array([self.index.get((int(tx), int(ty)), -1) for tx, ty in zip(tile_x, tile_y)], dtype=np.int64)
+        slot = slots[inverse.reshape(-1)]
+        offsets = slot*self.tile*self.tile + local[:, 1]*self.tile + local[:, 0]
+        return np.where(slot >= 0, offsets, -1)
+
+    def update(self, x, y, yaw, values):
+        # Fuse one IR vector (7 readings) taken at pose (x, y, yaw)
+        distances = ir_distance(values)[:, None]  # (7, 1), inf when nothing is in range
+        free = self.ranges < distances - self.hit_band
+        hit = np.abs(self.ranges - distances) <= self.hit_band
+        c = math.cos(yaw)
+        s = math.sin(yaw)
+        points = self.points @ np.array(((c, s), (-s, c))) + (x, y)  # (7, k, 2) in the odom frame
+        with self.lock:
+            offsets = self.flat_index(self.cells(points.reshape(-1, 2))).reshape(free.shape)
+            free_cells = offsets[free]
+            hit_cells = offsets[hit]
+            # fancy assignment writes a repeated cell once, so no unique pass is needed
+            flat = self.flat
+            flat[free_cells] = np.maximum(flat[free_cells] + L_FREE, L_MIN)
+            flat[hit_cells] = np.minimum(flat[hit_cells] + L_OCC, L_MAX)
+            self.updates += 1
+
+    def update_ir(self, odom, values):
+        # odom: OdomRecord (e.g. OdomState.snapshot()), values: the 7 readings
+        if odom is not None:
+            self.update(odom.x, odom.y, odom.yaw, values)
+
+    def log_odds(self, xy):
+        # Log-odds at points (..., 2), 0 in unallocated tiles
+        xy = np.asarray(xy, dtype=float)
+        cells = self.cells(xy.reshape(-1, 2))
+        with self.lock:
+            offsets = self.flat_index(cells, allocate=False)
+            values = np.where(offsets >= 0, self.flat[np.maximum(offsets, 0)], 0.0)
+        return values.reshape(xy.shape[:-1])
+
+    def probability(self, x, y):
+        return float(1.0 - 1.0/(1.0 + math.exp(self.log_odds((x, y)))))
+
+    def occupied(self, x, y):
+        return bool(self.log_odds((x, y)) > OCCUPIED)
+
+    def free_distance(self, x, y, heading, max_distance, width=2*ROBOT_RADIUS):
+        # How far the robot's body can drive from (x, y) along heading before a known obstacle,
+        # max_distance when nothing is mapped in the way
+        steps = np.arange(0.0, max_distance + ROBOT_RADIUS, self.resolution)
+        across = np.linspace(-0.5*width, 0.5*width, max(2, int(width/self.resolution) + 1))
+        c = math.cos(heading)
+        s = math.sin(heading)
+        xs = x + steps[:, None]*c - across[None, :]*s
+        ys = y + steps[:, None]*s + across[None, :]*c
+        blocked = (self.log_odds(np.stack((xs, ys), axis=-1)) > OCCUPIED).any(axis=1)
+        if not blocked.any():
+            return max_distance
+        # the bumper reaches ROBOT_RADIUS ahead of the center
+        return float(max(0.0, min(max_distance, steps[np.argmax(blocked)] - ROBOT_RADIUS)))
+
+    def freer_side(self, x, y, yaw, distance=0.5, spread=math.pi/4):
+        # 1.0 when the mapped space ahead left of the heading is more open than ahead right, else -1.0
+        left = self.free_distance(x, y, yaw + spread, distance)
+        right = self.free_distance(x, y, yaw - spread, distance)
+        return 1.0 if left > right else -1.0
+
+    def obstacle_cells(self):
+        # (n, 2) centers (m) of every occupied cell, for plotting or debugging
+        with self.lock:
+            slots = {slot: key for key, slot in self.index.items()}
+            occupied = np.nonzero(self.flat[:len(slots)*self.tile*self.tile] > OCCUPIED)[0]
+        slot, local = np.divmod(occupied, self.tile*self.tile)
+        ly, lx = np.divmod(local, self.tile)
+        keys = np.array([slots[i] for i in slot]).reshape(-1, 2)
+        cells = keys*self.tile + np.stack((lx, ly), axis=-1)
+        return (cells + 0.5)*self.resolution
+
+    def stats(self):
+        return {'updates': self.updates, 'tiles': len(self.index),
+                'area_m2': len(self.index)*(self.tile*self.resolution)**2,
+                'bytes': self.pool.nbytes}
+
+# Rebuild the grid from a flight log, each IR vector at the last odometry pose before it:
+#   python occupancy_grid.py run.log
+if __name__ == '__main__':
+    import sys
+    import time
+    from flight_log import FlightLog
+    log = FlightLog(sys.argv[1])
+    odom_stamps, odom = log.odom()
+    ir_stamps, ir = log.ir()
+    poses = np.searchsorted(odom_stamps, ir_stamps, side='right') - 1
+    grid = OccupancyGrid()
+    t_start = time.perf_counter()
+    for i in np.nonzero(poses >= 0)[0]:
+        x, y, yaw = odom[poses[i], :3]
+        grid.update(float(x), float(y), float(yaw), ir[i])
+    elapsed = time.perf_counter() - t_start
+    print(f'{grid.updates} IR vectors in {elapsed:.2f} s ({grid.updates/max(elapsed, 1e-9):.0f} updates/s), {grid.stats()}')
+    print(f'{len(grid.obstacle_cells())} occupied cells')
@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+
+def quat_to_yaw(x, y, z, w):
+    # Heading (rad, -pi..pi) from an orientation quaternion
+    return math.atan2(2.0*(w*z + x*y), 1.0 - 2.0*(y*y + z*z))
+
+def odom_message(x, y, yaw, linear=0.0, angular=0.0):
+    # Planar nav_msgs/Odometry body, as roslibpy delivers it to a callback
+    return {
+        'pose': {'pose': {'position': {'x': x, 'y': y, 'z': 0.0},
+                          'orientation': {'x': 0.0, 'y': 0.0, 'z': math.sin(yaw/2), 'w': math.cos(yaw/2)}}},
+        'twist': {'twist': {'linear': {'x': linear, 'y': 0.0, 'z': 0.0},
+                            'angular': {'x': 0.0, 'y': 0.0, 'z': angular}}},
+    }
+
+# One odometry sample, fields are plain floats so a copy is cheap. __slots__ is the one
+# list of fields: copy() goes through it, so a field is added or dropped in one place.
+class OdomRecord:
+    __slots__ = ('x', 'y', 'yaw', 'linear', 'angular', 'stamp', 'seq')
+
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.yaw = 0.0
+        self.linear = 0.0  # twist.linear.x (m/s)
+        self.angular = 0.0  # twist.angular.z (rad/s)
+        self.stamp = 0.0  # receive time, time.monotonic()
+        self.seq = 0  # 0 = never written, -1 = being written
+
+    def copy(self):
+        record = OdomRecord.__new__(OdomRecord)
+        for name in OdomRecord.__slots__:
+            setattr(record, name, getattr(self, name))
+        return record
+
+    def __repr__(self):
+        return f'OdomRecord(x={self.x:.3f}, y={self.y:.3f}, yaw={self.yaw:.3f}, seq={self.seq})'
+
+# Latest odometry, double buffered: the callback fills the back record and flips,
+# readers copy the front record and retry if it was rewritten under them
+class OdomState:
+
+    def __init__(self):
+        self.buffers = (OdomRecord(), OdomRecord())
+        self.front = 0
+        self.seq = 0
+        self.updated = threading.Condition()
+
+    def update(self, message, stamp=None):
+        # message: nav_msgs/Odometry as received from roslibpy
+        position = message['pose']['pose']['position']
+        orientation = message['pose']['pose']['orientation']
+        twist = message['twist']['twist']
+        self.write(position['x'], position['y'],
+                   quat_to_yaw(orientation['x'], orientation['y'], orientation['z'], orientation['w']),
+                   twist['linear']['x'], twist['angular']['z'], stamp)
+
+    def write(self, x, y, yaw, linear=0.0, angular=0.0, stamp=None):
+        # Publish a pose to readers, one writer thread only
+        back = self.buffers[1 - self.front]
+        back.seq = -1
+        back.x = x
+        back.y = y
+        back.yaw = yaw
+        back.linear = linear
+        back.angular = angular
+        back.stamp = time.monotonic() if stamp is None else stamp
+        back.seq = self.seq + 1
+        self.front = 1 - self.front
+
+        with self.updated:
+            self.seq = back.seq
+            self.updated.notify_all()
+
+    def snapshot(self):
+        # Consistent copy of the newest record, None before the first message
+        while True:
+            record = self.buffers[self.front]
+            seq = record.seq
+            if seq == 0:
+                return None
+            copy = record.copy()
+            if seq > 0 and record.seq == seq:
+                return copy
+
+    def wait_for_odom(self, newer_than=None, timeout=None):
+        # Block until a record newer than `newer_than` (a record or a stamp) arrives.
+        # With newer_than=None this only waits for the first message. None on timeout.
+        if isinstance(newer_than, OdomRecord):
+            seq = newer_than.seq
+            ready = lambda: self.seq > seq
+        elif newer_than is not None:
+            ready = lambda: self.seq > 0 and self.buffers[self.front].stamp > newer_than
+        else:
+            ready = lambda: self.seq > 0
+        with self.updated:
+            if not self.updated.wait_for(ready, timeout):
+                return None
+        return self.snapshot()
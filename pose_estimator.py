@@ -0,0 +1,180 @@
+import math
+import time
+import numpy as np
+from odometry import OdomState, quat_to_yaw
+from motion import wrap_angle
+
+# Dead reckoning from three relative sensors: wheel odometry (/odom), the optical mouse
+# under the bumper (/mouse, body frame displacement, does not slip) and the gyro (/imu,
+# yaw rate). Every odometry message is one prediction step of an EKF on (x, y, yaw): the
+# heading change is the gyro's and the wheels' blended by their variances, the translation
+# the mouse's and the wheels' blended the same way, with the mouse alone when they disagree
+# by more than SLIP (the wheels spun or skidded). None of the sensors is absolute, so there
+# is no correction step, the covariance says how far the pose may have drifted.
+
+WHEEL_SIGMA = 0.004  # m, wheel displacement noise per odometry message
+MOUSE_SIGMA = 0.002  # m, mouse displacement noise per odometry message
+WHEEL_YAW_SIGMA = 0.01  # rad, wheel heading change noise per odometry message
+GYRO_SIGMA = 0.002  # rad, integrated gyro noise per odometry message
+SLIP = 0.003  # m, wheel and mouse disagreeing by more than this per message is slip
+STALE = 0.5  # s, a mouse or gyro silent for longer is left out
+MOUSE_SCALE = 1.0  # m per mouse unit, calibrate against a measured straight run
+
+def mouse_message(integrated_x, integrated_y, last_dx=0.0, last_dy=0.0):
+    # irobot_create_msgs/Mouse body, as roslibpy delivers it to a callback
+    return {'last_dx': last_dx, 'last_dy': last_dy, 'integrated_x': integrated_x, 'integrated_y': integrated_y}
+
+def imu_message(angular_z):
+    # The part of a sensor_msgs/Imu body the estimator reads
+    return {'angular_velocity': {'x': 0.0, 'y': 0.0, 'z': angular_z}}
+
+# Drop-in for OdomState (MotionEngine, CoverageMeter, OccupancyGrid read it the same way):
+# update() takes the /odom messages, on_mouse() and on_imu() the other two topics, and the
+# fused pose goes out through OdomState's double buffer, so readers never take a lock.
+# All three callbacks are expected on one thread, the bridge's.
+class PoseEstimator(OdomState):
+
+    def __init__(self, wheel_sigma=WHEEL_SIGMA, mouse_sigma=MOUSE_SIGMA, wheel_yaw_sigma=WHEEL_YAW_SIGMA,
+                 gyro_sigma=GYRO_SIGMA, slip=SLIP):
+        super().__init__()
+        self.wheel_var = wheel_sigma**2
+        self.mouse_var = mouse_sigma**2
+        self.wheel_yaw_var = wheel_yaw_sigma**2
+        self.gyro_var = gyro_sigma**2
+        self.slip = slip
+
+        # EKF state and matrices, allocated once and updated in place
+        self.state = np.zeros(3)  # x, y, yaw in the odometry frame
+        self.P = np.zeros((3, 3))
+        self.F = np.eye(3)
+        self.Q = np.zeros((3, 3))
+        self.FP = np.zeros((3, 3))
+
+        self.wheel = None  # (x, y, yaw) of the last odometry message
+        self.mouse = None  # integrated (x, y) of the last mouse message
+        self.mouse_dx = 0.0  # mouse displacement since the last odometry message
+        self.mouse_dy = 0.0
+        self.mouse_at = None
+        self.gyro_rate = None  # last yaw rate (rad/s) and its time
+        self.gyro_at = None
+        self.gyro_yaw = 0.0  # integrated since the last odometry message
+
+        # Counters, read them with stats()
+        self.updates = 0
+        self.slips = 0
+        self.mouse_count = 0
+        self.imu_count = 0
+        self.update_time = 0.0
+
+    def on_mouse(self, message, stamp=None):
+        x = message['integrated_x']
+        y = message['integrated_y']
+        if self.mouse is not None:
+            self.mouse_dx += MOUSE_SCALE*(x - self.mouse[0])
+            self.mouse_dy += MOUSE_SCALE*(y - self.mouse[1])
+        self.mouse = (x, y)
+        self.mouse_at = time.monotonic() if stamp is None else stamp
+        self.mouse_count += 1
+
+    def on_imu(self, message, stamp=None):
+        # Trapezoidal integral of the yaw rate between IMU messages
+        if stamp is None:
+            stamp = time.monotonic()
+        rate = message['angular_velocity']['z']
+        if self.gyro_at is not None and stamp - self.gyro_at < STALE:
+            self.gyro_yaw += 0.5*(rate + self.gyro_rate)*(stamp - self.gyro_at)
+        self.gyro_rate = rate
+        self.gyro_at = stamp
+        self.imu_count += 1
+
+    def update(self, message, stamp=None):
+        # One /odom message: predict with everything that arrived since the previous one
+        t_start = time.perf_counter()
+        if stamp is None:
+            stamp = time.monotonic()
+        position = message['pose']['pose']['position']
+        orientation = message['pose']['pose']['orientation']
+        twist = message['twist']['twist']
+        x = position['x']
+        y = position['y']
+        yaw = quat_to_yaw(orientation['x'], orientation['y'], orientation['z'], orientation['w'])
+        state = self.state
+        if self.wheel is None:
+            # the fused frame starts on the odometry frame
+            state[0] = x
+            state[1] = y
+            state[2] = yaw
+            self.wheel = (x, y, yaw)
+            self.mouse_dx = self.mouse_dy = self.gyro_yaw = 0.0
+            self.write(x, y, yaw, twist['linear']['x'], twist['angular']['z'], stamp)
+            return
+
+        # wheel motion in the body frame of the previous odometry heading
+        wx, wy, wyaw = self.wheel
+        self.wheel = (x, y, yaw)
+        c = math.cos(wyaw)
+        s = math.sin(wyaw)
+        forward = c*(x - wx) + s*(y - wy)
+        side = -s*(x - wx) + c*(y - wy)
+        dyaw = wrap_angle(yaw - wyaw)
+        yaw_var = self.wheel_yaw_var
+        move_var = self.wheel_var
+
+        if self.gyro_at is not None and stamp - self.gyro_at < STALE:
+            k = self.wheel_yaw_var/(self.wheel_yaw_var + self.gyro_var)
+            dyaw += k*(self.gyro_yaw - dyaw)
+            yaw_var = k*self.gyro_var
+        self.gyro_yaw = 0.0
+
+        if self.mouse_at is not None and stamp - self.mouse_at < STALE:
+            if abs(forward - self.mouse_dx) > self.slip:
+                self.slips += 1
+                forward = self.mouse_dx
+                side = self.mouse_dy
+                move_var = self.mouse_var
+            else:
+                k = self.wheel_var/(self.wheel_var + self.mouse_var)
+                forward += k*(self.mouse_dx - forward)
+                side += k*(self.mouse_dy - side)
+                move_var = k*self.mouse_var
+        self.mouse_dx = self.mouse_dy = 0.0
+
+        # propagate along the midpoint heading
+        heading = state[2] + 0.5*dyaw
+        c = math.cos(heading)
+        s = math.sin(heading)
+        state[0] += c*forward - s*side
+        state[1] += s*forward + c*side
+        state[2] = wrap_angle(state[2] + dyaw)
+
+        # P = F P F^T + Q
+        F = self.F
+        F[0, 2] = -s*forward - c*side
+        F[1, 2] = c*forward - s*side
+        Q = self.Q
+        Q[0, 0] = Q[1, 1] = move_var
+        Q[2, 2] = yaw_var
+        np.matmul(F, self.P, out=self.FP)
+        np.matmul(self.FP, F.T, out=self.P)
+        self.P += Q
+
+        self.write(float(state[0]), float(state[1]), float(state[2]), twist['linear']['x'], twist['angular']['z'], stamp)
+        self.updates += 1
+        self.update_time += time.perf_counter() - t_start
+
+    def uncertainty(self):
+        # (position sigma in m, heading sigma in rad) accumulated since the first message
+        P = self.P
+        return math.sqrt(max(0.0, P[0, 0] + P[1, 1])), math.sqrt(max(0.0, P[2, 2]))
+
+    def stats(self):
+        sigma_xy, sigma_yaw = self.uncertainty()
+        return {
+            'updates': self.updates,
+            'mouse': self.mouse_count,
+            'imu': self.imu_count,
+            'slips': self.slips,
+            'sigma_xy': sigma_xy,
+            'sigma_yaw': sigma_yaw,
+            'update_us': 1e6*self.update_time/self.updates if self.updates else 0.0,
+        }
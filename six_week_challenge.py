@@ -3,6 +3,10 @@ import roslibpy
 import pygame
 from lights_function import play_lights
 import threading
+from cmd_vel import TwistPublisher
+from subscriptions import SubscriptionManager
+from joystick_events import JoystickEvents
+from ir_buffer import IrRingBuffer, IrZoneClassifier, ZONE_LABELS
 
 # Initialize pygame and joystick control
 pygame.init()
@@ -17,11 +21,22 @@ ros_node.run()
 
 robot_name = 'foxtrot'
 
+# cmd_vel rate (Hz) for the timed segments of auto_mow
+CMD_RATE = 10
+
+# IR avoidance: any sensor over 10 counts, turn away from front obstacles, only report side ones
+IR_THRESHOLDS = 10
+IR_ACTIONS = {
+    'front': 'rotate_right',
+    'front_left': 'rotate_right',
+    'front_right': 'rotate_left',
+    'clear': 'forward',
+}
+
 # Joystick class
 class Joystick:
     def __init__(self):
-        self.joystick = pygame.joystick.Joystick(0)
-        self.joystick.init()
+        self.events = JoystickEvents(0)  # debounced JOYBUTTONDOWN/JOYAXISMOTION snapshots
         self.stop_event = threading.Event()
 
         # State variables
@@ -34,44 +49,51 @@ class Joystick:
         self.color = 'Off'
         self.blink = False
 
+        # Mode change notification, the version is bumped on every toggle
+        self.mode_changed = threading.Condition()
+        self.mode_version = 0
+
         # Create and start thread
         self.thread = threading.Thread(target=self.get_commands, daemon=True)
         self.thread.start()
 
     def get_commands(self):
         while not self.stop_event.is_set():
-            pygame.event.pump()  # Process joystick events
-
-            if self.joystick.get_button(0):  # "A" button
-                self.manual_mode = not self.manual_mode
-                self.idle_mode = False
-                self.autonomous_mode = False
-                print(f"Manual mode {'activated' if self.manual_mode else 'deactivated'}")
-                time.sleep(0.3)  # Debounce delay
-
-            if self.joystick.get_button(2):  # "X" button
-                self.idle_mode = not self.idle_mode
-                self.manual_mode = False
-                self.autonomous_mode = False
-                print(f"Secondary mode {'activated' if self.idle_mode else 'deactivated'}")
-                time.sleep(0.3)
-
-            if self.joystick.get_button(1):  # "B" button
-                self.autonomous_mode = not self.autonomous_mode
-                self.manual_mode = False
-                self.idle_mode = False
-                print(f"Autonomous mode {'activated' if self.autonomous_mode else 'deactivated'}")
-                time.sleep(0.3)
-
-            if self.joystick.get_button(4):  # Left bumper
-                self.armed = not self.armed
-                print(f"Robot {'armed' if self.armed else 'disarmed'}")
-                time.sleep(0.3)
+            self.events.wait()  # sleep until an event arrives, at most WAIT_TIMEOUT
+            # Each press arrives once, debounced by timestamp, so axes keep updating meanwhile
+            for snapshot in self.events.poll():
+                if snapshot.kind != 'button':
+                    continue
+
+                if snapshot.name == 'A':  # "A" button
+                    self.manual_mode = not self.manual_mode
+                    self.idle_mode = False
+                    self.autonomous_mode = False
+                    print(f"Manual mode {'activated' if self.manual_mode else 'deactivated'}")
+
+                elif snapshot.name == 'X':  # "X" button
+                    self.idle_mode = not self.idle_mode
+                    self.manual_mode = False
+                    self.autonomous_mode = False
+                    print(f"Secondary mode {'activated' if self.idle_mode else 'deactivated'}")
+
+                elif snapshot.name == 'B':  # "B" button
+                    self.autonomous_mode = not self.autonomous_mode
+                    self.manual_mode = False
+                    self.idle_mode = False
+                    print(f"Autonomous mode {'activated' if self.autonomous_mode else 'deactivated'}")
+
+                elif snapshot.name == 'LB':  # Left bumper
+                    self.armed = not self.armed
+                    print(f"Robot {'armed' if self.armed else 'disarmed'}")
+
+                self.notify_mode_change()
+                self.events.latency.record(snapshot.stamp)  # snapshot stamp -> mode change
 
             # Determine movement & LED state
             if self.manual_mode:
-                self.linear_x = -self.joystick.get_axis(1)  # Invert Y-axis for forward/backward
-                self.angular_z = -self.joystick.get_axis(0)  # X-axis for rotation
+                self.linear_x = -self.events.axes[1]  # Invert Y-axis for forward/backward
+                self.angular_z = -self.events.axes[0]  # X-axis for rotation
                 self.color = 'Green'
             elif self.idle_mode:
                 self.linear_x = 0.0
@@ -85,12 +107,22 @@ class Joystick:
                 self.linear_x = 0
                 self.angular_z = 0
 
-            time.sleep(0.1)  # Loop at 5 Hz
+    def notify_mode_change(self):
+        with self.mode_changed:
+            self.mode_version += 1
+            self.mode_changed.notify_all()
+
+    def wait_mode_change(self, version, timeout=None):
+        # Block until the mode moves past `version`, returns the current version
+        with self.mode_changed:
+            self.mode_changed.wait_for(lambda: self.mode_version != version, timeout)
+            return self.mode_version
 
     def stop(self):
         self.stop_event.set()
         self.thread.join()
-        self.joystick.quit()
+        print(f"Joystick input stats: {self.events.stats()}")
+        self.events.close()
 
 
 # Robot class
@@ -98,10 +130,14 @@ class RobotController:
     def __init__(self, joystick):
         self.joystick = joystick
         self.stop_event = threading.Event()
+        self.subscriptions = SubscriptionManager()
+        self.ir_buffer = IrRingBuffer()
+        self.ir_classifier = IrZoneClassifier(IR_THRESHOLDS, IR_ACTIONS)
 
         # ROS publishers
         self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
         self.drive_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
+        self.cmd_vel = TwistPublisher(self.drive_pub)
         self.audio_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_audio', 'irobot_create_msgs/AudioNoteVector')
         self.odom_topic = roslibpy.Topic(ros_node, f'/{robot_name}/mouse', 'irobot_create_msgs/Mouse')
         self.ir_topic = roslibpy.Topic(ros_node, f'/{robot_name}/ir_intensity', 'irobot_create_msgs/IrIntensityVector')
@@ -121,51 +157,31 @@ class RobotController:
         self.sense_ir_thread.start()
     
     def callback_ir(self, message):
-        values = [reading['value'] for reading in message['readings']]
-        front_value = values[3]  # Adjust index based on sensor configuration
-        left_value = values[0]
-        right_value = values[6]
-        left_center= values[2]
-        right_center=values[5]
-        error = left_value - right_value
-
-        #print(f'{ROBOT_NAME} IR values: {values}')
-        if front_value>10:
-            print('object in FRONT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': -1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-            
-        elif left_center>10:    
-            print('object in FRONT LEFT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': -1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-
-        elif right_center>10:
-            print('object in FRONT RIGHT')
-            drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': 1.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
-            
-        elif left_value>10:
-            print('object LEFT')
-            
-        elif right_value>10:
-            print('object RIGHT')
-        
-        else:
-            drive_message = {'linear': {'x': 0.5, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}}  # Rotate right
-            self.drive_pub.publish(roslibpy.Message(drive_message))
+        self.ir_buffer.push(message['readings'])
+        zone, action = self.ir_classifier.classify(self.ir_buffer.latest())
+
+        #print(f'{ROBOT_NAME} IR values: {self.ir_buffer.latest()}')
+        if zone != 'clear':
+            print(f'object {ZONE_LABELS[zone]}')
+
+        if action == 'rotate_right':
+            self.cmd_vel.rotate(-1.0)  # Rotate right
+
+        elif action == 'rotate_left':
+            self.cmd_vel.rotate(1.0)  # Rotate left
+
+        elif action == 'forward':
+            self.cmd_vel.forward(0.5)
             
               
 
     def sense_ir(self):
         while not self.stop_event.is_set():
-            if self.joystick.manual_mode == False:
-                if self.joystick.armed == True:
-                    self.ir_topic.subscribe(self.callback_ir)
+            version = self.joystick.mode_version
+            # Only listen to the IR sensors while armed and not driving manually
+            sense = self.joystick.armed and not self.joystick.manual_mode
+            self.subscriptions.set_attached(self.ir_topic, self.callback_ir, sense)
+            self.joystick.wait_mode_change(version)  # sleep until the mode changes
 
 
             
@@ -173,64 +189,39 @@ class RobotController:
     def auto_mow(self):
         last_turn = 'left'  # track the last turn direction
         while not self.stop_event.is_set():
+            version = self.joystick.mode_version
             if self.joystick.autonomous_mode and self.joystick.armed:           
                 # Drive straight
-                t_start = time.time()
-                t_elapsed = 0
-                while t_elapsed < 11.5:
-                    drive_message = {'linear': {'x': 0.15, 'y': 0.0, 'z': 0.0},
-                                    'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}} 
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
-                    t_elapsed = time.time() - t_start
-                    print(t_elapsed)
+                sent = self.cmd_vel.drive_for(0.15, 0.0, 11.5, rate=CMD_RATE, stop_event=self.stop_event)
+                print(f"Straight segment done, {sent} messages")
 
                 # Decide on the turn direction (alternate turns)
                 if last_turn == 'right':
                     # Left turn sequence
                     print("Making left turn")
-                    t_start_turn = time.time()
-                    t_elapsed = 0
-                    while t_elapsed < 1:
-                        drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': 1.0}}  # Rotate left
-                        self.drive_pub.publish(roslibpy.Message(drive_message))
-                        t_elapsed = time.time() - t_start_turn
-                        print(t_elapsed)
+                    self.cmd_vel.drive_for(0.0, 1.0, 1.0, rate=CMD_RATE, stop_event=self.stop_event)  # Rotate left
                     time.sleep(1)
                     last_turn = 'left'  # Update last turn direction to 'left'
                 elif last_turn == 'left':
                     # Right turn sequence
                     print("Making right turn")
-                    t_start_turn = time.time()
-                    t_elapsed = 0
-                    while t_elapsed < 1:
-                        drive_message = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0},  # Stop moving forward
-                                        'angular': {'x': 0.0, 'y': 0.0, 'z': -1.0}}  # Rotate right
-                        self.drive_pub.publish(roslibpy.Message(drive_message))
-                        t_elapsed = time.time() - t_start_turn
-                        print(t_elapsed)
+                    self.cmd_vel.drive_for(0.0, -1.0, 1.0, rate=CMD_RATE, stop_event=self.stop_event)  # Rotate right
                     time.sleep(1)
                     last_turn = 'right'  # Update last turn direction to 'right'
 
                 # Sleep to allow the turn to complete before the next action
                 time.sleep(0.1)
+            else:
+                self.joystick.wait_mode_change(version)  # sleep until the mode changes instead of spinning
 
 
     def drive(self):
         while not self.stop_event.is_set():
             if self.joystick.manual_mode == True:
                 if self.joystick.armed == False:
-                    drive_message = {
-                    "linear": {"x": 0.0, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": 0.0}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
+                    self.cmd_vel.stop()
                 elif self.joystick.armed == True:
-                    drive_message = {
-                    "linear": {"x": self.joystick.linear_x, "y": 0.0, "z": 0.0},
-                    "angular": {"x": 0.0, "y": 0.0, "z": self.joystick.angular_z}
-                    }
-                    self.drive_pub.publish(roslibpy.Message(drive_message))
+                    self.cmd_vel.publish(self.joystick.linear_x, self.joystick.angular_z)
             
             time.sleep(0.1)  # 10Hz
 
@@ -295,6 +286,7 @@ class RobotController:
 
     def stop(self):
         self.stop_event.set()
+        self.joystick.notify_mode_change()  # wake threads waiting on a mode change
         self.drive_thread.join()
         self.led_thread.join()
         self.audio_thread.join()
@@ -304,12 +296,11 @@ class RobotController:
 
     def cleanup(self):
         play_lights(ros_node, robot_name, 'Off')
-        self.drive_pub.publish(roslibpy.Message({"linear": {"x": 0.0, "y": 0.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.0}}))
+        self.cmd_vel.stop()
         self.led_pub.unadvertise()
         self.drive_pub.unadvertise()
         self.audio_pub.unadvertise()
-        self.odom_topic.unsubscribe()
-        self.ir_topic.unsubscribe()
+        self.subscriptions.close()
 
 
 # Main loop
@@ -319,7 +310,7 @@ if __name__ == "__main__":
         robot = RobotController(joystick)
 
         while True:
-            for event in pygame.event.get():
+            for event in pygame.event.get(pygame.QUIT):  # joystick events belong to Joystick
                 if event.type == pygame.QUIT:
                     raise KeyboardInterrupt  # Graceful exit
 
@@ -1,5 +1,6 @@
 import roslibpy
 import time
+from cmd_vel import TwistPublisher
 
 # Configuration
 IP = '192.168.8.104'
@@ -10,46 +11,33 @@ ROBOT_NAME = 'india'
 ros = roslibpy.Ros(host=IP, port=PORT)
 ros.run()
 
-# Function to create movement commands
-def create_movement_command(linear_speed=0.1, angular_speed=0.0):
-    return {
-        'linear': {'x': linear_speed, 'y': 0.0, 'z': 0.0},
-        'angular': {'x': 0.0, 'y': 0.0, 'z': angular_speed}
-    }
-
 # Movement functions
 def move_forward():
-    movement_command = create_movement_command(linear_speed=0.5)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.publish(linear_x=0.5)
 
 def move_slow_and_turn(error):
     k = 1  # Proportional control constant
     angular_speed = k * error * -0.1  # Negative for right turn
-    movement_command = create_movement_command(linear_speed=0.3, angular_speed=angular_speed)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.publish(linear_x=0.3, angular_z=angular_speed)
 
 def move_slow_and_turn(error):
     k = 1  # Proportional control constant
     angular_speed = k * error * -0.1  # Negative for right turn
-    movement_command = create_movement_command(linear_speed=0.3, angular_speed=angular_speed)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.publish(linear_x=0.3, angular_z=angular_speed)
 def stop_robot():
-    movement_command = create_movement_command(linear_speed=0.0)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.stop()
 
 
 def move_right(error):
     k = 1  # Proportional control constant
     angular_speed = k * error * -0.1  # Negative for right turn
-    movement_command = create_movement_command(linear_speed=0.0, angular_speed=angular_speed)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.publish(linear_x=0.0, angular_z=angular_speed)
 
 
 def move_left(error):
     k = 1  # Proportional control constant
     angular_speed = k * error * -0.1  # Positive for left turn
-    movement_command = create_movement_command(linear_speed=0.0, angular_speed=angular_speed)
-    movement_publisher.publish(roslibpy.Message(movement_command))
+    movement_publisher.publish(linear_x=0.0, angular_z=angular_speed)
 
 
 
@@ -99,7 +87,7 @@ def callback_ir(message):
 
 # Initialize movement publisher
 movement_topic = roslibpy.Topic(ros, f'/{ROBOT_NAME}/cmd_vel', 'geometry_msgs/Twist')
-movement_publisher = movement_topic
+movement_publisher = TwistPublisher(movement_topic)
 
 # Initialize IR sensor subscriber
 ir_intensity_topic = roslibpy.Topic(ros, f'/{ROBOT_NAME}/ir_intensity', 'irobot_create_msgs/msg/IrIntensityVector')
@@ -0,0 +1,67 @@
+import threading
+
+# Keeps one bridge subscription per topic and fans messages out to the attached callbacks
+class SubscriptionManager:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callbacks = {}  # topic name -> list of attached callbacks
+        self.topics = {}  # topic name -> roslibpy.Topic
+        self.subscribe_count = 0
+        self.unsubscribe_count = 0
+
+    def attach(self, topic, callback):
+        # Attach a callback, only the first callback on a topic sends a subscribe op
+        with self.lock:
+            callbacks = self.callbacks.setdefault(topic.name, [])
+            if callback in callbacks:
+                return False
+            callbacks.append(callback)
+            if len(callbacks) == 1:
+                self.topics[topic.name] = topic
+                topic.subscribe(lambda message, name=topic.name: self.dispatch(name, message))
+                self.subscribe_count += 1
+            return True
+
+    def detach(self, topic, callback):
+        # Detach a callback, the last callback on a topic sends the unsubscribe op
+        with self.lock:
+            callbacks = self.callbacks.get(topic.name, [])
+            if callback not in callbacks:
+                return False
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.callbacks[topic.name]
+                self.topics.pop(topic.name).unsubscribe()
+                self.unsubscribe_count += 1
+            return True
+
+    def set_attached(self, topic, callback, attached):
+        # Attach or detach depending on a mode flag, safe to call repeatedly
+        if attached:
+            return self.attach(topic, callback)
+        return self.detach(topic, callback)
+
+    def is_attached(self, topic, callback):
+        with self.lock:
+            return callback in self.callbacks.get(topic.name, ())
+
+    def refcount(self, topic):
+        with self.lock:
+            return len(self.callbacks.get(topic.name, ()))
+
+    def dispatch(self, name, message):
+        with self.lock:
+            callbacks = tuple(self.callbacks.get(name, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def close(self):
+        # Drop every subscription, e.g. on shutdown
+        with self.lock:
+            topics = list(self.topics.values())
+            self.callbacks.clear()
+            self.topics.clear()
+        for topic in topics:
+            topic.unsubscribe()
+            self.unsubscribe_count += 1
@@ -0,0 +1,16 @@
+import json
+import os
+
+# Where the ir_tuner.py winner is kept and how the robot reads it back. Only the standard
+# library here: 6wk_tune_ir.py loads it at startup, the simulator and the tuner stay off the robot.
+
+# Tuning file, next to the scripts
+TUNING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ir_tuning.json')
+
+def load_tuning(path=TUNING_FILE):
+    # The tuned constants, {} when there is no tuning file
+    if not os.path.exists(path):
+        return {}
+    with open(path) as tuning_file:
+        config = json.load(tuning_file)
+    return {name: value for name, value in config.items() if name.isupper()}
@@ -0,0 +1,190 @@
+import functools
+import math
+import time
+import numpy as np
+
+# Acceleration limited velocity for every command the robot gets. A move of known length
+# (DriveStraight, Turn, the end of a FollowPath) reads a precomputed profile: jerk limited
+# S-curve up to the cruise velocity and the mirror image down to rest, a plain trapezoid
+# when the limits have no jerk. Streams with no known end (teleop, the curvature capped speed
+# of FollowPath) go through a SlewLimiter. Limits are (velocity, acceleration, jerk) tuples,
+# in m and s for linear motion and rad and s for turns.
+
+LINEAR_LIMITS = (0.3, 0.5, 2.0)  # m/s, m/s², m/s³, the Create3 tops out at 0.306 m/s
+ANGULAR_LIMITS = (1.0, 2.0, 8.0)  # rad/s, rad/s², rad/s³
+SAMPLE_PERIOD = 0.01  # s between the samples of a profile
+CACHE_SIZE = 256  # profiles kept, lanes and turns repeat the same few lengths
+
+def accel_phase(peak, acceleration, jerk):
+    # (duration, velocity function of t) of the rise from rest to `peak`
+    if jerk is None:
+        return peak/acceleration, lambda t: acceleration*t
+    ramp = min(acceleration/jerk, math.sqrt(peak/jerk))  # s of jerk at each end of the rise
+    reached = jerk*ramp  # acceleration actually reached
+    constant = (peak - reached*ramp)/reached  # s at that acceleration
+    duration = 2*ramp + constant
+
+    def velocity(t):
+        return np.where(t < ramp, 0.5*jerk*t*t,
+                        np.where(t < ramp + constant, 0.5*reached*ramp + reached*(t - ramp),
+                                 peak - 0.5*jerk*(duration - t)**2))
+    return duration, velocity
+
+def accel_distance(peak, acceleration, jerk):
+    # The rise is point symmetric about its middle, so it covers peak/2 on average
+    return 0.5*peak*accel_phase(peak, acceleration, jerk)[0]
+
+# Velocity over time and over distance for one move of `distance` from rest to rest
+class VelocityProfile:
+
+    def __init__(self, distance, limits):
+        velocity, acceleration, jerk = limits
+        self.distance = distance
+        self.limits = limits
+        peak = velocity
+        if 2*accel_distance(peak, acceleration, jerk) > distance:
+            # too short to reach cruise velocity: bisect for the peak that just fits
+            low, high = 0.0, velocity
+            for _ in range(40):
+                peak = 0.5*(low + high)
+                if 2*accel_distance(peak, acceleration, jerk) > distance:
+                    high = peak
+                else:
+                    low = peak
+            peak = low
+        self.peak = peak
+        rise, rise_velocity = accel_phase(peak, acceleration, jerk) if peak > 0 else (0.0, lambda t: 0.0*t)
+        cruise = (distance - 2*accel_distance(peak, acceleration, jerk))/peak if peak > 0 else 0.0
+        self.duration = 2*rise + cruise
+
+        # the rise sampled over time, with the distance covered at every sample
+        t = np.append(np.arange(0.0, rise, SAMPLE_PERIOD), rise)
+        v = rise_velocity(t)
+        s = np.concatenate(([0.0], np.cumsum(0.5*(v[1:] + v[:-1])*np.diff(t))))
+        self.rise_t = t
+        self.rise_v = v
+        self.rise_s = s
+        self.rise = rise
+        self.cruise = cruise
+
+    def at_time(self, t):
+        # Velocity t s after the start of the move
+        if t >= self.duration:
+            return 0.0
+        if t <= self.rise:
+            return float(np.interp(t, self.rise_t, self.rise_v))
+        if t <= self.rise + self.cruise:
+            return self.peak
+        return float(np.interp(self.duration - t, self.rise_t, self.rise_v))
+
+    def braking(self, remaining):
+        # Highest velocity that still comes to rest within `remaining`, the fall mirrors the rise
+        if remaining <= 0.0:
+            return 0.0
+        return float(np.interp(remaining, self.rise_s, self.rise_v, right=self.peak))
+
+    def command(self, elapsed, remaining):
+        # What to send: rising on the clock, falling on the distance left so a slow start
+        # (slip, a stall) still stops on target
+        return min(self.at_time(min(elapsed, self.rise)), self.braking(remaining))
+
+    def __repr__(self):
+        return (f'VelocityProfile({self.distance:.3f} peak={self.peak:.3f} rise={self.rise:.2f}s '
+                f'cruise={self.cruise:.2f}s total={self.duration:.2f}s)')
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def cached_profile(distance, limits):
+    return VelocityProfile(distance, limits)
+
+def velocity_profile(distance, limits=LINEAR_LIMITS, velocity=None):
+    # Shared profile for abs(distance) at mm resolution, velocity caps limits[0]
+    if velocity is not None:
+        limits = (min(abs(velocity), limits[0]),) + tuple(limits[1:])
+    return cached_profile(round(abs(distance), 3), tuple(limits))
+
+def profile_cache_info():
+    return cached_profile.cache_info()
+
+# Follows a velocity target with limited acceleration and jerk. The acceleration is cut to
+# what can still be taken back to zero, one jerk step per call, before the target, so it
+# arrives without overshoot and without a jump in acceleration.
+class SlewLimiter:
+
+    def __init__(self, limits, value=0.0):
+        self.velocity, self.acceleration, self.jerk = limits
+        self.value = value
+        self.accel = 0.0
+        self.stamp = None
+
+    def reset(self, value=0.0, stamp=None):
+        # Hold value at rest, stamp: when it was sent, so the next step has a dt
+        self.value = value
+        self.accel = 0.0
+        self.stamp = stamp
+
+    def step(self, target, now=None):
+        # Returns the limited value, dt is taken from the previous call
+        if now is None:
+            now = time.monotonic()
+        dt = 0.0 if self.stamp is None else max(0.0, now - self.stamp)
+        self.stamp = now
+        target = max(-self.velocity, min(self.velocity, target))
+        error = target - self.value
+        if dt == 0.0 or error == 0.0:
+            if error == 0.0:
+                self.accel = 0.0
+            return self.value
+        previous = self.accel
+        if self.jerk is None:
+            self.accel = max(-self.acceleration, min(self.acceleration, error/dt))
+        else:
+            change = self.jerk*dt
+            if abs(error/dt) <= change and abs(error/dt - self.accel) <= change:
+                # the last step in, one jerk step from the acceleration before and one back to rest
+                self.value = target
+                self.accel = error/dt
+                return self.value
+            # Highest acceleration that still steps down to zero by `change` per step before
+            # the target: k steps down cover change*dt*k(k+1)/2
+            steps = math.floor((math.sqrt(1.0 + 8.0*abs(error)/(change*dt)) - 1.0)/2.0)
+            wanted = math.copysign(min(self.acceleration, steps*change), error)
+            self.accel = max(self.accel - change, min(self.accel + change, wanted))
+        self.value += self.accel*dt
+        if (target - self.value)*error <= 0.0 and (self.jerk is None or abs(error/dt - previous) <= self.jerk*dt):
+            # reached or passed the target this step, the acceleration goes to zero on the next.
+            # A target moved closer than the acceleration can be taken back is passed and come
+            # back to instead, at the jerk limit.
+            self.value = target
+            self.accel = error/dt
+        return self.value
+
+# Joystick axes to cmd_vel: full deflection is the velocity limit, both axes slew limited
+class TeleopShaper:
+
+    def __init__(self, linear_limits=LINEAR_LIMITS, angular_limits=ANGULAR_LIMITS):
+        self.linear = SlewLimiter(linear_limits)
+        self.angular = SlewLimiter(angular_limits)
+
+    def command(self, linear_axis, angular_axis, now=None):
+        # Axes in -1..1, returns (linear_x, angular_z)
+        if now is None:
+            now = time.monotonic()
+        return (self.linear.step(linear_axis*self.linear.velocity, now),
+                self.angular.step(angular_axis*self.angular.velocity, now))
+
+    def stop(self):
+        # Disarm: drop to rest now, a ramp is for driving, not for stopping on request
+        self.linear.reset()
+        self.angular.reset()
+
+# Profile of a 1.4 m lane at a few cruise speeds, and how fast cached lookups are
+if __name__ == '__main__':
+    for speed in (0.15, 0.2, 0.25, 0.3):
+        profile = velocity_profile(1.4, velocity=speed)
+        print(profile)
+    print(velocity_profile(math.pi/2, ANGULAR_LIMITS, velocity=0.5))
+    n = 10000
+    t_start = time.perf_counter()
+    for i in range(n):
+        velocity_profile(1.4, velocity=0.25).command(0.01*i % 2.0, 1.4 - 0.001*i % 1.4)
+    print(f'{1e6*(time.perf_counter() - t_start)/n:.1f} us per cached lookup, {profile_cache_info()}')
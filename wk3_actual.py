@@ -3,6 +3,7 @@ import roslibpy
 import pygame
 from lights_function import play_lights
 import threading
+from cmd_vel import TwistPublisher
 
 # Initialize pygame and joystick control
 pygame.init()
@@ -102,6 +103,7 @@ class RobotController:
         # ROS publishers
         self.led_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_lightring', 'irobot_create_msgs/LightringLeds')
         self.drive_pub = roslibpy.Topic(ros_node, f'/{robot_name}/cmd_vel', 'geometry_msgs/Twist')
+        self.cmd_vel = TwistPublisher(self.drive_pub)
 
         # Create and start threads
         self.drive_thread = threading.Thread(target=self.drive, daemon=True)
@@ -111,18 +113,9 @@ class RobotController:
 
     def drive(self):
         while not self.stop_event.is_set():
-            drive_message = {
-                "linear": {"x": self.joystick.linear_x, "y": 0.0, "z": 0.0},
-                "angular": {"x": 0.0, "y": 0.0, "z": self.joystick.angular_z}
-            }
-            self.drive_pub.publish(roslibpy.Message(drive_message))
+            self.cmd_vel.publish(self.joystick.linear_x, self.joystick.angular_z)
             time.sleep(0.1)  # 10Hz
-            if self.joystick.armed == False:
-                drive_message = {
-                "linear": {"x": self.joystick.linear_x, "y": 0.0, "z": 0.0},
-                "angular": {"x": 0.0, "y": 0.0, "z": self.joystick.angular_z}
-            }
-            self.drive_pub.publish(roslibpy.Message(drive_message))
+            self.cmd_vel.publish(self.joystick.linear_x, self.joystick.angular_z)
             time.sleep(0.1)  # 10Hz
 
     def leds(self):
@@ -143,7 +136,7 @@ class RobotController:
 
     def cleanup(self):
         play_lights(ros_node, robot_name, 'Off')
-        self.drive_pub.publish(roslibpy.Message({"linear": {"x": 0.0, "y": 0.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.0}}))
+        self.cmd_vel.stop()
         self.led_pub.unadvertise()
         self.drive_pub.unadvertise()
 